@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+Offline benchmark of the grab/list/download flow against a local stand-in of the packtpub.com pages.
+Every scenario runs in its own process, so its peak memory usage is measured separately.
+
+    python benchmark.py --titles 10 1000 10000 --downloads 20 --size 1024 --latency 20 --engine requests asyncio
+"""
+from __future__ import (absolute_import, division, print_function, unicode_literals)
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:# python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+try:
+    import resource
+except ImportError:# windows
+    resource = None
+
+SESSION_COOKIE = 'SESS_BENCH=logged-in'
+BLOCK = bytes(bytearray(range(256))) * 256# 64 KB
+DOWNLOAD_URL_PATTERN = re.compile(r'^/(ebook|code)_download/(\d+)(/\w+)?$')
+RANGE_PATTERN = re.compile(r'^bytes=(\d+)-$')
+CONFIG_TEMPLATE = """[LOGIN_DATA]
+email= bench@example.com
+password= bench
+sessionCacheFilePath:
+
+[DOWNLOAD_DATA]
+downloadFolderPath: {downloadFolderPath}
+downloadFormats: pdf
+ebookExtraInfoLogFilePath: eBookMetadata.log
+downloadWorkers: {workers}
+downloadWorkersPerHost: {workers}
+httpEngine: {engine}
+httpRequestsPerSecond: 0
+"""
+# libraries which should be imported only by the commands using them
+HEAVY_MODULES = ('requests', 'bs4', 'lxml', 'aiohttp', 'apiclient', 'googleapiclient', 'oauth2client', 'httplib2')
+IMPORT_TIME_PATTERN = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+####################################-PACKTPUB STAND-IN-############################################
+
+def get_my_books_page(nr_of_titles):
+    """Account page listing nr_of_titles books, each one with markup similar to the real page"""
+    lines = ['<html><head><title>My eBooks</title></head><body><div id="account-right-content">']
+    for i in range(nr_of_titles):
+        nid = 10000 + i
+        lines.append(
+            '<div class="product-line unseen" title="Benchmark Book {i} [eBook]" nid="{nid}">'
+            '<div class="product-thumbnail"><a href="/application-development/benchmark-book-{i}">'
+            '<img src="//cdn.example.com/{nid}.png" alt="Benchmark Book {i}"/></a></div>'
+            '<div class="product-info"><div class="title">Benchmark Book {i} [eBook]</div>'
+            '<div class="author">Author {i}</div><div class="date">01 Jan 2017</div></div></div>'
+            '<div class="product-buttons-line toggle"><div class="download-container cf">'
+            '<a href="/ebook_download/{nid}/pdf"><div class="download-container-button">PDF</div></a>'
+            '<a href="/ebook_download/{nid}/epub"><div class="download-container-button">ePub</div></a>'
+            '<a href="/ebook_download/{nid}/mobi"><div class="download-container-button">Mobi</div></a>'
+            '<a href="/code_download/{code}"><div class="download-container-button">Code</div></a>'
+            '</div></div>'.format(i=i, nid=nid, code=20000 + i))
+    lines.append('</div></body></html>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True# headers and body are written separately, don't let them wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        pass
+
+    def __send(self, body, status=200, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __is_logged_in(self):
+        return SESSION_COOKIE in (self.headers.get('Cookie') or '')
+
+    def do_POST(self):
+        time.sleep(self.server.latency)
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.startswith('/register'):
+            self.__send(b'<html><body>Welcome</body></html>', headers={'Set-Cookie': SESSION_COOKIE + '; Path=/'})
+        else:
+            self.__send(b'', status=404)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        path = self.path.split('?')[0]
+        if path == '/register':
+            self.__send(b'<html><body><form id="packt-user-login-form">'
+                        b'<input type="hidden" name="form_build_id" value="form-benchmark"/></form></body></html>')
+        elif path == '/account/my-ebooks':
+            if self.__is_logged_in():
+                self.__send(self.server.my_books_page)
+            else:
+                self.__send(b'<html><body><div class="register-page-form"></div></body></html>')
+        elif path == '/packt/offers/free-learning':
+            self.__send(b'<html><body><div class="dotd-main-book-image">'
+                        b'<a href="/application-development/benchmark-book-0"><img/></a></div>'
+                        b'<div class="dotd-title"><h2>Benchmark Book 0</h2></div>'
+                        b'<a class="twelve-days-claim" href="/freelearning-claim/10000/21478">Claim</a></body></html>')
+        elif path.startswith('/freelearning-claim/'):
+            self.__send(b'<html><body>My eBooks</body></html>')
+        elif path.startswith('/application-development/'):
+            self.__send(b'<html><body><div class="book-top-block-info-one-liner">Benchmark book</div>'
+                        b'<div class="book-top-block-info-authors">Author 0\n</div><time>01 Jan 2017</time>'
+                        b'<div class="book-top-block-code"><a href="/code_download/20000">Code</a></div></body></html>')
+        elif DOWNLOAD_URL_PATTERN.match(path):
+            self.__send_file()
+        else:
+            self.__send(b'', status=404)
+
+    def __send_file(self):
+        size = self.server.file_size
+        offset = 0
+        m = RANGE_PATTERN.match(self.headers.get('Range') or '')
+        if m:
+            offset = int(m.group(1))
+            if offset >= size:
+                return self.__send(b'', status=416, headers={'Content-Range': 'bytes */{}'.format(size)})
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(offset, size - 1, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size - offset))
+        self.end_headers()
+        left = size - offset
+        while left > 0:
+            block = BLOCK[:min(left, len(BLOCK))]
+            self.wfile.write(block)
+            left -= len(block)
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """Serves synthetic register, free-learning, my-ebooks and *_download pages on localhost"""
+    daemon_threads = True
+
+    def __init__(self, nr_of_titles=10, file_size=1024 * 1024, latency=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.file_size = file_size
+        self.latency = latency
+        self.set_nr_of_titles(nr_of_titles)
+
+    def set_nr_of_titles(self, nr_of_titles):
+        self.my_books_page = get_my_books_page(nr_of_titles)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+
+####################################-SCENARIOS-############################################
+
+def get_peak_rss_mb():
+    """Peak resident memory of this process in MB, None if it cannot be measured"""
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak_rss / 1024.0# bytes on macOS, KB elsewhere
+
+
+def run_scenario(scenario):
+    """Runs the flow against the stand-in server at scenario['url'], returns the measured values"""
+    import logging
+    import packtPublishingFreeEbook as app
+    from utils.metrics import metrics
+    logging.disable(logging.INFO)# SUCCESS level is below INFO, only warnings and errors are left
+    account_data = app.PacktAccountDataModel(scenario['cfgFilePath'])
+    account_data.packtPubUrl = scenario['url']
+    account_data.myBooksUrl = scenario['url'] + '/account/my-ebooks'
+    account_data.loginUrl = scenario['url'] + '/register'
+    account_data.freeLearningUrl = scenario['url'] + '/packt/offers/free-learning'
+    result = {}
+    start = time.time()
+    session = app.PacktPubHttpSession(account_data)
+    result['login'] = time.time() - start
+    start = time.time()
+    grabber = app.BookGrabber(session)
+    grabber.grabEbook()
+    grabber.getEbookInfoData(None)
+    result['grab'] = time.time() - start
+    downloader = app.BookDownloader(session)
+    downloader.showProgress = False
+    metrics.reset()
+    downloader.getDataOfAllMyBooks()
+    phases = metrics.get_phases()# the account page fetch and its parsing are timed separately
+    result['fetch'] = phases['list_books_fetch']['seconds']
+    result['parse'] = phases['list_books_parse']['seconds']
+    titles = [book['title'] for book in downloader.bookData[:scenario['downloads']]]
+    start = time.time()
+    downloaded = downloader.downloadBooks(titles, formats=('pdf',)) if titles else 0
+    result['download'] = time.time() - start
+    result['downloaded'] = downloaded
+    result['throughput'] = downloaded * scenario['size'] / 1048576.0 / result['download'] if downloaded else 0.0
+    result['peakRss'] = get_peak_rss_mb()
+    return result
+
+
+def run_scenario_process(server, scenario):
+    """Runs the scenario in a new process working in a temporary directory (config, downloads and logs)"""
+    work_dir = tempfile.mkdtemp(prefix='packt-benchmark-')
+    try:
+        download_folder_path = os.path.join(work_dir, 'downloads')
+        os.mkdir(download_folder_path)
+        cfg_file_path = os.path.join(work_dir, 'configFile.cfg')
+        with open(cfg_file_path, 'w') as f:
+            f.write(CONFIG_TEMPLATE.format(downloadFolderPath=download_folder_path, workers=scenario['workers'],
+                                           engine=scenario['engine']))
+        server.set_nr_of_titles(scenario['titles'])
+        scenario = dict(scenario, url=server.url, cfgFilePath=cfg_file_path, size=server.file_size)
+        src_path = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([src_path] + [os.environ.get('PYTHONPATH', '')]))
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--scenario', json.dumps(scenario)],
+                                         cwd=work_dir, env=env)
+        # log records written out at exit might follow the result
+        return json.loads([line for line in output.decode('utf-8').splitlines() if line.startswith('{')][-1])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+####################################-STARTUP-############################################
+
+def get_imported_modules(args, cwd):
+    """Runs python with -X importtime (python 3.7+) and returns {module: self import time in us}"""
+    process = subprocess.Popen([sys.executable, '-X', 'importtime'] + args, cwd=cwd,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    modules = {}
+    for line in stderr.decode('utf-8', 'replace').splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match:
+            modules[match.group(4)] = int(match.group(1))
+    return modules
+
+
+def measure_startup(target):
+    """
+    Measures imports made by 'packtPublishingFreeEbook.py --check' on top of the bare interpreter ones.
+    :param target: allowed import time in ms
+    :return: True if the import time is within the target and no heavy library has been imported
+    """
+    work_dir = tempfile.mkdtemp(prefix='packt-benchmark-')
+    try:
+        with open(os.path.join(work_dir, 'configFile.cfg'), 'w') as f:
+            f.write(CONFIG_TEMPLATE.format(downloadFolderPath=work_dir, workers=1, engine='requests'))
+        script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'packtPublishingFreeEbook.py')
+        bare_modules = get_imported_modules(['-c', 'pass'], work_dir)
+        start = time.time()
+        modules = get_imported_modules([script_path, '--check'], work_dir)
+        run_time = time.time() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not modules:
+        print("No import times reported, python 3.7+ is required")
+        return False
+    import_time = sum(us for module, us in modules.items() if module not in bare_modules) / 1000.0
+    heavy_modules = sorted(set(module.split('.')[0] for module in modules) & set(HEAVY_MODULES))
+    slowest = sorted((module for module in modules if module not in bare_modules), key=modules.get, reverse=True)[:5]
+    print("'--check' run time: {:.0f} ms, import time: {:.1f} ms (target {:.0f} ms)".format(run_time * 1000,
+                                                                                         import_time, target))
+    print("Slowest imports: {}".format(', '.join('{} {:.1f} ms'.format(m, modules[m] / 1000.0) for m in slowest)))
+    if heavy_modules:
+        print("Heavy libraries imported: {}".format(', '.join(heavy_modules)))
+    return import_time <= target and not heavy_modules
+
+
+def format_row(values):
+    return ' '.join('{:>12}'.format(value) for value in values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the script against a local packtpub stand-in")
+    parser.add_argument("-t", "--titles", help="numbers of titles on the account page, one scenario for each",
+                        type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument("-d", "--downloads", help="number of books downloaded in every scenario", type=int, default=20)
+    parser.add_argument("-s", "--size", help="size of every downloaded file in KB", type=int, default=1024)
+    parser.add_argument("-l", "--latency", help="latency of every response in ms", type=float, default=0.0)
+    parser.add_argument("-w", "--workers", help="numbers of simultaneous downloads, one scenario for each",
+                        type=int, nargs='+', default=[1])
+    parser.add_argument("-e", "--engine", help="http engines, one scenario for each", nargs='+',
+                        choices=('requests', 'asyncio'), default=['requests'])
+    parser.add_argument("--json", help="writes the results into the given file", default=None)
+    parser.add_argument("--startup", help="measures imports of '--check' command instead, fails if they take longer "
+                                          "than the given number of ms or load a heavy library", type=float, default=None)
+    parser.add_argument("--scenario", help=argparse.SUPPRESS, default=None)
+    args = parser.parse_args()
+
+    if args.startup is not None:
+        sys.exit(0 if measure_startup(args.startup) else 1)
+
+    if args.scenario is not None:# child process
+        print(json.dumps(run_scenario(json.loads(args.scenario))))
+        return
+
+    server = StandInServer(file_size=args.size * 1024, latency=args.latency / 1000.0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    print(format_row(['titles', 'engine', 'workers', 'login [s]', 'grab [s]', 'fetch [s]', 'parse [s]',
+                      'download [s]', 'MB/s', 'peak RSS [MB]']))
+    results = []
+    try:
+        for titles, engine, workers in itertools.product(args.titles, args.engine, args.workers):
+            scenario = {'titles': titles, 'engine': engine, 'workers': workers, 'downloads': args.downloads}
+            result = run_scenario_process(server, scenario)
+            results.append(dict(scenario, **result))
+            print(format_row([titles, engine, workers, '{:.3f}'.format(result['login']), '{:.3f}'.format(result['grab']),
+                              '{:.3f}'.format(result['fetch']), '{:.3f}'.format(result['parse']),
+                              '{:.3f}'.format(result['download']),
+                              '{:.1f}'.format(result['throughput']),
+                              '{:.1f}'.format(result['peakRss']) if result['peakRss'] is not None else '-']))
+    finally:
+        server.shutdown()
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'size': args.size * 1024, 'latency': args.latency, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
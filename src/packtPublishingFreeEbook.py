@@ -1,20 +1,31 @@
 #!/usr/bin/env python
 from __future__ import (absolute_import, division, print_function, unicode_literals)
 
-import requests
 import os
 import configparser
 import argparse
 import re
 import sys
+import json
+import time
+import threading
+from bisect import bisect_left
 from collections import OrderedDict
-from bs4 import BeautifulSoup
 
 from utils import *
+from utils import transfer
+from utils.integrity import Checksums
+from utils.metrics import metrics
+from utils.page_cache import PageCache
 logger = log_manager.get_logger(__name__)
 # downgrading logging level for requests
 logging.getLogger("requests").setLevel(logging.WARNING)
 
+EBOOK_TITLE_SUFFIX_PATTERN = re.compile(r'\s*\[e\w+\]\s*', flags=re.I)
+BOOK_LINE_CLASS_PATTERN = re.compile(r'(^|\s)product-(buttons-)?line(\s|$)')# matches both raw and already split class values
+DOWNLOAD_URL_PATTERN = re.compile(r'^(/[a-zA-Z]+_download/(\w+)(/(\w+))*)')
+HTTP_ENGINES = ('requests', 'asyncio')
+
 
 #################################-MAIN CLASSES-###########################################
 class PacktAccountDataModel(object):
@@ -34,7 +45,12 @@ class PacktAccountDataModel(object):
                            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 '
                                          '(KHTML, like Gecko) Chrome/51.0.2704.103 Safari/537.36'}
         self.myPacktEmail, self.myPacktPassword = self.__getConfigLoginData()
+        self.sessionCacheFilePath = self.__getConfigSessionCacheFilePath()
         self.downloadFolderPath, self.downloadFormats, self.downloadBookTitles = self.__getConfigDownloadData()
+        self.downloadWorkers, self.downloadWorkersPerHost = self.__getConfigDownloadWorkers()
+        self.libraryIndexFilePath = self.__getConfigLibraryIndexFilePath()
+        self.httpEngine = self.__getConfigHttpEngine()
+        self.httpRetries, self.httpRequestsPerSecond = self.__getConfigHttpRetries()
         if not os.path.exists(self.downloadFolderPath):
             message = "Download folder path: '{}' doesn't exist".format(self.downloadFolderPath)
             logger.error(message)
@@ -50,6 +66,14 @@ class PacktAccountDataModel(object):
         password = self.configuration.get("LOGIN_DATA", 'password')
         return email, password
 
+    def __getConfigSessionCacheFilePath(self):
+        """Gets the path of the file storing cookies of the logged in session, None if caching is disabled."""
+        try:
+            sessionCacheFilePath = self.configuration.get("LOGIN_DATA", 'sessionCacheFilePath').strip()
+            return os.path.join(os.path.dirname(self.cfgFilePath), sessionCacheFilePath) if sessionCacheFilePath else None
+        except configparser.Error as e:
+            return os.path.splitext(self.cfgFilePath)[0] + '.session'
+
     def __getConfigDownloadData(self):
         """Downloads ebook data from the user account."""
         downloadPath = self.configuration.get("DOWNLOAD_DATA", 'downloadFolderPath')
@@ -65,6 +89,54 @@ class PacktAccountDataModel(object):
             pass
         return downloadPath, downloadFormats, downloadBookTitles
 
+    def __getConfigDownloadWorkers(self):
+        """Gets the number of simultaneous downloads (all in total and per single host)."""
+        downloadWorkers = 1
+        downloadWorkersPerHost = transfer.DEFAULT_WORKERS_PER_HOST
+        try:
+            downloadWorkers = max(1, self.configuration.getint("DOWNLOAD_DATA", 'downloadWorkers'))
+        except (configparser.Error, ValueError) as e:
+            pass
+        try:
+            downloadWorkersPerHost = max(1, self.configuration.getint("DOWNLOAD_DATA", 'downloadWorkersPerHost'))
+        except (configparser.Error, ValueError) as e:
+            pass
+        return downloadWorkers, downloadWorkersPerHost
+
+    def __getConfigLibraryIndexFilePath(self):
+        """Gets the path of the local library index database, None if the index is not used."""
+        try:
+            libraryIndexFilePath = self.configuration.get("DOWNLOAD_DATA", 'libraryIndexFilePath').strip()
+            return os.path.join(os.path.dirname(self.cfgFilePath), libraryIndexFilePath) if libraryIndexFilePath else None
+        except configparser.Error as e:
+            return None
+
+    def __getConfigHttpEngine(self):
+        """Gets the engine making http requests: 'requests' (default) or 'asyncio' (requires aiohttp)."""
+        try:
+            httpEngine = self.configuration.get("DOWNLOAD_DATA", 'httpEngine').strip().lower()
+        except configparser.Error as e:
+            return HTTP_ENGINES[0]
+        if httpEngine not in HTTP_ENGINES:
+            message = "Unknown http engine: '{}', use one of: {}".format(httpEngine, ', '.join(HTTP_ENGINES))
+            logger.error(message)
+            raise ValueError(message)
+        return httpEngine
+
+    def __getConfigHttpRetries(self):
+        """Gets the number of retries of a failed request and the limit of requests sent per second to a host (0 - none)."""
+        httpRetries = 4
+        httpRequestsPerSecond = 10.0
+        try:
+            httpRetries = max(0, self.configuration.getint("DOWNLOAD_DATA", 'httpRetries'))
+        except (configparser.Error, ValueError) as e:
+            pass
+        try:
+            httpRequestsPerSecond = max(0.0, self.configuration.getfloat("DOWNLOAD_DATA", 'httpRequestsPerSecond'))
+        except (configparser.Error, ValueError) as e:
+            pass
+        return httpRetries, httpRequestsPerSecond
+
     @staticmethod
     def convertBookTitleToValidString(title):
         """removes all unicodes and chars only valid in pathnames on Linux/Windows OS"""
@@ -75,9 +147,26 @@ class PacktAccountDataModel(object):
 class PacktPubHttpSession(object):
     """Responsible for creating a http session and logs int your account"""    
     
-    def __init__(self, accountConfigData):
+    def __init__(self, accountConfigData, httpAdapter=None):
+        """
+        :param httpAdapter: requests.adapters.HTTPAdapter whose connection pool is used instead of a new one, e.g. to
+                            share it with sessions of other accounts (the 'requests' engine only)
+        """
         self.accountConfig = accountConfigData
-        self.session = self.__createHttpSession()
+        self.httpAdapter = httpAdapter
+        self.session = self.__newHttpSession()
+        self.pageCache = PageCache()
+        try:
+            with metrics.span('session_restore'):
+                restored = self.__restoreHttpSession(self.session)
+            if not restored:
+                self.session.cookies.clear()
+                with metrics.span('login'):
+                    self.__createHttpSession(self.session)
+                self.__storeHttpSession()
+        except Exception:
+            self.close()# nobody else gets hold of a session failed to log in
+            raise
 
     def getCurrentConfig(self):
         return self.accountConfig
@@ -85,8 +174,102 @@ class PacktPubHttpSession(object):
     def getCurrentHttpSession(self):
         return self.session
 
-    def __createHttpSession(self):
-        """Creates the http session"""
+    def hasExpired(self):
+        """Checks if any cookie of the session has expired, a long lived session has to be logged in again then"""
+        now = time.time()
+        return any(cookie.expires is not None and cookie.expires <= now for cookie in self.session.cookies)
+
+    def close(self):
+        """
+        Closes the http session, the asyncio engine stops its event loop thread then. The connection pool of
+        a shared httpAdapter is left open for the sessions of the other accounts.
+        """
+        if self.httpAdapter is None or self.accountConfig.httpEngine == 'asyncio':
+            self.session.close()
+
+    def getPage(self, url, timeout=10):
+        """Gets the page with GET, a page fetched already is served from the cache or revalidated (see PageCache)"""
+        return self.pageCache.get(self.session, url, headers=self.accountConfig.reqHeaders, timeout=timeout)
+
+    def __newHttpSession(self):
+        """Creates an empty http session of the configured engine, failed requests are retried by its transport"""
+        from utils.transport import RetryPolicy, RetryingHTTPAdapter
+        retryPolicy = RetryPolicy(self.accountConfig.httpRetries, self.accountConfig.httpRequestsPerSecond)
+        if self.accountConfig.httpEngine == 'asyncio':
+            from utils.aio import AsyncHttpSession
+            return AsyncHttpSession(retryPolicy)
+        import requests
+        session = requests.Session()
+        httpAdapter = RetryingHTTPAdapter(retryPolicy, pool_adapter=self.httpAdapter)
+        session.mount('https://', httpAdapter)
+        session.mount('http://', httpAdapter)
+        return session
+
+    def __isLoggedIn(self, session):
+        """Checks if the session is still logged in, reading the account page only until the login form shows up"""
+        r = session.get(self.accountConfig.myBooksUrl, headers=self.accountConfig.reqHeaders, timeout=10,
+                        stream=True, allow_redirects=False)
+        try:
+            if r.status_code != 200:
+                return False
+            tail = ''
+            for chunk in r.iter_content(chunk_size=16384, decode_unicode=True):
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode('utf-8', 'replace')
+                if (tail + chunk).find("register-page-form") != -1:
+                    return False
+                tail = chunk[-len("register-page-form"):]
+            return True
+        finally:
+            r.close()
+
+    def __restoreHttpSession(self, session):
+        """Restores the cookies stored by the previous run into the session, returns False if they are no longer valid"""
+        cacheFilePath = self.accountConfig.sessionCacheFilePath
+        if cacheFilePath is None or not os.path.isfile(cacheFilePath):
+            return False
+        import requests
+        try:
+            with open(cacheFilePath, 'r') as f:
+                cachedData = json.load(f)
+            if cachedData['email'] != self.accountConfig.myPacktEmail:
+                return False
+            now = time.time()
+            cookies = [cookie for cookie in cachedData['cookies'] if cookie['expires'] is None or cookie['expires'] > now]
+            if len(cookies) == 0:
+                return False
+            for cookie in cookies:
+                session.cookies.set_cookie(requests.cookies.create_cookie(**cookie))
+            if not self.__isLoggedIn(session):
+                logger.info("Stored session has expired")
+                return False
+        except Exception as e:
+            logger.debug("Cannot restore the stored session: {}".format(e))
+            return False
+        logger.info("Session restored, logged in successfully!")
+        return True
+
+    def __storeHttpSession(self):
+        """Stores cookies of the logged in session in a file readable only by the owner"""
+        cacheFilePath = self.accountConfig.sessionCacheFilePath
+        if cacheFilePath is None:
+            return
+        cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+                    'expires': cookie.expires, 'secure': cookie.secure,
+                    'rest': {'HttpOnly': None} if cookie.has_nonstandard_attr('HttpOnly') else {}}
+                   for cookie in self.session.cookies]
+        try:
+            fd = os.open(cacheFilePath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.chmod(cacheFilePath, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'email': self.accountConfig.myPacktEmail, 'cookies': cookies}, f)
+        except (IOError, OSError) as e:
+            logger.error("Cannot store the session in '{}': {}".format(cacheFilePath, e))
+
+    def __createHttpSession(self, session):
+        """Logs the http session in"""
+        import requests
+        from bs4 import BeautifulSoup
         formData = {'email': self.accountConfig.myPacktEmail,
                     'password': self.accountConfig.myPacktPassword,
                     'op': 'Login',
@@ -94,12 +277,11 @@ class PacktPubHttpSession(object):
                     'form_id': 'packt_user_login_form'}
         # to get form_build_id
         logger.info("Creating session...")
-        rGet = requests.get(self.accountConfig.loginUrl, headers=self.accountConfig.reqHeaders, timeout=10)
+        rGet = session.get(self.accountConfig.loginUrl, headers=self.accountConfig.reqHeaders, timeout=10)
         content = BeautifulSoup(str(rGet.content), 'html.parser')
         formBuildId = [element['value'] for element in
                        content.find(id='packt-user-login-form').find_all('input', {'name': 'form_build_id'})]
         formData['form_build_id'] = formBuildId[0]
-        session = requests.Session()
         rPost = session.post(self.accountConfig.loginUrl, headers=self.accountConfig.reqHeaders, data=formData)
         #check once again if we are really logged into the server
         rGet = session.get(self.accountConfig.myBooksUrl, headers=self.accountConfig.reqHeaders, timeout=10)
@@ -108,42 +290,61 @@ class PacktPubHttpSession(object):
             logger.error(message)
             raise requests.exceptions.RequestException(message)
         logger.info("Session created, logged in successfully!")
-        return session
 
 
 class BookGrabber(object):
     """Claims (grabs) a free daily ebook, retrieving its title"""
 
     def __init__(self, currentSession):
+        self.currentSession = currentSession
         self.session = currentSession.getCurrentHttpSession()
         self.accountData = currentSession.getCurrentConfig()
         self.bookTitle = ""
+        self.freeLearningData = None
+
+    def __getFreeLearningData(self):
+        """Gets the claim url, title and book page url of the daily ebook, the page is fetched and parsed once per run"""
+        import requests
+        from bs4 import BeautifulSoup
+        if self.freeLearningData is None:
+            r = self.currentSession.getPage(self.accountData.freeLearningUrl)
+            if r.status_code != 200:
+                raise requests.exceptions.RequestException("http GET status code != 200")
+            html = BeautifulSoup(r.text, 'html.parser')
+            self.freeLearningData = {
+                'claimUrl': html.find(attrs={'class': 'twelve-days-claim'})['href'],
+                'title': PacktAccountDataModel.convertBookTitleToValidString(
+                    html.find('div', {'class': 'dotd-title'}).find('h2').next_element),
+                'bookUrl': html.find('div', {'class': 'dotd-main-book-image'}).find('a').attrs['href']}
+        return self.freeLearningData
 
     def __writeEbookInfoData(self, data):
         """
-        Write result to file
+        Write result to file, a SQLite store if its name ends with .sqlite or .db, a plain text log otherwise
         :param data: the data to be written down
         """
-        with open(self.accountData.bookInfoDataLogFile, "a") as output:
-            output.write('\n')
-            for key, value in data.items():
-                output.write('{} --> {}\n'.format(key.upper(), value))
+        from utils import metadata
+        if metadata.is_store_file(self.accountData.bookInfoDataLogFile):
+            with metadata.MetadataStore(self.accountData.bookInfoDataLogFile) as store:
+                store.add(data)
+        else:
+            with open(self.accountData.bookInfoDataLogFile, "a") as output:
+                output.write('\n')
+                for key, value in data.items():
+                    output.write('{} --> {}\n'.format(key.upper(), value))
         logger.info("Complete information for '{}' have been saved".format(data["title"]))
 
+    @metrics.timed('book_info')
     def getEbookInfoData(self, r):
         """
         Log grabbed book information to log file
         :param r: the previous response got when book has been successfully added to user library
         :return: the data ready to be written to the log file
         """
+        from bs4 import BeautifulSoup
         logger.info("Retrieving complete information for '{}'".format(self.bookTitle))
-        r = self.session.get(self.accountData.freeLearningUrl,
-                             headers=self.accountData.reqHeaders, timeout=10)
-        resultHtml = BeautifulSoup(r.text, 'html.parser')
-        lastGrabbedBook = resultHtml.find('div', {'class': 'dotd-main-book-image'})
-        bookUrl = lastGrabbedBook.find('a').attrs['href']
-        bookPage = self.session.get(self.accountData.packtPubUrl + bookUrl,
-                                    headers=self.accountData.reqHeaders, timeout=10).text
+        bookUrl = self.__getFreeLearningData()['bookUrl']
+        bookPage = self.currentSession.getPage(self.accountData.packtPubUrl + bookUrl).text
         page = BeautifulSoup(bookPage, 'html.parser')
 
         resultData = OrderedDict()
@@ -159,16 +360,14 @@ class BookGrabber(object):
         self.__writeEbookInfoData(resultData)
         return resultData
 
+    @metrics.timed('grab')
     def grabEbook(self, logEbookInfodata = False):
         """Grabs the ebook"""
+        import requests
         logger.info("Start grabbing eBook...")
-        r = self.session.get(self.accountData.freeLearningUrl,
-                             headers=self.accountData.reqHeaders, timeout=10)
-        if r.status_code is not 200:
-            raise requests.exceptions.RequestException("http GET status code != 200")
-        html = BeautifulSoup(r.text, 'html.parser')
-        claimUrl = html.find(attrs={'class': 'twelve-days-claim'})['href']
-        self.bookTitle = PacktAccountDataModel.convertBookTitleToValidString(html.find('div', {'class': 'dotd-title'}).find('h2').next_element)
+        freeLearningData = self.__getFreeLearningData()
+        claimUrl = freeLearningData['claimUrl']
+        self.bookTitle = freeLearningData['title']
         r = self.session.get(self.accountData.packtPubUrl + claimUrl,
                              headers=self.accountData.reqHeaders, timeout=10)
         if r.status_code is 200 and r.text.find('My eBooks') != -1:
@@ -183,36 +382,145 @@ class BookGrabber(object):
 
 class BookDownloader(object):
     """Downloads already claimed ebooks from your account"""
+    htmlParser = None
 
     def __init__(self, currentSession):
         self.session = currentSession.getCurrentHttpSession()
         self.accountData = currentSession.getCurrentConfig()
+        self.bookData = []
+        self.bookTitleIndex = {}
+        self.__sortedTitleKeys = []
+        self.showProgress = sys.stdout.isatty()
+        self.libraryIndex = None
+        if self.accountData.libraryIndexFilePath is not None:
+            from utils.library import LibraryIndex
+            self.libraryIndex = LibraryIndex(self.accountData.libraryIndexFilePath,
+                                             PacktAccountDataModel.convertBookTitleToValidString)
+
+    def close(self):
+        """Closes the library index"""
+        if self.libraryIndex is not None:
+            self.libraryIndex.close()
+            self.libraryIndex = None
+
+    def getDataOfMyBooksFromIndex(self, titles):
+        """
+        Gets data of the chosen ebooks from the local library index instead of the account page.
+        :return: True if all the titles have been found in the index, False if titles is None (all the books are needed)
+        """
+        if self.libraryIndex is None or titles is None:
+            return False
+        self.bookData = self.libraryIndex.find_books_by_titles(titles)
+        self.__buildTitleIndex()
+        return all(titleKey in self.bookTitleIndex for titleKey in self.__getTitleKeys(titles))
+
+    @staticmethod
+    def __getTitleKey(title):
+        return PacktAccountDataModel.convertBookTitleToValidString(title).lower()
+
+    @classmethod
+    def __getTitleKeys(cls, titles):
+        """Keys of the titles, empty ones (e.g. left by a trailing comma) are dropped, they would match every book"""
+        return [titleKey for titleKey in (cls.__getTitleKey(title) for title in titles) if titleKey]
+
+    def __buildTitleIndex(self):
+        """Normalizes every title once and indexes the books by it"""
+        self.bookTitleIndex = {}
+        for book in self.bookData:
+            book['normalizedTitle'] = PacktAccountDataModel.convertBookTitleToValidString(book['title'])
+            self.bookTitleIndex.setdefault(book['normalizedTitle'].lower(), []).append(book)
+        self.__sortedTitleKeys = sorted(self.bookTitleIndex)
+
+    def __findBooksByTitlePrefix(self, titleKey):
+        """Returns books whose title starts with the given one, if it is not ambiguous"""
+        matchingKeys = []
+        for key in self.__sortedTitleKeys[bisect_left(self.__sortedTitleKeys, titleKey):]:
+            if not key.startswith(titleKey):
+                break
+            matchingKeys.append(key)
+        if len(matchingKeys) == 1:
+            logger.info("Title: '{}' matched by its beginning: '{}'".format(titleKey, matchingKeys[0]))
+            return self.bookTitleIndex[matchingKeys[0]]
+        if len(matchingKeys) > 1:
+            logger.info("Title: '{}' is ambiguous, it might be one of: {}".format(titleKey, ', '.join(matchingKeys)))
+        return []
+
+    def findBooksByTitles(self, titles):
+        """
+        Finds books by their titles, compared in the normalized, case insensitive form.
+        A title with no exact match is looked up as the beginning of the book titles.
+        """
+        foundBookIds = set()
+        for titleKey in self.__getTitleKeys(titles):
+            books = self.bookTitleIndex.get(titleKey)
+            if books is None:
+                books = self.__findBooksByTitlePrefix(titleKey)
+            foundBookIds.update(book['id'] for book in books)
+        return [book for book in self.bookData if book['id'] in foundBookIds]
+
+    @classmethod
+    def __getHtmlParser(cls):
+        """lxml is much faster than the pure python parser for big account pages, it is used if available"""
+        if cls.htmlParser is None:
+            cls.htmlParser = 'lxml' if isModuleAvailable('lxml') else 'html.parser'
+        return cls.htmlParser
 
     def getDataOfAllMyBooks(self):
         """Gets data from all available ebooks"""
+        import requests
+        from bs4 import BeautifulSoup, SoupStrainer
         logger.info("Getting data of all your books...")
-        r = self.session.get(self.accountData.myBooksUrl,
-                             headers=self.accountData.reqHeaders, timeout=10)
+        with metrics.span('list_books_fetch') as span:
+            r = self.session.get(self.accountData.myBooksUrl,
+                                 headers=self.accountData.reqHeaders, timeout=10)
+            span.bytes = len(r.content)
         if r.status_code is not 200:
             message = "Cannot open {}, http GET status code != 200".format(self.accountData.myBooksUrl)
             logger.error(message)
             raise requests.exceptions.RequestException(message)
         logger.info("Opened '{}' successfully!".format(self.accountData.myBooksUrl))
 
-        myBooksHtml = BeautifulSoup(r.text, 'html.parser')
-        all = myBooksHtml.find(id='product-account-list').find_all('div', {'class': 'product-line unseen'})
-        self.bookData = [{'title': re.sub(r'\s*\[e\w+\]\s*', '', attr['title'], flags=re.I).strip(' '), # remove '[eBook]' from the title
-                          'id': attr['nid']} for attr in all]
-        for i, div in enumerate(myBooksHtml.find_all('div', {'class': 'product-buttons-line toggle'})):
-            downloadUrls = {}
-            for a_href in div.find_all('a'):
-                m = re.match(r'^(/[a-zA-Z]+_download/(\w+)(/(\w+))*)', a_href.get('href'))# extract the download link from href like: "/ebook_download/20892/pdf"
-                if m:
-                    if m.group(4) is not None:
-                        downloadUrls[m.group(4)] = m.group(0)
-                    else:
-                        downloadUrls['code'] = m.group(0)
-            self.bookData[i]['downloadUrls'] = downloadUrls
+        with metrics.span('list_books_parse'):
+            # build only book lines and their download buttons, walking them in document order keeps the two in pairs
+            onlyBookLines = SoupStrainer('div', attrs={'class': BOOK_LINE_CLASS_PATTERN})
+            myBooksHtml = BeautifulSoup(r.text, self.__getHtmlParser(), parse_only=onlyBookLines)
+            self.bookData = []
+            currentBook = None# book the following buttons line belongs to, None after a skipped book line
+            for div in myBooksHtml.find_all('div', attrs={'class': BOOK_LINE_CLASS_PATTERN}):
+                if 'product-line' in div['class']:
+                    currentBook = None
+                    if div.get('nid') is not None and div.get('title') is not None:
+                        currentBook = {'title': EBOOK_TITLE_SUFFIX_PATTERN.sub('', div['title']).strip(' '), # remove '[eBook]' from the title
+                                       'id': div['nid'],
+                                       'downloadUrls': {}}
+                        self.bookData.append(currentBook)
+                elif currentBook is not None:
+                    downloadUrls = currentBook['downloadUrls']
+                    for a_href in div.find_all('a', href=True):
+                        m = DOWNLOAD_URL_PATTERN.match(a_href['href'])# extract the download link from href like: "/ebook_download/20892/pdf"
+                        if m:
+                            if m.group(4) is not None:
+                                downloadUrls[m.group(4)] = m.group(0)
+                            else:
+                                downloadUrls['code'] = m.group(0)
+            self.__buildTitleIndex()
+        if self.libraryIndex is not None:
+            newBooks = self.libraryIndex.update_books(self.bookData)
+            if newBooks:
+                logger.info("{} new eBooks since the last run: {}{}".format(
+                    len(newBooks), ', '.join("'{}'".format(book['title']) for book in newBooks[:10]),
+                    ', ...' if len(newBooks) > 10 else ''))
+
+    def __isFileDownloaded(self, filePath, book, form):
+        """Checks the library index (if used) instead of the file system, files found only on disk are indexed"""
+        if self.libraryIndex is None:
+            return os.path.isfile(filePath)
+        if self.libraryIndex.is_file_downloaded(filePath):
+            return True
+        if os.path.isfile(filePath):
+            self.libraryIndex.add_file(filePath, book['id'], form)
+            return True
+        return False
 
     def __updateDownloadProgressBar(self, currentWorkDone):
         """Prints progress bar, currentWorkDone should be float value in range {0.0 - 1.0}, else prints '\n'"""
@@ -221,35 +529,201 @@ class BookDownloader(object):
         else:
             print("")
 
-    def downloadBooks(self, titles=None, formats=None, intoFolder = False):
+    @staticmethod
+    def __logDownloadStart(job):
+        if job['form'] == 'code':
+            logger.info("Downloading code for eBook: '{}'...".format(job['title']))
+        else:
+            logger.info("Downloading eBook: '{}' in .{} format...".format(job['title'], job['form']))
+
+    def __finishDownload(self, job, error=None):
+        """Indexes the downloaded file and logs the outcome, returns True if the download succeeded"""
+        title, form = job['title'], job['form']
+        try:
+            if error is not None:
+                raise error
+            if self.libraryIndex is not None:
+                self.libraryIndex.add_file(job['filePath'], job['nid'], form, job['checksums'])
+            if form == 'code':
+                logger.success("Code for eBook: '{}' downloaded successfully!".format(title))
+            else:
+                logger.success("eBook: '{}.{}' downloaded successfully!".format(title, form))
+            return True
+        except Exception as e:
+            logger.error("Cannot download '{}': {}".format(title, e))
+        return False
+
+    def __downloadFile(self, session, job, progress=None):
         """
-        Downloads the ebooks.
-        :param titles: list('C# tutorial', 'c++ Tutorial') ;
-        :param formats: tuple('pdf','mobi','epub','code');
+        Downloads a single file described by the job, returns True on success.
+        :param progress: callable(downloadedBytes, totalBytes) invoked while downloading
+        Interrupted downloads are kept as '.part' files and resumed during the next call.
         """
-        # download ebook
+        self.__logDownloadStart(job)
+        try:
+            with metrics.span('download', file=os.path.basename(job['filePath'])) as span:
+                span.bytes = transfer.download_file(session, job['url'], job['filePath'],
+                                                    headers=self.accountData.reqHeaders, timeout=100, progress=progress,
+                                                    checksums=job['checksums'])
+        except Exception as e:
+            return self.__finishDownload(job, e)
+        return self.__finishDownload(job)
+
+    def __downloadSequentially(self, jobs):
+        """Downloads the files one after another, returns list of download results (True if succeeded)"""
+        results = []
+        progress = None
+        if self.showProgress:
+            progress = lambda downloaded, total: self.__updateDownloadProgressBar(float(downloaded) / total if total else 0.0)
+        for job in jobs:
+            # the bar is redrawn a few times per second at most, not for every chunk
+            results.append(self.__downloadFile(self.session, job, transfer.rate_limited(progress) if progress else None))
+            if self.showProgress:
+                self.__updateDownloadProgressBar(-1)# add end of line
+        return results
+
+    def __downloadConcurrently(self, jobs, workers):
+        """Downloads the files using a bounded pool of workers, returns list of download results (True if succeeded)"""
+        from concurrent.futures import ThreadPoolExecutor
+        logger.info("Downloading {} files using {} workers...".format(len(jobs), workers))
+        hostLimiter = transfer.HostLimiter(self.accountData.downloadWorkersPerHost)
+        progressSummary = transfer.ProgressSummary(len(jobs), interactive=self.showProgress)
+        workerData = threading.local()
+
+        def download(job):
+            if not hasattr(workerData, 'session'):# requests.Session is not thread safe, each worker gets its own
+                workerData.session = transfer.clone_session(self.session)
+            key = job['filePath']
+            try:
+                with hostLimiter.for_url(job['url']):
+                    return self.__downloadFile(workerData.session, job,
+                                               lambda downloaded, total: progressSummary.update(key, downloaded, total))
+            finally:
+                progressSummary.finish(key)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(download, jobs))
+
+    def __downloadAsynchronously(self, jobs, workers):
+        """Downloads the files on the event loop of the asyncio engine, returns list of download results (True if succeeded)"""
+        logger.info("Downloading {} files, {} at once...".format(len(jobs), workers))
+        progressSummary = transfer.ProgressSummary(len(jobs), interactive=self.showProgress)
+        results = [False] * len(jobs)
+
+        def onDone(index, error):
+            results[index] = self.__finishDownload(jobs[index], error)
+            progressSummary.finish(index)
+
+        self.session.download_files([(job['url'], job['filePath']) for job in jobs], workers,
+                                    self.accountData.downloadWorkersPerHost, headers=self.accountData.reqHeaders,
+                                    timeout=100, on_start=lambda index: self.__logDownloadStart(jobs[index]),
+                                    on_progress=progressSummary.update, on_done=onDone,
+                                    checksums=[job['checksums'] for job in jobs])
+        return results
+
+    @staticmethod
+    def __getSyncEntries(book, formats, intoFolder):
+        """Describes what has to be downloaded for the book, as a set of (format, url, intoFolder) entries"""
+        return set((form, url, intoFolder) for form, url in book['downloadUrls'].items() if form in formats)
+
+    def __getFormats(self, formats):
         if formats is None:
             formats = self.accountData.downloadFormats
             if formats is None:
                 formats = ('pdf', 'mobi', 'epub', 'code')
+        return formats
+
+    def __getStreamSources(self, titles, formats):
+        """Returns list of (fileName, url) tuples of the ebooks to be streamed"""
+        formats = self.__getFormats(formats)
+        books = self.findBooksByTitles(titles) if titles is not None else self.bookData
+        if len(books) == 0:
+            logger.info("There is no books with provided titles: {} at your account!".format(titles))
+        return [("{}.{}".format(book['normalizedTitle'], 'zip' if form == 'code' else form),
+                 self.accountData.packtPubUrl + book['downloadUrls'][form])
+                for book in books for form in formats if form in book['downloadUrls']]
+
+    def __openStream(self, session, fileName, url):
+        """Opens the ebook for reading, returns None if it cannot be downloaded"""
+        logger.info("Streaming '{}'...".format(fileName))
+        try:
+            return transfer.open_stream(session, url, fileName, headers=self.accountData.reqHeaders, timeout=100)
+        except Exception as e:
+            logger.error("Cannot download '{}': {}".format(fileName, e))
+        return None
+
+    def iterBookStreams(self, titles=None, formats=None):
+        """
+        Streams the ebooks instead of saving them on disk, yields tuples (fileName, stream) where stream is
+        a non seekable file object with 'size' attribute (None if unknown). Each stream has to be read
+        (or closed) before the next one is requested.
+        :param titles: list('C# tutorial', 'c++ Tutorial') ;
+        :param formats: tuple('pdf','mobi','epub','code');
+        """
+        for fileName, url in self.__getStreamSources(titles, formats):
+            stream = self.__openStream(self.session, fileName, url)
+            if stream is None:
+                continue
+            try:
+                yield fileName, stream
+            finally:
+                stream.close()
+
+    def getBookStreamOpeners(self, titles=None, formats=None):
+        """
+        Like iterBookStreams, but the streams are opened later on, possibly by many threads at once.
+        :return: list of (fileName, openStream) tuples, openStream() returns the stream or None if it cannot be opened
+        """
+        workerData = threading.local()
+
+        def getSession():
+            if self.accountData.httpEngine == 'asyncio':# the asyncio session is thread safe
+                return self.session
+            if not hasattr(workerData, 'session'):# requests.Session is not, each thread gets its own
+                workerData.session = transfer.clone_session(self.session)
+            return workerData.session
+
+        return [(fileName, lambda fileName=fileName, url=url: self.__openStream(getSession(), fileName, url))
+                for fileName, url in self.__getStreamSources(titles, formats)]
+
+    def downloadBooks(self, titles=None, formats=None, intoFolder=False, workers=None, incremental=False):
+        """
+        Downloads the ebooks.
+        :param titles: list('C# tutorial', 'c++ Tutorial') ;
+        :param formats: tuple('pdf','mobi','epub','code');
+        :param workers: number of simultaneous downloads, [downloadWorkers] config field is used if None
+        :param incremental: skips books fully synced by the previous runs (requires the library index)
+        :return: number of downloaded files
+        """
+        # download ebook
+        formats = self.__getFormats(formats)
+        if workers is None:
+            workers = self.accountData.downloadWorkers
         if titles is not None:
-            tempBookData = [data for data in self.bookData \
-                            if any(PacktAccountDataModel.convertBookTitleToValidString(data['title']) == \
-                            PacktAccountDataModel.convertBookTitleToValidString(title) for title in titles)]
+            tempBookData = self.findBooksByTitles(titles)
         else:# download all
             tempBookData = self.bookData
         if len(tempBookData) == 0:
             logger.info("There is no books with provided titles: {} at your account!".format(titles))
-        nrOfBooksDownloaded = 0
-        is_interactive = sys.stdout.isatty()
-        for i, book in enumerate(tempBookData):
+        syncEntries = {}
+        if incremental:
+            if self.libraryIndex is None:
+                logger.error("Incremental sync requires the library index, set [libraryIndexFilePath] field")
+            else:
+                syncedBooks = self.libraryIndex.get_synced_books()
+                syncEntries = dict((book['id'], self.__getSyncEntries(book, formats, intoFolder)) for book in tempBookData)
+                tempBookData = [book for book in tempBookData
+                                if not syncEntries[book['id']].issubset(syncedBooks.get(book['id'], ()))]
+                logger.info("{} eBooks are new or changed since the last sync".format(len(tempBookData)))
+        jobs = []
+        for book in tempBookData:
+            title = book['normalizedTitle']# format valid pathname
             for form in formats:
-                if form in list(tempBookData[i]['downloadUrls'].keys()):
+                if form in book['downloadUrls']:
                     if form == 'code':
                         fileType = 'zip'
                     else:
                         fileType = form
-                    title = PacktAccountDataModel.convertBookTitleToValidString(tempBookData[i]['title'])# format valid pathname
                     logger.info("Title: '{}'".format(title))
                     if intoFolder:
                         targetDownloadPath = os.path.join(self.accountData.downloadFolderPath, title)
@@ -259,125 +733,568 @@ class BookDownloader(object):
                         targetDownloadPath = os.path.join(self.accountData.downloadFolderPath)
                     fullFilePath = os.path.join(targetDownloadPath,
                                                 "{}.{}".format(title, fileType))
-                    if os.path.isfile(fullFilePath):
+                    if self.__isFileDownloaded(fullFilePath, book, form):
                         logger.info("'{}.{}' already exists under the given path".format(title, fileType))
                     else:
-                        if form == 'code':
-                            logger.info("Downloading code for eBook: '{}'...".format(title))
-                        else:
-                            logger.info("Downloading eBook: '{}' in .{} format...".format(title, form))
-                        try:
-                            r = self.session.get(self.accountData.packtPubUrl + tempBookData[i]['downloadUrls'][form],
-                                                 headers=self.accountData.reqHeaders, timeout=100,stream=True)
-                            if r.status_code is 200:
-                                with open(fullFilePath, 'wb') as f:
-                                        totalLength = int(r.headers.get('content-length'))
-                                        numOfChunks = (totalLength/1024) + 1
-                                        for num, chunk in enumerate(r.iter_content(chunk_size=1024)):
-                                            if chunk:
-                                                if is_interactive:
-                                                    self.__updateDownloadProgressBar(num/numOfChunks)
-                                                f.write(chunk)
-                                                f.flush()
-                                        if is_interactive:
-                                            self.__updateDownloadProgressBar(-1)# add end of line
-                                if form == 'code':
-                                    logger.success("Code for eBook: '{}' downloaded successfully!".format(title))
-                                else:
-                                    logger.success("eBook: '{}.{}' downloaded successfully!".format(title, form))
-                                nrOfBooksDownloaded += 1
-                            else:
-                                message = "Cannot download '{}'".format(title)
-                                logger.error(message)
-                                raise requests.exceptions.RequestException(message)
-                        except Exception as e:
-                            logger.error(e)
-        logger.info("{} eBooks have been downloaded!".format(str(nrOfBooksDownloaded)))
+                        jobs.append({'title': title,
+                                     'nid': book['id'],
+                                     'form': form,
+                                     'url': self.accountData.packtPubUrl + book['downloadUrls'][form],
+                                     'filePath': fullFilePath,
+                                     'checksums': Checksums()})# filled in while downloading, stored in the library index
+        if self.accountData.httpEngine == 'asyncio' and len(jobs) > 0:
+            results = self.__downloadAsynchronously(jobs, min(workers, len(jobs)))
+        elif workers > 1 and len(jobs) > 1:
+            results = self.__downloadConcurrently(jobs, min(workers, len(jobs)))
+        else:
+            results = self.__downloadSequentially(jobs)
+        if syncEntries:
+            failedBookIds = set(job['nid'] for job, downloaded in zip(jobs, results) if not downloaded)
+            self.libraryIndex.mark_books_synced(dict((book['id'], syncEntries[book['id']]) for book in tempBookData
+                                                    if book['id'] not in failedBookIds))
+        nrOfDownloaded = sum(1 for downloaded in results if downloaded)
+        logger.info("{} eBooks have been downloaded!".format(str(nrOfDownloaded)))
+        return nrOfDownloaded
 
 
-# Main
-if __name__ == '__main__':
+#################################-WORKFLOW-###########################################
+DEFAULT_BATCH_WORKERS = 4
+DEFAULT_DAEMON_SCHEDULE = '12:00'
+DEFAULT_DAEMON_JITTER = 10# minutes
+DEFAULT_DAEMON_RETRIES = 3
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument("-g", "--grab", help="grabs daily ebook",
-                        action="store_true")
-    parser.add_argument("-gl", "--grabl", help="grabs and log ebook extra info data",
-                        action="store_true")
-    parser.add_argument("-gd", "--grabd", help="grabs daily ebook and downloads the title afterwards",
-                        action="store_true")
-    parser.add_argument("-da", "--dall", help="downloads all ebooks from your account",
-                        action="store_true")
-    parser.add_argument("-dc", "--dchosen", help="downloads chosen titles described in [downloadBookTitles] field",
-                        action="store_true")
-    parser.add_argument("-sgd", "--sgd", help="sends the grabbed eBook to google drive",
-                        action="store_true")
-    parser.add_argument("-m", "--mail", help="send download to emails defined in config file", default=False,
-                        action="store_true")
-    parser.add_argument("-rm", "--report_mail", help="send fail report email when script somehow failed", default=False,
-                        action="store_true")
-    parser.add_argument("-f", "--folder", help="downloads eBook into a folder", default=False,
-                        action="store_true")
-    parser.add_argument("--noauth_local_webserver", help="set if you want auth GoogleDrive without local browser",
-                        action="store_true")
 
-    args = parser.parse_args()
-    cfgFilePath = os.path.join(os.getcwd(), "configFile.cfg")
+class WarmResources(object):
+    """
+    Logged in session, Google Drive manager and SMTP connection of an account, kept between the runs of the daemon
+    mode. They are created by the first run needing them and created again lazily once they stop working.
+    """
+
+    def __init__(self, cfgFilePath):
+        self.cfgFilePath = cfgFilePath
+        self.session = None
+        self.googleDrive = None
+        self.mailBook = None
+
+    def getSession(self, args, httpAdapter=None):
+        if self.session is not None and self.session.hasExpired():
+            logger.info("Session of {} has expired".format(self.session.getCurrentConfig().myPacktEmail))
+            self.__closeSession()
+        if self.session is None:
+            self.session = createSession(self.cfgFilePath, args, httpAdapter)
+        return self.session
+
+    def getGoogleDrive(self):
+        if self.googleDrive is None:
+            from utils.googleDrive import GoogleDriveManager
+            self.googleDrive = GoogleDriveManager(self.cfgFilePath)
+        return self.googleDrive
+
+    def getMailBook(self):
+        if self.mailBook is None:
+            from utils.mail import MailBook
+            self.mailBook = MailBook(self.cfgFilePath)# reconnects by itself if the SMTP connection has been closed
+        return self.mailBook
+
+    def discard(self):
+        """Closes the session and forgets the Drive manager after a failed run, the next run creates them again"""
+        self.__closeSession()
+        self.googleDrive = None
+
+    def __closeSession(self):
+        if self.session is not None:
+            try:
+                self.session.close()
+            except Exception as e:
+                logger.error("Cannot close the session: {}".format(e))
+            self.session = None
 
+    def getStatus(self):
+        return {'session': self.session is not None, 'googleDrive': self.googleDrive is not None,
+                'mail': self.mailBook is not None}
+
+    def close(self):
+        self.__closeSession()
+        if self.mailBook is not None:
+            self.mailBook.close()
+
+
+def createSession(cfgFilePath, args, httpAdapter=None):
+    """Reads the account config and logs its session in"""
+    accountData = PacktAccountDataModel(cfgFilePath)
+    if args.engine is not None:
+        accountData.httpEngine = args.engine
+    return PacktPubHttpSession(accountData, httpAdapter)
+
+
+def runWorkflow(cfgFilePath, args, httpAdapter=None, showProgress=None, warm=None):
+    """
+    Grabs, downloads and sends the ebooks of a single account, as chosen by the command line arguments.
+    :param httpAdapter: requests.adapters.HTTPAdapter shared with the other accounts, so they use one connection pool
+    :param showProgress: prints progress bars of the downloads, if None they are shown in an interactive console
+    :param warm: WarmResources of the account reused by this run (the daemon mode), if None they live only in this run
+    :return: summary dict: {'account':.., 'grabbedTitle':.., 'downloaded':.., 'error':.., 'time':..}
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    summary = {'account': cfgFilePath, 'grabbedTitle': None, 'downloaded': None, 'error': None}
+    startTime = time.time()
+    resources = warm if warm is not None else WarmResources(cfgFilePath)
+    downloader = None
+    infoDataExecutor = None
     try:
-        session = PacktPubHttpSession(PacktAccountDataModel(cfgFilePath))
+        session = resources.getSession(args, httpAdapter)
+        accountData = session.getCurrentConfig()
+        summary['account'] = accountData.myPacktEmail
         grabber = BookGrabber(session)
         downloader = BookDownloader(session)
+        if showProgress is not None:
+            downloader.showProgress = showProgress
         if args.sgd:
-            from utils.googleDrive import GoogleDriveManager
-            googleDrive= GoogleDriveManager(cfgFilePath)
+            googleDrive = resources.getGoogleDrive()
 
+        infoDataFuture = None
         if args.grab or args.grabl or args.grabd or args.sgd or args.mail:
             if not args.grabl:
                 grabber.grabEbook()
+            elif accountData.httpEngine == 'asyncio':
+                grabber.grabEbook()
+                # the session is thread safe, so book details are fetched while the rest of the work goes on
+                infoDataExecutor = ThreadPoolExecutor(max_workers=1)
+                infoDataFuture = infoDataExecutor.submit(grabber.getEbookInfoData, None)
             else:
                 grabber.grabEbook(logEbookInfodata=True)
+            summary['grabbedTitle'] = grabber.bookTitle
 
-        if args.grabd or args.dall or args.dchosen or args.sgd or args.mail:
+        if args.rescan and downloader.libraryIndex is not None:
+            downloader.libraryIndex.forget_files()
+        if args.grabd or args.dall or args.sgd or args.mail:
             downloader.getDataOfAllMyBooks()
+        elif args.dchosen:
+            if not downloader.getDataOfMyBooksFromIndex(session.getCurrentConfig().downloadBookTitles):
+                downloader.getDataOfAllMyBooks()
         intoFolder = False
         if args.folder:
             intoFolder = True
-        if args.grabd or args.sgd or args.mail:
-            if args.sgd or args.mail:
-                session.getCurrentConfig().downloadFolderPath=os.getcwd()
-            downloader.downloadBooks([grabber.bookTitle], intoFolder=intoFolder)
-            if args.sgd or args.mail:
-                paths = [os.path.join(session.getCurrentConfig().downloadFolderPath, path) \
-                        for path in os.listdir(session.getCurrentConfig().downloadFolderPath) \
-                            if os.path.isfile(path) and path.find(grabber.bookTitle) is not -1]
-            if args.sgd:
-                googleDrive.send_files(paths)
+        if args.sgd or args.mail:# stream the book straight to its destination, nothing is stored on disk
+            if args.sgd:# every format goes over its own connection, [gdUploadWorkers] of them at once
+                googleDrive.send_streams(downloader.getBookStreamOpeners([grabber.bookTitle]), into_folders=intoFolder)
             elif args.mail:
-                from utils.mail import MailBook
-                mb = MailBook(cfgFilePath)
-                pdfPath = None
-                mobiPath = None
-                try:
-                    pdfPath = [path for path in paths if path.split('.')[-1] == 'pdf'][-1]
-                    mobiPath = [path for path in paths if path.split('.')[-1] == 'mobi'][-1]
-                except:
-                    pass
-                if pdfPath:
-                    mb.send_book(pdfPath)
-                if mobiPath:
-                    mb.send_kindle(mobiPath)
-            if args.sgd or args.mail:
-                [os.remove(path) for path in paths]
+                mailFormats = tuple(form for form in session.getCurrentConfig().downloadFormats if form in ('pdf', 'mobi'))
+                mb = resources.getMailBook()# one SMTP connection for all the messages
+                for fileName, stream in downloader.iterBookStreams([grabber.bookTitle], formats=mailFormats):
+                    if fileName.endswith('.pdf'):
+                        mb.send_book(stream, book_name=fileName)
+                    else:
+                        mb.send_kindle(stream, book_name=fileName)
+
+        elif args.grabd:
+            summary['downloaded'] = downloader.downloadBooks([grabber.bookTitle], intoFolder=intoFolder,
+                                                             workers=args.workers)
 
         elif args.dall:
-            downloader.downloadBooks(intoFolder=intoFolder)
+            summary['downloaded'] = downloader.downloadBooks(intoFolder=intoFolder, workers=args.workers,
+                                                             incremental=args.incremental)
 
         elif args.dchosen:
-            downloader.downloadBooks(session.getCurrentConfig().downloadBookTitles, intoFolder=intoFolder)
+            summary['downloaded'] = downloader.downloadBooks(session.getCurrentConfig().downloadBookTitles,
+                                                             intoFolder=intoFolder, workers=args.workers,
+                                                             incremental=args.incremental)
+        if infoDataFuture is not None:
+            infoDataFuture.result()
         logger.success("Good, looks like all went well! :-)")
     except Exception as e:
+        summary['error'] = str(e)
         logger.error("Exception occurred {}".format(e))
+        if infoDataExecutor is not None:# the book details may be still being fetched with the session discarded below
+            infoDataExecutor.shutdown()
+        resources.discard()
         if args.report_mail:
-            from utils.mail import MailBook
-            mb = MailBook(cfgFilePath)
-            mb.send_info(body="Today's book grabbing has failed with exception: {}!\n Check this out!".format(str(e)))            
+            try:
+                resources.getMailBook().send_info(
+                    body="Today's book grabbing has failed with exception: {}!\n Check this out!".format(str(e)))
+            except Exception as e:
+                logger.error("Cannot send the fail report: {}".format(e))
+    finally:
+        if infoDataExecutor is not None:
+            infoDataExecutor.shutdown()
+        if downloader is not None:
+            downloader.close()
+        if warm is None:
+            resources.close()
+    summary['time'] = time.time() - startTime
+    return summary
+
+
+def isModuleAvailable(moduleName):
+    """Checks if the module can be imported, without importing it"""
+    try:
+        from importlib.util import find_spec
+    except ImportError:# python 2
+        from pkgutil import find_loader as find_spec
+    try:
+        return find_spec(moduleName) is not None
+    except ImportError:
+        return False
+
+
+def checkSetup(cfgFilePath):
+    """
+    Checks the config file, the stored session and the required libraries without connecting anywhere,
+    nor importing the http, html or Google libraries.
+    :return: True if everything needed by the configuration is in place
+    """
+    try:
+        accountData = PacktAccountDataModel(cfgFilePath)
+    except Exception as e:
+        logger.error("Config file '{}' is invalid: {}".format(cfgFilePath, e))
+        return False
+    logger.success("Config file '{}' is valid, account: {}".format(cfgFilePath, accountData.myPacktEmail))
+    ready = True
+    requiredModules = [('requests', True), ('bs4', True), ('lxml', False),
+                       ('aiohttp', accountData.httpEngine == 'asyncio')]
+    if accountData.configuration.has_section("GOOGLE_DRIVE_DATA"):
+        requiredModules += [('httplib2', False), ('oauth2client', False), ('apiclient', False)]
+    for moduleName, required in requiredModules:
+        if isModuleAvailable(moduleName):
+            logger.info("Library '{}' is installed".format(moduleName))
+        elif required:
+            logger.error("Library '{}' is required but not installed".format(moduleName))
+            ready = False
+        else:
+            logger.info("Optional library '{}' is not installed".format(moduleName))
+    cacheFilePath = accountData.sessionCacheFilePath
+    if cacheFilePath is None:
+        logger.info("Session cache is disabled, every run logs in")
+    elif not os.path.isfile(cacheFilePath):
+        logger.info("No stored session, the next run logs in")
+    else:
+        try:
+            with open(cacheFilePath, 'r') as f:
+                cachedData = json.load(f)
+            expires = [cookie['expires'] for cookie in cachedData['cookies'] if cookie['expires'] is not None]
+            if cachedData['email'] != accountData.myPacktEmail:
+                logger.info("Stored session belongs to another account, the next run logs in")
+            elif expires and min(expires) < time.time():
+                logger.info("Stored session has expired, the next run logs in")
+            else:
+                logger.info("Stored session is valid{}".format(
+                    " until " + time.strftime("%d-%m-%Y %H:%M", time.localtime(min(expires))) if expires else ""))
+        except Exception as e:
+            logger.error("Stored session '{}' is corrupted, the next run logs in: {}".format(cacheFilePath, e))
+    if accountData.libraryIndexFilePath is not None:
+        logger.info("Library index: '{}'{}".format(accountData.libraryIndexFilePath,
+                                                   "" if os.path.isfile(accountData.libraryIndexFilePath) else
+                                                   " (will be created by the next run)"))
+    return ready
+
+
+def verifyLibrary(cfgFilePath, workers=None):
+    """
+    Hashes the files recorded in the library index using a pool of threads and compares them with the checksums
+    stored when they were downloaded, no connection is made. A corrupted file is renamed to '.corrupt', it is
+    forgotten by the index together with the missing ones, so the next download run fetches them again.
+    Files indexed without checksums (found on disk) get them recorded.
+    :return: True if all the files are intact
+    """
+    from utils import integrity
+    from utils.library import LibraryIndex
+    accountData = PacktAccountDataModel(cfgFilePath)
+    if accountData.libraryIndexFilePath is None:
+        logger.error("Verification requires the library index, set [libraryIndexFilePath] field")
+        return False
+    libraryIndex = LibraryIndex(accountData.libraryIndexFilePath, PacktAccountDataModel.convertBookTitleToValidString)
+    try:
+        files = libraryIndex.get_files()
+        workers = workers if workers is not None else integrity.DEFAULT_VERIFY_WORKERS
+        logger.info("Verifying {} files using {} workers...".format(len(files), workers))
+        nrOfIntact, nrOfRecorded, nrOfBroken = 0, 0, 0
+        for file, (path, checksums) in zip(files, integrity.hash_files([file['path'] for file in files], workers)):
+            if checksums is None:
+                logger.error("'{}' is missing".format(path))
+                libraryIndex.forget_file(path)
+                nrOfBroken += 1
+            elif file['sha256'] is None:
+                libraryIndex.add_file(path, file['nid'], file['format'], checksums)
+                nrOfRecorded += 1
+            elif checksums.size != file['size'] or checksums.sha256 != file['sha256']:
+                logger.error("'{}' is corrupted: {} bytes, SHA-256 {} instead of {} bytes, SHA-256 {}".format(
+                    path, checksums.size, checksums.sha256, file['size'], file['sha256']))
+                transfer.replace_file(path, path + '.corrupt')
+                libraryIndex.forget_file(path)
+                nrOfBroken += 1
+            else:
+                nrOfIntact += 1
+    finally:
+        libraryIndex.close()
+    logger.info("{} files intact, {} checksums recorded, {} files missing or corrupted".format(
+        nrOfIntact, nrOfRecorded, nrOfBroken))
+    return nrOfBroken == 0
+
+
+def parseDate(value):
+    """Converts YYYY-MM-DD date into seconds since the epoch (argparse type)"""
+    try:
+        return time.mktime(time.strptime(value, "%Y-%m-%d"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{}' is not a YYYY-MM-DD date".format(value))
+
+
+def getEbookMetadataStore(accountData):
+    """Opens the metadata store set in [ebookExtraInfoLogFilePath] field, None if the field points to a text log"""
+    from utils import metadata
+    if not metadata.is_store_file(accountData.bookInfoDataLogFile):
+        logger.error("[ebookExtraInfoLogFilePath] field: '{}' is not a metadata store, its name should end with {}".format(
+            accountData.bookInfoDataLogFile, ' or '.join(metadata.STORE_FILE_EXTENSIONS)))
+        return None
+    return metadata.MetadataStore(accountData.bookInfoDataLogFile)
+
+
+def queryEbookMetadata(cfgFilePath, title=None, since=None):
+    """
+    Prints metadata of the grabbed ebooks logged in the store, the oldest first.
+    :param title: beginning of the title (case insensitive)
+    :param since: time (seconds since the epoch) the ebooks have been grabbed at or after
+    :return: True if any ebook has been found
+    """
+    store = getEbookMetadataStore(PacktAccountDataModel(cfgFilePath))
+    if store is None:
+        return False
+    with store:
+        records = store.find(PacktAccountDataModel.convertBookTitleToValidString(title), since)
+    for grabbedAt, record in records:
+        print("{}  {}".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(grabbedAt)), record.get('title')))
+        for key, value in record.items():
+            if key not in ('title', 'downloaded_at'):
+                print("    {}: {}".format(key, value.replace('\n', '\n      ') if isinstance(value, str) else value))
+    logger.info("{} ebooks found".format(len(records)))
+    return len(records) > 0
+
+
+def importEbookMetadata(cfgFilePath, logFilePath):
+    """Imports records of the plain text metadata log ('KEY --> value' lines) into the store, returns True on success"""
+    from utils import metadata
+    store = getEbookMetadataStore(PacktAccountDataModel(cfgFilePath))
+    if store is None:
+        return False
+    with store:
+        records = list(metadata.parse_log_file(logFilePath))
+        imported = store.add_many(records)
+    logger.success("{} records imported from '{}', {} skipped as imported before".format(
+        imported, logFilePath, len(records) - imported))
+    return True
+
+
+def getAccountConfigFilePaths(paths):
+    """Expands the given config files and directories (all their *.cfg files) into a list of config file paths"""
+    cfgFilePaths = []
+    for path in paths:
+        if os.path.isdir(path):
+            cfgFilePaths.extend(sorted(os.path.join(path, fileName) for fileName in os.listdir(path)
+                                       if fileName.endswith('.cfg')))
+        else:
+            cfgFilePaths.append(path)
+    return [os.path.abspath(cfgFilePath) for cfgFilePath in cfgFilePaths]
+
+
+def runBatch(cfgFilePaths, args, workers=DEFAULT_BATCH_WORKERS, warmResources=None):
+    """
+    Runs the workflow of many accounts at once in this process, each one with its own session.
+    All the sessions share a single connection pool, at most 'workers' accounts are handled simultaneously.
+    :param warmResources: {config file path: WarmResources} reused by the runs (the daemon mode)
+    :return: list of the account summaries (see runWorkflow), in the order of the config files
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from requests.adapters import HTTPAdapter
+    workers = max(1, min(workers, len(cfgFilePaths)))
+    logger.info("Running the workflow of {} accounts, {} at once...".format(len(cfgFilePaths), workers))
+    # only the connection pool is shared, every account is retried and rate limited as its own config says
+    httpAdapter = HTTPAdapter(pool_maxsize=workers * transfer.DEFAULT_WORKERS_PER_HOST)
+    showProgress = False if workers > 1 else None# progress bars of many accounts would overwrite each other
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(lambda cfgFilePath: runWorkflow(
+            cfgFilePath, args, httpAdapter, showProgress, warmResources.get(cfgFilePath) if warmResources else None),
+            cfgFilePaths))
+    for summary in summaries:
+        details = "{:.1f} s".format(summary['time'])
+        if summary['grabbedTitle']:
+            details += ", grabbed: '{}'".format(summary['grabbedTitle'])
+        if summary['downloaded'] is not None:
+            details += ", downloaded files: {}".format(summary['downloaded'])
+        if summary['error'] is None:
+            logger.success("Account: {} - OK ({})".format(summary['account'], details))
+        else:
+            logger.error("Account: {} - FAILED: {} ({})".format(summary['account'], summary['error'], details))
+    logger.info("{} of {} accounts succeeded".format(sum(1 for summary in summaries if summary['error'] is None),
+                                                    len(summaries)))
+    return summaries
+
+
+def parseTimeOfDay(value):
+    """Converts HH:MM time into (hour, minute) tuple (argparse type)"""
+    try:
+        timeOfDay = time.strptime(value, "%H:%M")
+    except ValueError:
+        raise argparse.ArgumentTypeError("'{}' is not a HH:MM time".format(value))
+    return timeOfDay.tm_hour, timeOfDay.tm_min
+
+
+def runDaemon(cfgFilePaths, args):
+    """
+    Runs the workflow chosen by the arguments every day at the --schedule times, and an incremental sync of all
+    the books every --sync_every hours, until SIGTERM or Ctrl+C. Sessions, Google Drive managers and SMTP connections
+    of the accounts are kept between the runs. A failed run is retried --retries times (after 5, 10, 20... minutes)
+    for the failed accounts only. --status_port serves the state of the jobs on localhost.
+    :return: False if there is nothing to run
+    """
+    import signal
+    from utils.scheduler import Job, Scheduler, StatusServer
+    warmResources = dict((cfgFilePath, WarmResources(cfgFilePath)) for cfgFilePath in cfgFilePaths)
+    failedCfgFilePaths = {}# {job name: config files of the accounts failed by its last run}
+
+    def runAccounts(jobName, jobArgs):
+        job = jobs[jobName]
+        # a retry runs only the failed accounts, so the others don't e.g. mail the same book again
+        runCfgFilePaths = failedCfgFilePaths[jobName] if job.attempt > 0 else cfgFilePaths
+        metrics.reset()
+        if args.accounts is not None:
+            summaries = runBatch(runCfgFilePaths, jobArgs, args.batch_workers, warmResources)
+        else:
+            summaries = [runWorkflow(runCfgFilePaths[0], jobArgs, warm=warmResources[runCfgFilePaths[0]])]
+        if args.report is not None:
+            metrics.write_report(args.report, success=all(summary['error'] is None for summary in summaries))
+        failedCfgFilePaths[jobName] = [cfgFilePath for cfgFilePath, summary in zip(runCfgFilePaths, summaries)
+                                       if summary['error'] is not None]
+        return summaries
+
+    def hasFailedAccounts(summaries):
+        return any(summary['error'] is not None for summary in summaries)
+
+    jobs = OrderedDict()
+    jitter = args.jitter * 60
+    if args.grab or args.grabl or args.grabd or args.dall or args.dchosen or args.sgd or args.mail:
+        jobs['workflow'] = Job('workflow', lambda: runAccounts('workflow', args), times_of_day=args.schedule,
+                               jitter=jitter, retries=args.retries, is_failed=hasFailedAccounts)
+    if args.sync_every is not None:
+        syncArgs = argparse.Namespace(**vars(args))
+        syncArgs.grab = syncArgs.grabl = syncArgs.grabd = syncArgs.dchosen = syncArgs.sgd = syncArgs.mail = False
+        syncArgs.dall = syncArgs.incremental = True
+        jobs['sync'] = Job('sync', lambda: runAccounts('sync', syncArgs), interval=args.sync_every * 3600,
+                           jitter=jitter, retries=args.retries, is_failed=hasFailedAccounts)
+    if not jobs:
+        logger.error("Nothing to run, choose the workflow of the daemon (e.g. -gd) or set --sync_every")
+        return False
+    scheduler = Scheduler(list(jobs.values()))
+
+    def getStatus():
+        status = scheduler.get_status()
+        status['accounts'] = dict((cfgFilePath, resources.getStatus()) for cfgFilePath, resources in warmResources.items())
+        healthy = all(job.last_error is None and all(summary['error'] is None for summary in job.last_result or [])
+                      for job in scheduler.jobs)
+        return healthy, status
+
+    statusServer = None
+    if args.status_port is not None:
+        statusServer = StatusServer(args.status_port, getStatus)
+        statusServer.start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if statusServer is not None:
+            statusServer.shutdown()
+            statusServer.server_close()
+        for resources in warmResources.values():
+            resources.close()
+    logger.info("Daemon stopped")
+    return True
+
+
+# Main
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-g", "--grab", help="grabs daily ebook",
+                        action="store_true")
+    parser.add_argument("-gl", "--grabl", help="grabs and log ebook extra info data",
+                        action="store_true")
+    parser.add_argument("-gd", "--grabd", help="grabs daily ebook and downloads the title afterwards",
+                        action="store_true")
+    parser.add_argument("-da", "--dall", help="downloads all ebooks from your account",
+                        action="store_true")
+    parser.add_argument("-dc", "--dchosen", help="downloads chosen titles described in [downloadBookTitles] field",
+                        action="store_true")
+    parser.add_argument("-sgd", "--sgd", help="sends the grabbed eBook to google drive",
+                        action="store_true")
+    parser.add_argument("-m", "--mail", help="send download to emails defined in config file", default=False,
+                        action="store_true")
+    parser.add_argument("-rm", "--report_mail", help="send fail report email when script somehow failed", default=False,
+                        action="store_true")
+    parser.add_argument("-f", "--folder", help="downloads eBook into a folder", default=False,
+                        action="store_true")
+    parser.add_argument("-w", "--workers", help="number of simultaneous downloads (overrides [downloadWorkers] field)",
+                        type=int, default=None)
+    parser.add_argument("-i", "--incremental", help="downloads only books added or changed since the last sync (requires library index)",
+                        action="store_true")
+    parser.add_argument("--rescan", help="forgets files stored in the library index and checks the download folder again",
+                        action="store_true")
+    parser.add_argument("-e", "--engine", help="http engine, asyncio runs all the requests on one event loop (overrides [httpEngine] field)",
+                        choices=HTTP_ENGINES, default=None)
+    parser.add_argument("-a", "--accounts", help="runs the workflow for many accounts at once, given as config files or directories of *.cfg files",
+                        nargs='+', default=None)
+    parser.add_argument("-bw", "--batch_workers", help="number of accounts handled simultaneously in the batch mode",
+                        type=int, default=DEFAULT_BATCH_WORKERS)
+    parser.add_argument("--report", help="writes timings of the run phases into the file, in Prometheus text format if it ends with .prom, as JSON otherwise",
+                        default=None)
+    parser.add_argument("--check", help="checks the config files, stored session and installed libraries, no connection is made",
+                        action="store_true")
+    parser.add_argument("--verify", help="checks the downloaded files against the checksums stored in the library index, "
+                                         "missing and corrupted ones are downloaded again by the next run (-w sets "
+                                         "the number of hashing threads)", action="store_true")
+    parser.add_argument("-q", "--query", help="prints metadata of the grabbed ebooks with titles beginning with the given "
+                                              "text (all if empty), requires a metadata store in [ebookExtraInfoLogFilePath] field",
+                        nargs='?', const='', default=None)
+    parser.add_argument("--since", help="limits --query to ebooks grabbed since the given YYYY-MM-DD date", type=parseDate,
+                        default=None)
+    parser.add_argument("--import_metadata", help="imports the plain text metadata log file into the metadata store",
+                        default=None)
+    parser.add_argument("--daemon", help="keeps running the chosen workflow every day at the --schedule times, "
+                                         "with sessions and connections kept between the runs", action="store_true")
+    parser.add_argument("--schedule", help="times of day (HH:MM) of the daemon runs", nargs='+', type=parseTimeOfDay,
+                        default=[parseTimeOfDay(DEFAULT_DAEMON_SCHEDULE)])
+    parser.add_argument("--jitter", help="maximum random delay of every daemon run in minutes", type=float,
+                        default=DEFAULT_DAEMON_JITTER)
+    parser.add_argument("--sync_every", help="the daemon also downloads new books of the account every given number of "
+                                             "hours (incremental sync, requires library index)", type=float, default=None)
+    parser.add_argument("--retries", help="number of retries of a failed daemon run, the first one after 5 minutes and "
+                                          "every next one twice as late", type=int, default=DEFAULT_DAEMON_RETRIES)
+    parser.add_argument("--status_port", help="the daemon serves its status on http://127.0.0.1:PORT/status and /health",
+                        type=int, default=None)
+    parser.add_argument("--noauth_local_webserver", help="set if you want auth GoogleDrive without local browser",
+                        action="store_true")
+
+    args = parser.parse_args()
+    log_manager.configure_from_file(os.path.join(os.getcwd(), "configFile.cfg"))
+    if args.check:
+        cfgFilePaths = getAccountConfigFilePaths(args.accounts) if args.accounts is not None else \
+            [os.path.join(os.getcwd(), "configFile.cfg")]
+        sys.exit(0 if all([checkSetup(cfgFilePath) for cfgFilePath in cfgFilePaths]) else 1)
+    if args.verify:
+        cfgFilePaths = getAccountConfigFilePaths(args.accounts) if args.accounts is not None else \
+            [os.path.join(os.getcwd(), "configFile.cfg")]
+        sys.exit(0 if all([verifyLibrary(cfgFilePath, args.workers) for cfgFilePath in cfgFilePaths]) else 1)
+    if args.import_metadata is not None:
+        sys.exit(0 if importEbookMetadata(os.path.join(os.getcwd(), "configFile.cfg"), args.import_metadata) else 1)
+    if args.query is not None or args.since is not None:
+        sys.exit(0 if queryEbookMetadata(os.path.join(os.getcwd(), "configFile.cfg"), args.query, args.since) else 1)
+    if args.daemon:
+        cfgFilePaths = getAccountConfigFilePaths(args.accounts) if args.accounts is not None else \
+            [os.path.join(os.getcwd(), "configFile.cfg")]
+        sys.exit(0 if runDaemon(cfgFilePaths, args) else 1)
+    if args.accounts is not None:
+        summaries = runBatch(getAccountConfigFilePaths(args.accounts), args, args.batch_workers)
+    else:
+        summaries = [runWorkflow(os.path.join(os.getcwd(), "configFile.cfg"), args)]
+    if args.report is not None:
+        metrics.write_report(args.report, success=all(summary['error'] is None for summary in summaries))
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+import os
+import atexit
+import codecs
+import asyncio
+import threading
+from http.client import HTTPMessage
+from urllib.parse import urljoin, urlparse
+
+import aiohttp
+import requests
+
+from utils import *
+from utils import transfer
+from utils.metrics import metrics
+from utils.transport import RetryPolicy
+logger = log_manager.get_logger(__name__)
+
+
+####################################-ASYNCIO HTTP ENGINE-############################################
+# optional engine (python 3.5+, pip install aiohttp) selected by [httpEngine] field or --engine option
+
+READ_SIZE = 64 * 1024
+MAX_REDIRECTS = 30
+REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+def write_chunk(f, chunk, checksums):
+    """Writes the downloaded chunk and feeds the checksums, run by the executor, so the loop is not blocked by the disk"""
+    f.write(chunk)
+    if checksums is not None:
+        checksums.update(chunk)
+
+
+class AsyncHttpResponse(object):
+    """requests.Response look-alike of an aiohttp response, its body is read on the event loop"""
+
+    def __init__(self, session, response, content=None):
+        self._session = session
+        self._response = response
+        self._content = content
+        self.status_code = response.status
+        self.headers = response.headers
+        self.url = str(response.url)
+
+    async def __read(self):
+        try:
+            return await self._response.read()
+        finally:
+            self._response.release()
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._session.run(self.__read())
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode(self._response.charset or 'utf-8', 'replace')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        """Yields the body in chunks of chunk_size, the data is fetched from the event loop in bigger blocks"""
+        decoder = codecs.getincrementaldecoder(self._response.charset or 'utf-8')('replace') if decode_unicode else None
+        while True:
+            if self._content is not None:
+                data, self._content = self._content, b''
+            else:
+                data = self._session.run(self._response.content.read(max(chunk_size, READ_SIZE)))
+            if not data:
+                break
+            for start in range(0, len(data), chunk_size):
+                chunk = data[start:start + chunk_size]
+                yield decoder.decode(chunk) if decoder else chunk
+        if decoder:
+            tail = decoder.decode(b'', final=True)
+            if tail:
+                yield tail
+
+    def close(self):
+        """Releases the connection, it is closed instead of being reused if the body has not been read"""
+        self._session.call_soon(self._response.release)
+
+
+class AsyncHttpSession(object):
+    """
+    requests.Session look-alike running all the requests on a single asyncio event loop with a pooled connector.
+    The loop runs in a background thread, so one session can be used by many threads at once.
+    Failed requests are retried as the retry policy (utils.transport.RetryPolicy) decides.
+    """
+
+    def __init__(self, retry_policy=None):
+        self.headers = {}
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # cookies are kept in a requests jar, so they are stored and restored the same way for both engines
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='asyncio-http-engine')
+        self._thread.daemon = True
+        self._thread.start()
+        self._client = self.run(self.__create_client())
+        atexit.register(self.close)
+
+    @staticmethod
+    async def __create_client():
+        # the number of simultaneous connections is bounded by the callers (see download_files)
+        return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), cookie_jar=aiohttp.DummyCookieJar())
+
+    def run(self, coroutine):
+        """Runs the coroutine on the event loop and waits for its result, must not be called from the loop thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def call_soon(self, callback):
+        self._loop.call_soon_threadsafe(callback)
+
+    def close(self):
+        """Closes the connector and stops the event loop thread"""
+        if self._client is None:
+            return
+        atexit.unregister(self.close)# the exit handler would keep a discarded session (and its thread) alive
+        self.run(self._client.close())
+        self._client = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def __get_request_headers(self, url, headers):
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        cookie_header = requests.cookies.get_cookie_header(self.cookies, requests.Request('GET', url).prepare())
+        if cookie_header and 'Cookie' not in request_headers:
+            request_headers['Cookie'] = cookie_header
+        return request_headers
+
+    def __extract_cookies(self, url, response):
+        message = HTTPMessage()
+        for value in response.headers.getall('Set-Cookie', []):
+            message['Set-Cookie'] = value
+        self.cookies.extract_cookies(requests.cookies.MockResponse(message),
+                                     requests.cookies.MockRequest(requests.Request('GET', url).prepare()))
+
+    async def __send_with_retries(self, method, url, headers, data, timeout):
+        """Sends a single request, retrying it the same way utils.transport.RetryingHTTPAdapter does"""
+        attempt = 0
+        while True:
+            delay, trial = self.retry_policy.before_request(url)
+            try:
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                try:
+                    response = await self._client.request(method, url, headers=self.__get_request_headers(url, headers),
+                                                          data=data, timeout=timeout, allow_redirects=False)
+                except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                    delay = self.retry_policy.after_response(url, method, attempt, error=e, trial=trial)
+                    if delay is None:
+                        raise
+                    reason = "failed: {}".format(e or type(e).__name__)
+                else:
+                    delay = self.retry_policy.after_response(url, method, attempt, response.status, response.headers,
+                                                             trial=trial)
+                    if delay is None:
+                        return response
+                    response.release()
+                    reason = "returned http status code {}".format(response.status)
+            finally:
+                if trial:
+                    self.retry_policy.release(url)
+            attempt += 1
+            with self.retry_policy.waiting(url, delay, reason):
+                await asyncio.sleep(delay)
+
+    async def _send(self, method, url, headers=None, data=None, timeout=None, allow_redirects=True):
+        """Sends the request following redirects by itself, so cookies set by every response land in the jar"""
+        client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout, sock_read=timeout)
+        for _ in range(MAX_REDIRECTS + 1):
+            response = await self.__send_with_retries(method, url, headers, data, client_timeout)
+            self.__extract_cookies(url, response)
+            location = response.headers.get('location')
+            if not allow_redirects or response.status not in REDIRECT_STATUS_CODES or not location:
+                return response
+            response.release()
+            url = urljoin(url, location)
+            if response.status == 303 or (response.status in (301, 302) and method == 'POST'):
+                method, data = 'GET', None
+        raise requests.exceptions.TooManyRedirects("Exceeded {} redirects".format(MAX_REDIRECTS))
+
+    async def __fetch(self, method, url, stream, **kwargs):
+        response = await self._send(method, url, **kwargs)
+        if stream:
+            return response, None
+        try:
+            return response, await response.read()
+        finally:
+            response.release()
+
+    def request(self, method, url, headers=None, data=None, timeout=None, stream=False, allow_redirects=True):
+        try:
+            response, content = self.run(self.__fetch(method, url, stream, headers=headers, data=data,
+                                                      timeout=timeout, allow_redirects=allow_redirects))
+        except asyncio.TimeoutError:
+            raise requests.exceptions.Timeout("{} {} timed out".format(method, url))
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError("{} {} failed: {}".format(method, url, e))
+        return AsyncHttpResponse(self, response, content)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    async def __download_file(self, url, file_path, headers, timeout, progress, checksums):
+        """
+        Coroutine counterpart of transfer.download_file. File operations and hashing run in the default executor,
+        so a slow disk or a big resumed '.part' file doesn't hold up the other transfers on the loop.
+        """
+        part_file_path = file_path + transfer.PART_FILE_SUFFIX
+        offset = os.path.getsize(part_file_path) if os.path.isfile(part_file_path) else 0
+        r = await self._send('GET', url, headers=transfer.get_resume_headers(file_path, offset, headers),
+                             timeout=timeout)
+        executor = self._loop.run_in_executor
+        try:
+            mode, offset = await executor(None, transfer.get_part_file_mode, r.status, r, url, file_path, offset)
+            if checksums is not None:
+                await executor(None, transfer.resume_checksums, checksums, file_path, mode)
+            if mode is None:
+                return 0
+            total_length = transfer.get_total_length(r, offset)
+            downloaded = offset
+            chunk_size = transfer.get_chunk_size(total_length - offset if total_length is not None else None)
+            f = await executor(None, open, part_file_path, mode)
+            try:
+                async for chunk in r.content.iter_chunked(chunk_size):
+                    await executor(None, write_chunk, f, chunk, checksums)
+                    downloaded += len(chunk)
+                    if progress is not None:
+                        progress(downloaded, total_length)
+            finally:
+                await executor(None, f.close)
+        finally:
+            r.release()
+        await executor(None, transfer.finish_part_file, file_path, downloaded, total_length)
+        return downloaded - offset
+
+    async def __download_files(self, downloads, workers, workers_per_host, headers, timeout,
+                               on_start, on_progress, on_done, checksums):
+        semaphore = asyncio.Semaphore(max(1, workers))
+        host_semaphores = {}
+
+        async def download(index, url, file_path):
+            host = urlparse(url).netloc
+            if host not in host_semaphores:
+                host_semaphores[host] = asyncio.Semaphore(max(1, workers_per_host))
+            error = None
+            # the host slot is taken first, so downloads waiting for a busy host don't hold the global ones
+            async with host_semaphores[host]:
+                async with semaphore:
+                    if on_start is not None:
+                        on_start(index)
+                    progress = None
+                    if on_progress is not None:
+                        progress = lambda downloaded, total: on_progress(index, downloaded, total)
+                    try:
+                        with metrics.span('download', file=os.path.basename(file_path)) as span:
+                            span.bytes = await self.__download_file(url, file_path, headers, timeout, progress,
+                                                                    checksums[index] if checksums else None)
+                    except Exception as e:
+                        error = e
+            if on_done is not None:# e.g. indexing the file, kept off the loop as well
+                await self._loop.run_in_executor(None, on_done, index, error)
+            return error
+
+        return await asyncio.gather(*[download(index, url, file_path)
+                                      for index, (url, file_path) in enumerate(downloads)])
+
+    def download_files(self, downloads, workers, workers_per_host=transfer.DEFAULT_WORKERS_PER_HOST, headers=None,
+                       timeout=100, on_start=None, on_progress=None, on_done=None, checksums=None):
+        """
+        Downloads the files at once on the event loop, at most 'workers' of them (and 'workers_per_host' from
+        a single host) simultaneously. Interrupted downloads are resumed the same way transfer.download_file does.
+        on_start and on_progress are invoked on the event loop thread, so they must be quick and must not make
+        requests with this session, on_done is invoked by an executor thread.
+        :param downloads: list of (url, file_path) tuples
+        :param on_start: callable(index) invoked when the download of downloads[index] starts
+        :param on_progress: callable(index, downloadedBytes, totalBytes) invoked while downloading
+        :param on_done: callable(index, error) invoked when the download ends, error is None if it succeeded
+        :param checksums: list of utils.integrity.Checksums (or None) fed with the content of downloads[index]
+        :return: list of errors, None for the files downloaded successfully
+        """
+        return self.run(self.__download_files(downloads, workers, workers_per_host, headers, timeout,
+                                              on_start, on_progress, on_done, checksums))
@@ -1,20 +1,29 @@
 #!/usr/bin/env python
 import sys
-import requests
 import os
 import configparser
 import argparse
 import httplib2
 import io
+import json
+import time
+import random
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import oauth2client
 from oauth2client import client
 from oauth2client import tools
 import apiclient
 from apiclient import discovery
 from apiclient.http import MediaFileUpload
+from apiclient.http import MediaUpload
 from apiclient.http import MediaIoBaseDownload
+from apiclient.errors import HttpError
 
 from utils import *
+from utils.integrity import Checksums, ChecksumMismatchError, hash_file
+from utils.metrics import metrics
 logger = log_manager.get_logger(__name__)
 
 ####################################-GOOGLE DRIVE MANAGER############################################
@@ -22,17 +31,36 @@ logger = log_manager.get_logger(__name__)
 SCOPES = 'https://www.googleapis.com/auth/drive'
 CLIENT_SECRET_FILE = 'client_secret.json'
 FILE_TYPE=frozenset(["FILE", "FOLDER"])
+STREAM_CHUNK_SIZE = 8 * 256 * 1024 # has to be a multiple of 256 KB
+DEFAULT_UPLOAD_CHUNK_SIZE_MB = 8
+DEFAULT_UPLOAD_RETRIES = 5
+RETRIABLE_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+BATCH_REQUESTS_LIMIT = 100 # max number of calls in a single batch request accepted by Drive API
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
 
 class GoogleDriveManager():
     """Allows to upload and download new content to Google Drive"""
 
-    def __init__(self, cfg_file_path):
+    def __init__(self, cfg_file_path, service=None):
+        """
+        :param service: already built Drive v3 service (e.g. a local fake of it), skips authorization if given
+        """
         self.__set_config_data(cfg_file_path)
         self._root_folder= GoogleDriveFile(self.folder_name)
-        self._credentials = self.__get_credentials()
-        self._http_auth = self._credentials.authorize(httplib2.Http())
-        self._service = discovery.build('drive', 'v3', http=self._http_auth)
-        self._root_folder.id=self.check_if_file_exist_create_new_one(self._root_folder.name)
+        self._thread_data = threading.local() # httplib2.Http is not thread safe, each upload worker gets its own
+        if service is None:
+            self._credentials = self.__get_credentials()
+            self._http_auth = self._credentials.authorize(httplib2.Http())
+            self._service = discovery.build('drive', 'v3', http=self._http_auth)
+        else:
+            self._credentials = None
+            self._http_auth = None
+            self._service = service
+        self._thread_data.http = self._http_auth
+        self._folder_contents = {} # {folder id: {file name: file id}} listed once per folder
+        self._file_checksums = {} # {file id: (md5Checksum, size)} of the listed files, folders have none
+        self._folder_contents_lock = threading.Lock()
+        self._root_folder.id = self.__get_root_folder_id()
         self._mimetypes = {'pdf':'application/pdf', 'zip':'application/zip', 'mobi':'application/x-mobipocket-ebook', 'epub':'application/epub+zip'}
         # downgrading logging level for google api
         logging.getLogger("apiclient").setLevel(logging.WARNING)
@@ -44,6 +72,66 @@ class GoogleDriveManager():
             raise configparser.Error('{} file not found'.format(cfg_file_path))
         self.app_name = configuration.get("GOOGLE_DRIVE_DATA", 'gdAppName')
         self.folder_name = configuration.get("GOOGLE_DRIVE_DATA", 'gdFolderName')
+        self.upload_workers = 1
+        self.upload_chunk_size = DEFAULT_UPLOAD_CHUNK_SIZE_MB * 1024 * 1024
+        self.upload_retries = DEFAULT_UPLOAD_RETRIES
+        try:
+            self.upload_workers = max(1, configuration.getint("GOOGLE_DRIVE_DATA", 'gdUploadWorkers'))
+        except (configparser.Error, ValueError):
+            pass
+        try:# chunk size has to be a multiple of 256 KB
+            self.upload_chunk_size = max(1, int(configuration.getfloat("GOOGLE_DRIVE_DATA", 'gdChunkSize') * 4)) * 256 * 1024
+        except (configparser.Error, ValueError):
+            pass
+        try:
+            self.upload_retries = max(0, configuration.getint("GOOGLE_DRIVE_DATA", 'gdUploadRetries'))
+        except (configparser.Error, ValueError):
+            pass
+
+    def __get_credential_dir(self):
+        credential_dir = os.path.join(os.getcwd(), '.credentials')
+        if not os.path.exists(credential_dir):
+            os.makedirs(credential_dir)
+        return credential_dir
+
+    def __get_folder_ids_cache_path(self):
+        return os.path.join(self.__get_credential_dir(), self.app_name + '_folders.json')
+
+    def __load_folder_ids_cache(self):
+        try:
+            with open(self.__get_folder_ids_cache_path(), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __save_folder_ids_cache(self, folder_ids):
+        try:
+            with open(self.__get_folder_ids_cache_path(), 'w') as f:
+                json.dump(folder_ids, f)
+        except (IOError, OSError) as e:
+            logger.debug('Cannot store folder ids: {}'.format(e))
+
+    def __get_root_folder_id(self):
+        """Gets id of [gdFolderName] folder, cached on disk to spare the lookup query on every run"""
+        folder_ids = self.__load_folder_ids_cache()
+        folder_id = folder_ids.get(self.folder_name)
+        if not folder_id:
+            folder_id = self.check_if_file_exist_create_new_one(self.folder_name)
+            folder_ids[self.folder_name] = folder_id
+            self.__save_folder_ids_cache(folder_ids)
+        return folder_id
+
+    def __forget_root_folder_id(self):
+        """Called when the cached root folder id is no longer valid, next run looks the folder up again"""
+        folder_ids = self.__load_folder_ids_cache()
+        if folder_ids.pop(self.folder_name, None) is not None:
+            self.__save_folder_ids_cache(folder_ids)
+            logger.info('Folder {} not found, its id will be looked up again during the next run'.format(self.folder_name))
+
+    def __handle_upload_error(self, error, file_name):
+        if isinstance(error, HttpError) and error.resp.status == 404:
+            self.__forget_root_folder_id()
+        logger.error('Error {} occurred while sending file: {} to Google Drive'.format(error, file_name))
 
     def __get_credentials(self):
         '''Gets valid user credentials from storage.
@@ -51,11 +139,7 @@ class GoogleDriveManager():
         the OAuth2 flow is completed to obtain the new credentials.
         Returns: the obtained credentials.
         '''
-        home_dir = os.getcwd()
-        credential_dir = os.path.join(home_dir, '.credentials')
-        if not os.path.exists(credential_dir):
-            os.makedirs(credential_dir)
-        credential_path = os.path.join(credential_dir, self.app_name+'.json')
+        credential_path = os.path.join(self.__get_credential_dir(), self.app_name+'.json')
         store = oauth2client.file.Storage(credential_path)
         credentials = store.get()
         if not credentials or credentials.invalid:
@@ -76,14 +160,102 @@ class GoogleDriveManager():
             logger.success('Storing credentials to ' + credential_path)
         return credentials
 
+    def __execute_batch(self, batch_requests, errors=None):
+        """
+        Executes {key: request} using as few batch calls as possible.
+        :param errors: dict filled with {key: exception} of the failed requests
+        :return: {key: response}, failed requests are logged and left out
+        """
+        keys = list(batch_requests.keys())
+        responses = {}
+
+        def callback(request_id, response, exception):
+            key = keys[int(request_id)]
+            if exception is not None:
+                logger.error('Batched request for {} failed: {}'.format(key, exception))
+                if errors is not None:
+                    errors[key] = exception
+            else:
+                responses[key] = response
+
+        for begin in range(0, len(keys), BATCH_REQUESTS_LIMIT):
+            batch = self._service.new_batch_http_request(callback=callback)
+            for i in range(begin, min(begin + BATCH_REQUESTS_LIMIT, len(keys))):
+                batch.add(batch_requests[keys[i]], request_id=str(i))
+            batch.execute(http=self.__get_thread_http())
+        return responses
+
+    def __list_folder_request(self, parent_id, page_token=None):
+        return self._service.files().list(q="'%s' in parents and trashed = false" % parent_id, spaces='drive',
+                                          fields='nextPageToken, files(id, name, md5Checksum, size)', pageSize=1000, pageToken=page_token)
+
+    def __list_folders(self, parent_ids):
+        """
+        Lists the not yet listed folders, first pages of all of them are fetched in batches.
+        Raises the error of a failed listing, so a folder which could not be listed is never taken for an empty one.
+        """
+        with self._folder_contents_lock:
+            parent_ids = [parent_id for parent_id in set(parent_ids) if parent_id not in self._folder_contents]
+        if not parent_ids:
+            return
+        errors = {}
+        if len(parent_ids) == 1:
+            responses = {parent_ids[0]: self.__list_folder_request(parent_ids[0]).execute(http=self.__get_thread_http())}
+        else:
+            responses = self.__execute_batch(dict((parent_id, self.__list_folder_request(parent_id)) for parent_id in parent_ids),
+                                             errors)
+        for parent_id, response in responses.items():
+            contents = {}
+            checksums = {}
+            while True:
+                for file in response.get('files', []):
+                    contents.setdefault(file.get('name'), file.get('id'))
+                    if file.get('md5Checksum'):
+                        checksums[file.get('id')] = (file.get('md5Checksum'), int(file.get('size', -1)))
+                page_token = response.get('nextPageToken', None)
+                if page_token is None:
+                    break
+                response = self.__list_folder_request(parent_id, page_token).execute(http=self.__get_thread_http())
+            logger.debug('Listed {} files in folder {}'.format(len(contents), parent_id))
+            with self._folder_contents_lock:
+                self._folder_contents.setdefault(parent_id, contents)
+                self._file_checksums.update(checksums)
+        if errors:# the listed folders are kept, the failed ones are listed again by the next call
+            raise next(iter(errors.values()))
+
+    def __list_folder(self, parent_id):
+        """Lists the folder once, returns {name: id} map kept up to date with files created later on"""
+        self.__list_folders([parent_id])
+        with self._folder_contents_lock:
+            return self._folder_contents.get(parent_id, {})
+
+    def __remember_file(self, file_name, file_id, parent_id, md5=None, size=None):
+        """Adds a newly created file to the folder listing (if the folder has been listed)"""
+        with self._folder_contents_lock:
+            if parent_id in self._folder_contents:
+                self._folder_contents[parent_id][file_name] = file_id
+            if md5 is not None:
+                self._file_checksums[file_id] = (md5, size)
+
+    def __get_file_checksum(self, file_id):
+        """Returns (md5Checksum, size) of a listed file, None if Drive doesn't know its checksum"""
+        with self._folder_contents_lock:
+            return self._file_checksums.get(file_id)
+
+    @staticmethod
+    def __check_uploaded_file(response, file_name, checksums):
+        """Compares the checksum computed by Drive with the one of the sent data"""
+        if response.get('md5Checksum') and response.get('md5Checksum') != checksums.md5:
+            raise ChecksumMismatchError("Google Drive received corrupted content of {}: MD5 {} instead of {}".format(
+                file_name, response.get('md5Checksum'), checksums.md5))
+
     def __find_folder_or_file_by_name(self,file_name,parent_id=None):
         if(file_name ==None or len(file_name)==0):
             return False
-        page_token = None
         if parent_id is not None:
-            query=("name = '%s' and '%s' in parents"%(file_name,parent_id))
-        else:
-            query=("name = '%s'"%file_name)
+            return self.__list_folder(parent_id).get(file_name, False)
+        page_token = None
+        query=("name = '%s'"%file_name)
         while True:
             response = self._service.files().list(q=query,spaces='drive',fields='nextPageToken, files(id, name, parents)',pageToken=page_token).execute()
             for file in response.get('files', []):
@@ -107,6 +279,55 @@ class GoogleDriveManager():
                 id=self.__create_new_folder(file_name,parent_id)
         return id
 
+    def find_files(self, names_by_parent):
+        """
+        Checks existence of many files in many folders, listing all the not yet listed folders in batches.
+        :param names_by_parent: {parent folder id: list of file names}
+        :return: {(parent folder id, file name): file id or False}
+        """
+        self.__list_folders(names_by_parent.keys())
+        return dict(((parent_id, name), self.__list_folder(parent_id).get(name, False))
+                    for parent_id, names in names_by_parent.items() for name in names)
+
+    def create_folders(self, folder_names, parent_id=None):
+        """
+        Gets ids of the folders, creating the missing ones in batches.
+        :return: {folder name: folder id}, folders which could not be created are left out
+        """
+        parent_id = parent_id if parent_id is not None else self._root_folder.id
+        contents = self.__list_folder(parent_id)
+        folder_ids = dict((name, contents[name]) for name in folder_names if name in contents)
+        missing_names = [name for name in set(folder_names) if name not in folder_ids]
+        batch_requests = dict((name, self._service.files().create(body={'name': name, 'mimeType': FOLDER_MIME_TYPE,
+                                                                        'parents': [parent_id]}, fields='id'))
+                              for name in missing_names)
+        for name, file in self.__execute_batch(batch_requests).items():
+            logger.success('Created Folder {} ID: {}'.format(name, file.get('id')))
+            self.__remember_file(name, file.get('id'), parent_id)
+            folder_ids[name] = file.get('id')
+        return folder_ids
+
+    def update_files_metadata(self, metadata_by_file_id):
+        """
+        Updates metadata of many files in batches.
+        :param metadata_by_file_id: {file id: metadata body, e.g. {'description': ...}}
+        :return: ids of the updated files
+        """
+        batch_requests = dict((file_id, self._service.files().update(fileId=file_id, body=body, fields='id'))
+                              for file_id, body in metadata_by_file_id.items())
+        return list(self.__execute_batch(batch_requests).keys())
+
+    def share_files(self, file_ids, permission):
+        """
+        Adds the permission to many files in batches.
+        :param permission: permission body, e.g. {'type': 'user', 'role': 'reader', 'emailAddress': ...}
+        :return: ids of the shared files
+        """
+        batch_requests = dict((file_id, self._service.permissions().create(fileId=file_id, body=permission,
+                                                                           fields='id'))
+                              for file_id in file_ids)
+        return list(self.__execute_batch(batch_requests).keys())
+
     def list_all_files_in_main_folder(self):
         results = self._service.files().list().execute()
         items = results.get('files', [])
@@ -124,8 +345,10 @@ class GoogleDriveManager():
             'mimeType' : 'application/vnd.google-apps.folder',
             'parents': parent_id
         }
-        file = self._service.files().create(body=file_metadata, fields='id').execute()
+        file = self._service.files().create(body=file_metadata, fields='id').execute(http=self.__get_thread_http())
         logger.success('Created Folder ID: %s' % file.get('id'))
+        if parent_folders_id is not None:
+            self.__remember_file(folder_name, file.get('id'), parent_folders_id)
         return file.get('id')
 
     def __extract_filename_ext_and_mimetype_from_path(self, path):
@@ -137,33 +360,194 @@ class GoogleDriveManager():
             mime_type = self._mimetypes[file_extension]
         return file_name, file_extension, mime_type
 
-    def __insert_file_into_folder(self, file_name, path, parent_folder_id, file_mime_type=None):
-        parent_id= parent_folders_id if parent_folder_id is None else [parent_folder_id]
+    def __get_thread_http(self):
+        """Returns authorized http object of the current thread (None when using an injected service)"""
+        if self._credentials is None:
+            return None
+        if not hasattr(self._thread_data, 'http'):
+            self._thread_data.http = self._credentials.authorize(httplib2.Http())
+        return self._thread_data.http
+
+    def __execute_resumable_upload(self, request, file_name):
+        """Uploads the media chunk by chunk, after a failure the upload is resumed from the last committed byte"""
+        http = self.__get_thread_http()
+        response = None
+        failures = 0
+        with metrics.span('upload', file=file_name) as span:
+            while response is None:
+                try:
+                    status, response = request.next_chunk(http=http)
+                    failures = 0
+                    if status:
+                        logger.debug("Upload of {} {:d}%".format(file_name, int(status.progress() * 100)))
+                except (HttpError, httplib2.HttpLib2Error, socket.error, IOError) as e:
+                    if isinstance(e, HttpError) and e.resp.status not in RETRIABLE_STATUS_CODES:
+                        raise
+                    failures += 1
+                    if failures > self.upload_retries:
+                        raise
+                    span.retries += 1
+                    delay = random.uniform(0, 2 ** failures)
+                    logger.info("Upload of {} interrupted ({}), resuming in {:.1f}s...".format(file_name, e, delay))
+                    time.sleep(delay)
+            # the size of a stream might be unknown, then the last chunk is not counted
+            span.bytes = request.resumable.size() if request.resumable.size() is not None else request.resumable_progress
+        return response
+
+    def __insert_file_into_folder(self, file_name, path, parent_folder_id, file_mime_type=None, checksums=None,
+                                  file_id=None):
+        """Uploads the file, replacing the content of file_id if given, the result is checked against checksums"""
+        parent_id= parent_folder_id if parent_folder_id is None else [parent_folder_id]
         file_metadata = {
           'name' : file_name,
           'parents' : parent_id
         }
+        if checksums is None:
+            checksums = hash_file(path)
         media = MediaFileUpload(path,mimetype=file_mime_type,  # if None, it will be guessed 
-                                resumable=True)
-        file = self._service.files().create(body=file_metadata,media_body=media,fields='id').execute()
+                                chunksize=self.upload_chunk_size, resumable=True)
+        if file_id is None:
+            request = self._service.files().create(body=file_metadata,media_body=media,fields='id, md5Checksum')
+        else:
+            request = self._service.files().update(fileId=file_id,media_body=media,fields='id, md5Checksum')
+        file = self.__execute_resumable_upload(request, file_name)
         logger.debug('File ID: {}'.format(file.get('id')))
+        self.__check_uploaded_file(file, file_name, checksums)
+        if parent_folder_id is not None:
+            self.__remember_file(file_name, file.get('id'), parent_folder_id, checksums.md5, checksums.size)
         return file.get('id') 
+
+    def __send_file(self, file_name, path, file_mime_type, parent_id, checksums=None, file_id=None):
+        try:
+            self.__insert_file_into_folder(file_name, path, parent_id, file_mime_type, checksums, file_id)
+            logger.success('File {} succesfully sent to Google Drive'.format(file_name))
+        except Exception as e:
+            self.__handle_upload_error(e, file_name)
+
+    def __is_same_file(self, file_id, path, checksums):
+        """Checks if the Drive file has the content of the local one, files without a Drive checksum are trusted"""
+        remote = self.__get_file_checksum(file_id)
+        if remote is None:
+            return True
+        if remote[1] >= 0 and remote[1] != os.path.getsize(path):
+            return False
+        return remote[0] == (checksums if checksums is not None else hash_file(path)).md5
+
+    def __get_target_folder_ids(self, file_names, into_folders):
+        """Returns {file name: id of the folder the file goes to}, per book folders are named as the file without extension"""
+        if not into_folders:
+            return dict((file_name, self._root_folder.id) for file_name in file_names)
+        folder_ids = self.create_folders([os.path.splitext(file_name)[0] for file_name in file_names])
+        return dict((file_name, folder_ids[os.path.splitext(file_name)[0]]) for file_name in file_names
+                    if os.path.splitext(file_name)[0] in folder_ids)
        
-    def send_files(self, file_paths):
+    def send_files(self, file_paths, into_folders=False, checksums=None):
+        """
+        Uploads the files not existing on Google Drive yet, using [gdUploadWorkers] simultaneous uploads.
+        A same-named file is replaced if its md5Checksum differs from the local file.
+        :param into_folders: puts every book into its own folder, named as the book file without extension
+        :param checksums: {file path: utils.integrity.Checksums} known from the download, missing ones are computed
+        """
+        checksums = checksums or {}
         if file_paths is None or len(file_paths)==0:
             raise ValueError("Incorrect file paths argument format")
-        for path in file_paths:
-            if os.path.exists(path):
-                try:
-                    file_attrs = self.__extract_filename_ext_and_mimetype_from_path(path)
-                    if not self.__find_folder_or_file_by_name(file_attrs[0], self._root_folder.id):
-                        self.__insert_file_into_folder(file_attrs[0], path, self._root_folder.id, file_attrs[2])
-                        logger.success('File {} succesfully sent to Google Drive'.format(file_attrs[0]))
-                    else:
-                        logger.info('File {} already exists on Google Drive'.format(file_attrs[0]))
-                except Exception as e:
-                        logger.error('Error {} occurred while sending file: {} to Google Drive'.format(e, file_attrs[0]))
+        files = dict((path, self.__extract_filename_ext_and_mimetype_from_path(path))
+                     for path in file_paths if os.path.exists(path))
+        try:
+            parent_ids = self.__get_target_folder_ids([file_attrs[0] for file_attrs in files.values()], into_folders)
+            names_by_parent = {}
+            for file_name, parent_id in parent_ids.items():
+                names_by_parent.setdefault(parent_id, []).append(file_name)
+            existing_files = self.find_files(names_by_parent)
+        except Exception as e:
+            logger.error('Error {} occurred while checking files on Google Drive'.format(e))
+            return
+        uploads = []
+        for path, file_attrs in files.items():
+            if file_attrs[0] not in parent_ids:
+                logger.error('Cannot send file: {}, its folder has not been created'.format(file_attrs[0]))
+            elif existing_files[(parent_ids[file_attrs[0]], file_attrs[0])]:
+                file_id = existing_files[(parent_ids[file_attrs[0]], file_attrs[0])]
+                if self.__is_same_file(file_id, path, checksums.get(path)):
+                    logger.info('File {} already exists on Google Drive'.format(file_attrs[0]))
+                else:
+                    logger.warning('File {} on Google Drive differs from the local one, replacing it'.format(file_attrs[0]))
+                    uploads.append((file_attrs[0], path, file_attrs[2], parent_ids[file_attrs[0]], checksums.get(path), file_id))
+            else:
+                uploads.append((file_attrs[0], path, file_attrs[2], parent_ids[file_attrs[0]], checksums.get(path)))
+        if self.upload_workers > 1 and len(uploads) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.upload_workers, len(uploads))) as executor:
+                list(executor.map(lambda upload: self.__send_file(*upload), uploads))
+        else:
+            for upload in uploads:
+                self.__send_file(*upload)
                                
+    def send_stream(self, file_name, stream, size=None, into_folder=False):
+        """
+        Uploads data read from a (non seekable) stream as file_name, unless such a file already exists.
+        :param into_folder: puts the file into its own folder, named as the file without extension
+        """
+        try:
+            file_attrs = self.__extract_filename_ext_and_mimetype_from_path(file_name)
+            parent_id = self.__get_target_folder_ids([file_name], into_folder).get(file_name)
+            if parent_id is None:
+                logger.error('Cannot send file: {}, its folder has not been created'.format(file_name))
+                return
+            file_id = self.__find_folder_or_file_by_name(file_name, parent_id)
+            if file_id:
+                remote = self.__get_file_checksum(file_id)
+                # the content of the stream is not known before sending it, a different size reveals a broken file
+                if size is None or remote is None or remote[1] < 0 or remote[1] == size:
+                    logger.info('File {} already exists on Google Drive'.format(file_name))
+                    return
+                logger.warning('File {} on Google Drive has {} bytes instead of {}, replacing it'.format(
+                    file_name, remote[1], size))
+            media = StreamMediaUpload(stream, file_attrs[2], size, chunksize=self.upload_chunk_size)
+            if file_id:
+                request = self._service.files().update(fileId=file_id, media_body=media, fields='id, md5Checksum')
+            else:
+                request = self._service.files().create(body={'name': file_name, 'parents': [parent_id]},
+                                                       media_body=media, fields='id, md5Checksum')
+            response = self.__execute_resumable_upload(request, file_name)
+            logger.debug('File ID: {}'.format(response.get('id')))
+            self.__check_uploaded_file(response, file_name, media.checksums)
+            self.__remember_file(file_name, response.get('id'), parent_id, media.checksums.md5, media.checksums.size)
+            logger.success('File {} succesfully sent to Google Drive'.format(file_name))
+        except Exception as e:
+            self.__handle_upload_error(e, file_name)
+
+    def send_streams(self, stream_openers, into_folders=False):
+        """
+        Uploads many streams using [gdUploadWorkers] simultaneous uploads, see send_stream.
+        :param stream_openers: list of (file_name, open_stream) tuples, open_stream() is called by the upload worker
+                               and returns a file object with 'size' attribute, or None if the file cannot be read
+        """
+        # the folders are created and listed up front, so the workers neither race to create the same folder
+        # nor list it again
+        try:
+            parent_ids = self.__get_target_folder_ids([file_name for file_name, _ in stream_openers], into_folders)
+            self.__list_folders(parent_ids.values())
+        except Exception as e:
+            logger.error('Error {} occurred while checking files on Google Drive'.format(e))
+            return
+
+        def send(stream_opener):
+            file_name, open_stream = stream_opener
+            stream = open_stream()
+            if stream is None:
+                return
+            try:
+                self.send_stream(file_name, stream, getattr(stream, 'size', None), into_folder=into_folders)
+            finally:
+                stream.close()
+
+        if self.upload_workers > 1 and len(stream_openers) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.upload_workers, len(stream_openers))) as executor:
+                list(executor.map(send, stream_openers))
+        else:
+            for stream_opener in stream_openers:
+                send(stream_opener)
+
     def download_file(self,file_name,file_id):
         request = self._service.files().get_media(fileId=file_id)
         fh = io.FileIO(file_name, 'wb')
@@ -173,6 +557,54 @@ class GoogleDriveManager():
             status, done = downloader.next_chunk()
             logger.debug("Download %d%%." % int(status.progress() * 100))
 
+class StreamMediaUpload(MediaUpload):
+    """
+    Resumable media upload reading a non seekable stream, only the not yet committed chunk is kept in memory.
+    Checksums of the data read so far are kept in 'checksums' attribute.
+    """
+
+    def __init__(self, stream, mimetype=None, size=None, chunksize=STREAM_CHUNK_SIZE):
+        super(StreamMediaUpload, self).__init__()
+        self._stream = stream
+        self._mimetype = mimetype if mimetype is not None else 'application/octet-stream'
+        self._size = size
+        self._chunksize = chunksize
+        self._buffer = b''
+        self._buffer_begin = 0
+        self.checksums = Checksums()
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def size(self):
+        return self._size
+
+    def resumable(self):
+        return True
+
+    def has_stream(self):
+        return False
+
+    def getbytes(self, begin, length):
+        if begin < self._buffer_begin:
+            raise ValueError("Cannot rewind the stream to byte {}".format(begin))
+        # bytes before begin have been committed by the server, forget them
+        self._buffer = self._buffer[begin - self._buffer_begin:]
+        self._buffer_begin = begin
+        while len(self._buffer) < length:
+            data = self._stream.read(length - len(self._buffer))
+            if not data:
+                break
+            self.checksums.update(data)
+            self._buffer += data
+        return self._buffer[:length]
+
+    def to_json(self):
+        raise NotImplementedError("Stream uploads cannot be serialized")
+
 class GoogleDriveFile():
     ''' Helper class that describes File or Folder stored on GoogleDrive server'''
     def __init__(self,file_name):
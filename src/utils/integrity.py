@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import os
+import mmap
+import hashlib
+
+from utils import *
+logger = log_manager.get_logger(__name__)
+
+
+####################################-CONTENT INTEGRITY-############################################
+
+HASH_SLICE_SIZE = 1024 * 1024# hashlib releases the GIL while hashing a slice, so many files are hashed in parallel
+DEFAULT_VERIFY_WORKERS = 4
+
+
+class ChecksumMismatchError(ValueError):
+    """Raised when the checksum of transferred data differs from the expected one"""
+
+
+class Checksums(object):
+    """
+    SHA-256 (stored in the library index) and MD5 (the one Google Drive reports as md5Checksum) of data fed
+    chunk by chunk, e.g. while it is being downloaded, together with its size
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def update(self, data):
+        self._sha256.update(data)
+        self._md5.update(data)
+        self.size += len(data)
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    def to_dict(self):
+        return {'size': self.size, 'sha256': self.sha256, 'md5': self.md5}
+
+
+def hash_file(path, checksums=None):
+    """
+    Reads the file through a memory map (no copying into python file buffers) and feeds it to checksums.
+    :param checksums: Checksums updated with the content of the file, a new one if None
+    :return: the checksums
+    """
+    if checksums is None:
+        checksums = Checksums()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:# an empty file cannot be mapped
+            return checksums
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for begin in range(0, size, HASH_SLICE_SIZE):
+                checksums.update(mapped[begin:begin + HASH_SLICE_SIZE])
+        finally:
+            mapped.close()
+    return checksums
+
+
+def _hash_file_or_none(path):
+    try:
+        return hash_file(path)
+    except (IOError, OSError) as e:
+        if os.path.exists(path):
+            logger.error("Cannot read '{}': {}".format(path, e))
+        return None
+
+
+def hash_files(paths, workers=DEFAULT_VERIFY_WORKERS):
+    """
+    Hashes the files using a pool of 'workers' threads.
+    :return: list of (path, Checksums) tuples in the order of paths, Checksums is None if the file cannot be read
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    paths = list(paths)
+    if not paths:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(paths)))) as executor:
+        return list(zip(paths, executor.map(_hash_file_or_none, paths)))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from utils import *
+logger = log_manager.get_logger(__name__)
+
+
+####################################-LOCAL LIBRARY INDEX-############################################
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    nid TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    normalized_title TEXT NOT NULL,
+    download_urls TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS books_normalized_title_nocase ON books (normalized_title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_first_seen ON books (first_seen);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    nid TEXT NOT NULL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    md5 TEXT
+);
+CREATE INDEX IF NOT EXISTS files_nid ON files (nid);
+CREATE TABLE IF NOT EXISTS synced_books (
+    nid TEXT PRIMARY KEY,
+    entries TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+FILE_CHECKSUM_COLUMNS = ('sha256', 'md5')# added to the files table of indexes created by older versions
+
+
+class LibraryIndex(object):
+    """Persistent SQLite index of the books claimed on the account and of their downloaded files"""
+
+    def __init__(self, db_file_path, normalize_title):
+        """
+        :param db_file_path: path of the SQLite database file, created if it doesn't exist
+        :param normalize_title: callable converting a book title into its normalized (file name) form
+        """
+        self._db_file_path = db_file_path
+        self._normalize_title = normalize_title
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_file_path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+            columns = set(row['name'] for row in self._connection.execute("PRAGMA table_info(files)"))
+            for column in FILE_CHECKSUM_COLUMNS:
+                if column not in columns:
+                    self._connection.execute("ALTER TABLE files ADD COLUMN {} TEXT".format(column))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def __row_to_book(row):
+        return {'title': row['title'], 'id': row['nid'], 'downloadUrls': json.loads(row['download_urls'])}
+
+    def update_books(self, book_data):
+        """
+        Stores the books listed on the account page.
+        :param book_data: list of {'title':.., 'id':.., 'downloadUrls':{..}} dicts
+        :return: list of books seen for the first time
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            known = set(row[0] for row in self._connection.execute("SELECT nid FROM books"))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO books (nid, title, normalized_title, download_urls, first_seen, last_seen) "
+                "VALUES (?, ?, ?, ?, COALESCE((SELECT first_seen FROM books WHERE nid = ?), ?), ?)",
+                [(book['id'], book['title'], self._normalize_title(book['title']), json.dumps(book['downloadUrls']),
+                  book['id'], now, now) for book in book_data])
+        return [book for book in book_data if book['id'] not in known]
+
+    def find_books_by_titles(self, titles):
+        """Returns the indexed books matching the given titles (compared in their normalized, case insensitive form)"""
+        normalized_titles = list(set(self._normalize_title(title) for title in titles))
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM books WHERE normalized_title COLLATE NOCASE IN ({})".format(','.join('?' * len(normalized_titles))),
+                normalized_titles).fetchall()
+        return [self.__row_to_book(row) for row in rows]
+
+    def is_file_downloaded(self, path):
+        """Checks if the file has been downloaded, without touching the file system"""
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM files WHERE path = ?", (path,)).fetchone()
+        return row is not None
+
+    def add_file(self, path, nid, form, checksums=None):
+        """
+        Stores size and modification time of a downloaded file.
+        :param checksums: utils.integrity.Checksums of the content, None if not known (e.g. a file found on disk)
+        """
+        stat = os.stat(path)
+        sha256, md5 = (checksums.sha256, checksums.md5) if checksums is not None else (None, None)
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO files (path, nid, format, size, mtime, sha256, md5) "
+                                     "VALUES (?, ?, ?, ?, ?, ?, ?)", (path, nid, form, stat.st_size, stat.st_mtime,
+                                                                      sha256, md5))
+
+    def get_files(self):
+        """Returns all the indexed files as dicts with path, nid, format, size, mtime, sha256 and md5 keys"""
+        with self._lock:
+            rows = self._connection.execute("SELECT * FROM files ORDER BY path").fetchall()
+        return [dict((key, row[key]) for key in row.keys()) for row in rows]
+
+    def forget_file(self, path):
+        """Removes the file record and the sync record of its book, so the next run downloads the file again"""
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT nid FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                self._connection.execute("DELETE FROM files WHERE path = ?", (path,))
+                self._connection.execute("DELETE FROM synced_books WHERE nid = ?", (row['nid'],))
+
+    def forget_files(self):
+        """Removes all file and sync records, so the download decisions are made on the basis of the file system again"""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM files")
+            self._connection.execute("DELETE FROM synced_books")
+
+    def get_synced_books(self):
+        """Returns {nid: set of entries} of all the books synced by the previous runs"""
+        with self._lock:
+            rows = self._connection.execute("SELECT nid, entries FROM synced_books").fetchall()
+        return dict((nid, set(tuple(entry) for entry in json.loads(entries))) for nid, entries in rows)
+
+    def mark_books_synced(self, entries):
+        """
+        Marks books as synced, the entries are merged with the already stored ones.
+        :param entries: {nid: set of hashable entries} describing what has been synced
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            for nid, book_entries in entries.items():
+                row = self._connection.execute("SELECT entries FROM synced_books WHERE nid = ?", (nid,)).fetchone()
+                if row is not None:
+                    book_entries = set(book_entries) | set(tuple(entry) for entry in json.loads(row[0]))
+                self._connection.execute("INSERT OR REPLACE INTO synced_books (nid, entries, synced_at) VALUES (?, ?, ?)",
+                                         (nid, json.dumps(sorted(book_entries)), now))
@@ -3,45 +3,152 @@
 import logging
 import os
 import sys
+import json
+import atexit
+import threading
+import configparser
+from logging.handlers import RotatingFileHandler
+try:
+    from logging.handlers import QueueHandler, QueueListener
+    import queue
+except ImportError:# python 2, records are written by the calling thread
+    QueueHandler = QueueListener = None
 
 LOG_FILE_PATH = os.path.join(os.getcwd(), "LOG_FILE.log")
+CONSOLE_LOG_FORMAT = '[%(levelname)s] - %(message)s'
+FILE_LOG_FORMAT = '%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'
+LOG_FORMATS = ('text', 'json')
+DEFAULT_LOG_BACKUP_COUNT = 5
 
+# adding a new logging level
+logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
+logging.addLevelName(logging.SUCCESS, 'SUCCESS')
 
-def get_logger(module_name):
-    """ 
-        module_name just to distinguish where the logs come from
-    """
-    # adding a new logging level
-    logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
-    logging.addLevelName(logging.SUCCESS, 'SUCCESS')
-    logger = logging.getLogger(module_name)
-    logger.success = lambda msg, *args: logger._log(logging.SUCCESS, msg, args)
+_lock = threading.RLock()
+_handler = None# the only handler attached to the loggers, shared by all of them
+_listener = None
+_output_handlers = []
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a JSON object written in a single line"""
+
+    def format(self, record):
+        data = {'time': self.formatTime(record), 'logger': record.name, 'level': record.levelname,
+                'message': record.getMessage(), 'thread': record.threadName}
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data)
 
-    # create formatters
-    console_log_formatter = logging.Formatter('[%(levelname)s] - %(message)s')
-    file_log_formatter = logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
-    
-    # create file handler
-    file_handler = logging.FileHandler(LOG_FILE_PATH)
-    file_handler.setFormatter(file_log_formatter)
+
+class _HandlerGroup(logging.Handler):
+    """Passes records to the output handlers right away, used when QueueHandler is not available"""
+
+    def emit(self, record):
+        for handler in _output_handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+def _create_output_handlers(file_path, max_bytes, backup_count, log_format):
+    # rotation is disabled for max_bytes == 0
+    file_handler = RotatingFileHandler(file_path, maxBytes=max_bytes, backupCount=backup_count, delay=True)
+    file_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(FILE_LOG_FORMAT))
     file_handler.setLevel(logging.DEBUG)
 
-    # create console log handler
     stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(console_log_formatter)
+    stream_handler.setFormatter(logging.Formatter(CONSOLE_LOG_FORMAT))
     stream_handler.setLevel(logging.SUCCESS)
+    return [file_handler, stream_handler]
+
+
+def _stop():
+    """Writes out the queued records and closes the output handlers"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+        for handler in _output_handlers:
+            handler.close()
+
 
+def configure(file_path=LOG_FILE_PATH, max_bytes=0, backup_count=0, log_format='text'):
+    """
+    (Re)configures the output of all the loggers. Records are put on a queue and written (formatted) by a single
+    background thread, so the code logging them never waits for disk or console I/O.
+    :param max_bytes: the log file is rotated once it grows bigger, 0 disables rotation
+    :param backup_count: number of rotated log files kept
+    :param log_format: format of the log file records: 'text' or 'json' (one JSON object per line)
+    """
+    global _handler, _listener, _output_handlers
+    with _lock:
+        _stop()
+        _output_handlers = _create_output_handlers(file_path, max_bytes, backup_count, log_format)
+        if QueueHandler is None:
+            if _handler is None:
+                _handler = _HandlerGroup()
+            return
+        if _handler is None:
+            _handler = QueueHandler(queue.Queue(-1))
+        _listener = QueueListener(_handler.queue, *_output_handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def configure_from_file(cfg_file_path):
+    """Configures the output as described by [LOGGING] section of the config file, defaults are kept if it is missing"""
+    configuration = configparser.ConfigParser()
+    configuration.read(cfg_file_path)
+    if not configuration.has_section("LOGGING"):
+        return
+    file_path = LOG_FILE_PATH
+    max_bytes = 0# no rotation
+    backup_count = 0
+    log_format = 'text'
+    try:
+        file_path = os.path.join(os.path.dirname(cfg_file_path), configuration.get("LOGGING", 'logFilePath').strip())
+    except configparser.Error as e:
+        pass
+    try:
+        max_bytes = int(configuration.getfloat("LOGGING", 'logMaxSize') * 1024 * 1024)
+        backup_count = DEFAULT_LOG_BACKUP_COUNT
+        backup_count = configuration.getint("LOGGING", 'logBackupCount')
+    except (configparser.Error, ValueError) as e:
+        pass
+    try:
+        log_format = configuration.get("LOGGING", 'logFormat').strip().lower()
+    except configparser.Error as e:
+        pass
+    if log_format not in LOG_FORMATS:
+        raise ValueError("Unknown log format: '{}', use one of: {}".format(log_format, ', '.join(LOG_FORMATS)))
+    configure(file_path, max_bytes, backup_count, log_format)
+
+
+def get_logger(module_name):
+    """
+        module_name just to distinguish where the logs come from
+    """
+    with _lock:
+        if _handler is None:
+            configure()
+    logger = logging.getLogger(module_name)
+    logger.success = lambda msg, *args: logger._log(logging.SUCCESS, msg, args)
     logger.setLevel(logging.SUCCESS)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    if _handler not in logger.handlers:
+        logger.addHandler(_handler)
     return logger
 
 
+atexit.register(_stop)
+
+
 if __name__ == "__main__":
     logger = get_logger('_this is me')
     logger.debug('This is debug level')
     logger.info('This is info level')
     logger.warning('This is warning level')
-    logger.error('This is error level')  
+    logger.error('This is error level')
     logger.critical('This is critical level')
     logger.success('This is success level')
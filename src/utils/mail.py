@@ -1,14 +1,17 @@
 #!/usr/bin/env python
 import os
+import uuid
+import base64
 import configparser
 import smtplib
 from os.path import basename
-from email.mime.application import MIMEApplication
+from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from email.utils import COMMASPACE, formatdate
+from email.utils import COMMASPACE, formatdate, encode_rfc2231
 
 from utils import *
+from utils.metrics import metrics
 logger = log_manager.get_logger(__name__)
 
 
@@ -16,11 +19,20 @@ logger = log_manager.get_logger(__name__)
 COMMA = ", "
 DEFAULT_BODY = "Enjoy!"
 DEFAULT_SUBJECT = "New free packt ebook"
+DEFAULT_MAX_MESSAGE_SIZE_MB = 20
+DEFAULT_KINDLE_MAX_ATTACHMENT_SIZE_MB = 50
+BASE64_OVERHEAD = 4.0 / 3
+BASE64_LINE_INPUT_SIZE = 57 # encodes into a 76 characters long line
+STREAM_READ_SIZE = 1024 * BASE64_LINE_INPUT_SIZE
+SMTP_SEND_BUFFER_SIZE = 64 * 1024
+SMTP_TIMEOUT = 60 # seconds
+encode_base64_lines = getattr(base64, 'encodebytes', None) or base64.encodestring # python 2 has only encodestring
 
 class MailBook:
 
     def __init__(self, cfgFilePath):
-        myDefaults = {'fromEmail': None,'toEmails': [],'kindleEmails': None, }
+        myDefaults = {'toEmails': '', 'kindleEmails': '', 'maxMessageSize': str(DEFAULT_MAX_MESSAGE_SIZE_MB),
+                      'maxAttachmentSize': '0', 'kindleMaxAttachmentSize': str(DEFAULT_KINDLE_MAX_ATTACHMENT_SIZE_MB)}
         config = configparser.ConfigParser(defaults=myDefaults)
         config.read(cfgFilePath)
         try:
@@ -28,61 +40,252 @@ class MailBook:
             self._smtp_port = config.get("MAIL", 'port')
             self._email_pass = config.get("MAIL", 'password')
             self._send_from = config.get("MAIL", 'email')
-            self._to_emails = config.get("MAIL", 'toEmails').split(COMMA)
-            self._kindle_emails = config.get("MAIL", 'kindleEmails').split(COMMA)
+            self._to_emails = [email for email in config.get("MAIL", 'toEmails').split(COMMA) if email]
+            self._kindle_emails = [email for email in config.get("MAIL", 'kindleEmails').split(COMMA) if email]
+            self._max_message_size = int(config.getfloat("MAIL", 'maxMessageSize') * 1024 * 1024)
+            # 0 means no limit
+            self._max_attachment_size = int(config.getfloat("MAIL", 'maxAttachmentSize') * 1024 * 1024)
+            self._kindle_max_attachment_size = int(config.getfloat("MAIL", 'kindleMaxAttachmentSize') * 1024 * 1024)
         except configparser.NoSectionError:
             raise ValueError("ERROR: need at least one from and one or more to emails")
+        self._smtp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_connection(self):
+        """Returns the authenticated SMTP connection, opened once and reused by all the messages"""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        # connects, host is kept for starttls
+        smtp = smtplib.SMTP(host=self._smtp_host, port=self._smtp_port, timeout=SMTP_TIMEOUT)
+        smtp.ehlo()
+        smtp.starttls()
+        smtp.ehlo()
+        smtp.login(self._send_from, self._email_pass)
+        self._smtp = smtp
+        return smtp
+
+    def close(self):
+        """Closes the SMTP connection if it is open"""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, IOError, OSError):
+                self._smtp.close()
+            self._smtp = None
+
+    def _drop_connection(self):
+        """Closes the socket without QUIT, e.g. in the middle of DATA, where the server would take it as message text"""
+        if self._smtp is not None:
+            self._smtp.close()
+            self._smtp = None
     
     def _create_email_msg(self, to=None, subject=None, body=None):
         msg = MIMEMultipart()
         msg['From'] = self._send_from
-        if to:
-            self._to_emails = to
-        msg['To'] = COMMASPACE.join(self._to_emails)
+        msg['To'] = COMMASPACE.join(to if to else self._to_emails)
         msg['Date'] = formatdate(localtime=True)
         msg['Subject'] = subject
         body = body if body else DEFAULT_BODY
         msg.attach(MIMEText(body))   
         return msg
     
-    def _send_email(self, msg):
+    def _send_email(self, msg, to=None):
+        to = to if to else self._to_emails
         try:
-            smtp = smtplib.SMTP(host=self._smtp_host, port=self._smtp_port)
-            smtp.connect(host=self._smtp_host, port=self._smtp_port)
-            smtp.ehlo()
-            smtp.starttls()
-            smtp.ehlo()
-            smtp.login(self._send_from, self._email_pass)
-            logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(self._to_emails)))
-            smtp.sendmail(self._send_from, self._to_emails, msg.as_string())
-            logger.info('Email to {} has been succesfully sent'.format(','.join(self._to_emails)))
+            with metrics.span('mail', recipients=len(to)) as span:
+                smtp = self._get_connection()
+                logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(to)))
+                data = msg.as_string()
+                smtp.sendmail(self._send_from, to, data)
+                span.bytes = len(data)
+            logger.info('Email to {} has been succesfully sent'.format(','.join(to)))
         except Exception as e:
             logger.error('Sending failed with an error: {}'.format(str(e)))
-        finally:
-            smtp.quit()
+            self.close()
     
     def send_info(self, subject="Info message from packtPublishingFreeEbook.py script", body=None):
         msg = self._create_email_msg(subject=subject, body=body)
         self._send_email(msg)
-    
-    def send_book(self, book, to=None):
+
+    @staticmethod
+    def _open_book(book):
+        """
+        Opens a book given as a path or a (path or file object, attachment name) tuple.
+        :return: (file object, attachment name, size or None if unknown, True if the file has been opened here)
+        """
+        book, book_name = book if isinstance(book, tuple) else (book, None)
+        if hasattr(book, 'read'):
+            return book, book_name, getattr(book, 'size', None), False
         if not os.path.isfile(book):
             raise ValueError("ERROR: {} file doesn't exist.".format(book))
-        book_name = basename(book)
-        subject = "{}: {}".format(DEFAULT_SUBJECT, book_name)
-        msg = self._create_email_msg(to, subject=subject)
-        with open(book, "rb") as f:
-            part = MIMEApplication(
-                f.read(),
-                Name=book_name
-            )
-            part['Content-Disposition'] = 'attachment; filename="{}"'.format(book_name)
-            msg.attach(part)
-        logger.info('Sending ebook: {} ...'.format(book_name))
-        self._send_email(msg)
+        return open(book, "rb"), book_name if book_name else basename(book), os.path.getsize(book), True
+
+    def _group_books(self, books):
+        """Packs the books into as few groups (messages) as [maxMessageSize] allows, keeping their order"""
+        groups = []
+        group_size = 0
+        for book in books:
+            size = book[2] * BASE64_OVERHEAD if book[2] is not None else self._max_message_size # unknown size goes alone
+            if not groups or group_size + size > self._max_message_size:
+                groups.append([])
+                group_size = 0
+            groups[-1].append(book)
+            group_size += size
+        return groups
+    
+    def send_book(self, book, to=None, book_name=None, max_attachment_size=None):
+        """
+        Sends the book as an attachment.
+        :param book: path of the book file or a readable file object (e.g. a streamed download)
+        :param book_name: attachment name, required if book is a file object
+        """
+        if hasattr(book, 'read') and not book_name:
+            raise ValueError("ERROR: book_name is required when sending a file object.")
+        self.send_books([(book, book_name)], to, max_attachment_size)
+
+    def _skip_too_big_books(self, books, max_attachment_size):
+        """Leaves out (and closes) books bigger than max_attachment_size, unknown sizes are let through"""
+        if not max_attachment_size:
+            return books
+        allowed_books = []
+        for book in books:
+            if book[2] is not None and book[2] > max_attachment_size:
+                logger.error('Ebook: {} ({:.1f} MB) exceeds the attachment size limit of {:.1f} MB, skipping it'.format(
+                    book[1], book[2] / 1048576.0, max_attachment_size / 1048576.0))
+                if book[3]:
+                    book[0].close()
+            else:
+                allowed_books.append(book)
+        return allowed_books
 
-    def send_kindle(self, book):
+    @staticmethod
+    def _format_attachment_headers(book_name, boundary):
+        try:
+            book_name.encode('ascii')
+            filename = 'filename="{}"'.format(book_name.replace('"', ''))
+            name = 'name="{}"'.format(book_name.replace('"', ''))
+        except UnicodeError:
+            filename = "filename*={}".format(encode_rfc2231(book_name, 'utf-8'))
+            name = "name*={}".format(encode_rfc2231(book_name, 'utf-8'))
+        return ('--{}\r\n'
+                'Content-Type: application/octet-stream; {}\r\n'
+                'MIME-Version: 1.0\r\n'
+                'Content-Transfer-Encoding: base64\r\n'
+                'Content-Disposition: attachment; {}\r\n'
+                '\r\n').format(boundary, name, filename)
+
+    def _iter_message_data(self, to, subject, body, attachments):
+        """Yields the message, in SMTP DATA format, base64 encoding attachments chunk by chunk while reading them"""
+        boundary = '===============' + uuid.uuid4().hex
+        yield ('From: {}\r\n'
+               'To: {}\r\n'
+               'Date: {}\r\n'
+               'Subject: {}\r\n'
+               'MIME-Version: 1.0\r\n'
+               'Content-Type: multipart/mixed; boundary="{}"\r\n'
+               '\r\n').format(self._send_from, COMMASPACE.join(to), formatdate(localtime=True),
+                               Header(subject).encode(), boundary).encode('ascii')
+        text = MIMEText(body if body else DEFAULT_BODY, 'plain', 'utf-8').as_string()
+        yield '--{}\r\n{}\r\n'.format(boundary, smtplib.quotedata(text)).encode('ascii')
+        for f, book_name in attachments:
+            yield self._format_attachment_headers(book_name, boundary).encode('ascii')
+            pending = b''
+            while True:
+                data = f.read(STREAM_READ_SIZE)
+                if data:
+                    pending += data
+                    if len(pending) < STREAM_READ_SIZE:
+                        continue
+                # only whole 57 byte groups are encoded, so lines are not broken in the middle
+                length = len(pending) if not data else len(pending) - len(pending) % BASE64_LINE_INPUT_SIZE
+                if length:
+                    yield encode_base64_lines(pending[:length]).replace(b'\n', b'\r\n')
+                    pending = pending[length:]
+                if not data:
+                    break
+        yield '--{}--\r\n'.format(boundary).encode('ascii')
+
+    def _send_streamed_email(self, to, subject, attachments, body=None):
+        """
+        Sends the message writing it straight onto SMTP DATA stream, so attachments are never held in memory.
+        :param attachments: list of (file object, attachment name)
+        """
+        in_data = False
+        try:
+            with metrics.span('mail', recipients=len(to), attachments=len(attachments)) as span:
+                smtp = self._get_connection()
+                logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(to)))
+                code, response = smtp.mail(self._send_from)
+                if code != 250:
+                    raise smtplib.SMTPSenderRefused(code, response, self._send_from)
+                accepted = [recipient for recipient in to if smtp.rcpt(recipient)[0] in (250, 251)]
+                if not accepted:
+                    smtp.rset()
+                    raise smtplib.SMTPRecipientsRefused(dict((recipient, (550, b'')) for recipient in to))
+                smtp.putcmd("data")
+                code, response = smtp.getreply()
+                if code != 354:
+                    raise smtplib.SMTPDataError(code, response)
+                in_data = True
+                buffer = b''
+                for data in self._iter_message_data(to, subject, body, attachments):
+                    buffer += data
+                    if len(buffer) >= SMTP_SEND_BUFFER_SIZE:
+                        smtp.send(buffer)
+                        span.bytes += len(buffer)
+                        buffer = b''
+                smtp.send(buffer + b'.\r\n')
+                span.bytes += len(buffer)
+                code, response = smtp.getreply()
+                in_data = False
+                if code != 250:
+                    raise smtplib.SMTPDataError(code, response)
+            logger.info('Email to {} has been succesfully sent'.format(','.join(accepted)))
+        except Exception as e:
+            logger.error('Sending failed with an error: {}'.format(str(e)))
+            if in_data:# the message cannot be ended cleanly, a new connection is opened for the next one
+                self._drop_connection()
+            else:
+                self.close()
+
+    def send_books(self, books, to=None, max_attachment_size=None):
+        """
+        Sends many books to the same recipients over one connection, putting as many attachments
+        into a single message as [maxMessageSize] allows. Attachments are streamed, never loaded in memory.
+        :param books: list of book paths or (path or file object, attachment name) tuples
+        :param max_attachment_size: books bigger than that (in bytes) are skipped, [maxAttachmentSize] if None
+        """
+        to = to if to else self._to_emails
+        if max_attachment_size is None:
+            max_attachment_size = self._max_attachment_size
+        opened_books = []
+        try:
+            for book in books:
+                opened_books.append(self._open_book(book))
+            opened_books = self._skip_too_big_books(opened_books, max_attachment_size)
+            for group in self._group_books(opened_books):
+                book_names = [book_name for _, book_name, _, _ in group]
+                subject = "{}: {}".format(DEFAULT_SUBJECT, ', '.join(book_names))
+                logger.info('Sending ebooks: {} ...'.format(', '.join(book_names)))
+                self._send_streamed_email(to, subject, [(f, book_name) for f, book_name, _, _ in group])
+        finally:
+            for f, _, _, opened_here in opened_books:
+                if opened_here:
+                    f.close()
+
+    def send_kindle(self, book, book_name=None):
         if not self._kindle_emails:
             return
-        self.send_book(book, to=self._kindle_emails) 
-
+        max_attachment_size = min(size for size in (self._max_attachment_size, self._kindle_max_attachment_size) if size) \
+            if self._max_attachment_size or self._kindle_max_attachment_size else 0
+        self.send_book(book, to=self._kindle_emails, book_name=book_name, max_attachment_size=max_attachment_size)
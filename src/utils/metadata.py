@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+
+from utils import *
+logger = log_manager.get_logger(__name__)
+
+
+####################################-EBOOK METADATA STORE-############################################
+
+STORE_FILE_EXTENSIONS = ('.sqlite', '.db')
+LOG_DATE_FORMAT = "%d-%m-%Y %H:%M"# format of 'downloaded_at' field
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ebooks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL COLLATE NOCASE,
+    author TEXT,
+    date_published TEXT,
+    grabbed_at REAL NOT NULL,
+    data TEXT NOT NULL,
+    UNIQUE (title, grabbed_at)
+);
+CREATE INDEX IF NOT EXISTS ebooks_title ON ebooks (title);
+CREATE INDEX IF NOT EXISTS ebooks_grabbed_at ON ebooks (grabbed_at);
+"""
+
+
+def is_store_file(file_path):
+    """Checks if the metadata file is a SQLite store (by its extension), otherwise it is a plain text log"""
+    return file_path.lower().endswith(STORE_FILE_EXTENSIONS)
+
+
+def parse_log_file(file_path):
+    """
+    Reads the plain text metadata log: records separated by empty lines, made of 'KEY --> value' lines.
+    Lines without the separator continue the value of the previous key.
+    :return: generator of OrderedDict records with lower case keys
+    """
+    record = OrderedDict()
+    key = None
+    with open(file_path, 'r') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                if record:
+                    yield record
+                record, key = OrderedDict(), None
+            elif ' --> ' in line:
+                key, value = line.split(' --> ', 1)
+                key = key.strip().lower()
+                record[key] = value
+            elif key is not None:
+                record[key] += '\n' + line
+    if record:
+        yield record
+
+
+def get_grabbed_at(record):
+    """Returns the time the record has been written at, parsed from its 'downloaded_at' field"""
+    try:
+        return time.mktime(time.strptime(record['downloaded_at'].strip(), LOG_DATE_FORMAT))
+    except (KeyError, ValueError) as e:
+        return None
+
+
+class MetadataStore(object):
+    """
+    SQLite store of the metadata of the grabbed ebooks, indexed by title and by the time of grabbing.
+    Every write is a transaction, so a crash never leaves a half written record behind.
+    """
+
+    def __init__(self, db_file_path):
+        self._db_file_path = db_file_path
+        self._connection = sqlite3.connect(db_file_path)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.executescript(SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def __record_to_row(record, grabbed_at):
+        return (record.get('title', ''), record.get('author'), record.get('date_published'), grabbed_at,
+                json.dumps(record))
+
+    def add(self, record, grabbed_at=None):
+        """
+        Stores the metadata of an ebook.
+        :param record: dict with 'title' and any other fields, e.g. made by BookGrabber.getEbookInfoData
+        :param grabbed_at: time of grabbing, now if None
+        :return: True if stored, False if the same record (title and time) has been stored before
+        """
+        return self.add_many([record], grabbed_at if grabbed_at is not None else time.time()) == 1
+
+    def add_many(self, records, grabbed_at=None):
+        """
+        Stores the records in a single transaction, time of grabbing is taken from their 'downloaded_at' field
+        (grabbed_at, or now if it is missing). Records stored before are skipped, so an import can be repeated.
+        :return: number of stored records
+        """
+        now = time.time()
+        rows = []
+        for record in records:
+            record_grabbed_at = grabbed_at if grabbed_at is not None else get_grabbed_at(record)
+            rows.append(self.__record_to_row(record, record_grabbed_at if record_grabbed_at is not None else now))
+        with self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany("INSERT OR IGNORE INTO ebooks (title, author, date_published, grabbed_at, data) "
+                                         "VALUES (?, ?, ?, ?, ?)", rows)
+            return self._connection.total_changes - before
+
+    def find(self, title=None, since=None, until=None, limit=None):
+        """
+        Returns the records matching all the given conditions, the oldest first.
+        :param title: beginning of the title (case insensitive)
+        :param since: time (seconds since the epoch) the ebooks have been grabbed at or after
+        :param until: time the ebooks have been grabbed before
+        :return: list of (grabbed_at, OrderedDict record) tuples
+        """
+        conditions, args = [], []
+        if title:
+            # LIKE on a NOCASE column with a constant prefix is answered by the title index
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            args.append(title.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        if since is not None:
+            conditions.append("grabbed_at >= ?")
+            args.append(since)
+        if until is not None:
+            conditions.append("grabbed_at < ?")
+            args.append(until)
+        query = "SELECT grabbed_at, data FROM ebooks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY grabbed_at"
+        if limit is not None:
+            query += " LIMIT {:d}".format(limit)
+        rows = self._connection.execute(query, args).fetchall()
+        return [(row['grabbed_at'], json.loads(row['data'], object_pairs_hook=OrderedDict)) for row in rows]
+
+    def contains(self, title):
+        """Checks if metadata of the title (compared case insensitively) has been stored"""
+        return self._connection.execute("SELECT 1 FROM ebooks WHERE title = ? LIMIT 1", (title,)).fetchone() is not None
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from utils import *
+from utils.transfer import replace_file
+logger = log_manager.get_logger(__name__)
+
+
+####################################-RUN METRICS-############################################
+
+PROMETHEUS_PREFIX = 'packt'
+PROMETHEUS_FILE_EXTENSION = '.prom'
+
+
+class Span(object):
+    """Single timed phase of the run, bytes and retries are filled in by the instrumented code"""
+
+    def __init__(self, phase, labels):
+        self.phase = phase
+        self.labels = labels
+        self.bytes = 0
+        self.retries = 0
+        self.error = None
+        self.started_at = time.time()
+        self.duration = None
+
+    def to_dict(self):
+        return {'phase': self.phase, 'labels': self.labels, 'startedAt': self.started_at, 'duration': self.duration,
+                'bytes': self.bytes, 'retries': self.retries, 'error': self.error}
+
+
+class RunMetrics(object):
+    """Thread safe collection of the timing spans of a single run, written out as a JSON or Prometheus report"""
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+
+    def reset(self):
+        """Forgets the spans recorded so far, the next run starts from scratch (e.g. every run of the daemon mode)"""
+        with self._lock:
+            self._spans = []
+            self.started_at = time.time()
+
+    @contextmanager
+    def span(self, phase, **labels):
+        """
+        Times the enclosed block as a span of the given phase, an exception leaving the block is recorded as its error.
+            with metrics.span('download', file=name) as span:
+                span.bytes = download()
+        """
+        span = Span(phase, labels)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = time.time() - span.started_at
+            with self._lock:
+                self._spans.append(span)
+
+    def timed(self, phase):
+        """Decorator timing every call of the function as a span of the given phase"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(phase):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def __get_busy_time(spans):
+        """Wall clock time during which at least one of the (possibly simultaneous) spans was running"""
+        busy_time = 0.0
+        busy_until = None
+        for span in sorted(spans, key=lambda span: span.started_at):
+            end = span.started_at + span.duration
+            if busy_until is None or span.started_at > busy_until:
+                busy_time += span.duration
+                busy_until = end
+            elif end > busy_until:
+                busy_time += end - busy_until
+                busy_until = end
+        return busy_time
+
+    def get_phases(self):
+        """
+        Returns {phase: {'count':.., 'errors':.., 'seconds':.., 'wallSeconds':.., 'bytes':.., 'retries':.., 'bytesPerSecond':..}},
+        'seconds' sums durations of all the spans, 'wallSeconds' counts simultaneous spans once (throughput is based on it)
+        """
+        with self._lock:
+            spans = list(self._spans)
+        spans_by_phase = {}
+        for span in spans:
+            spans_by_phase.setdefault(span.phase, []).append(span)
+        phases = {}
+        for name, phase_spans in spans_by_phase.items():
+            wall_seconds = self.__get_busy_time(phase_spans)
+            phase_bytes = sum(span.bytes for span in phase_spans)
+            phases[name] = {'count': len(phase_spans),
+                            'errors': sum(1 for span in phase_spans if span.error is not None),
+                            'seconds': sum(span.duration for span in phase_spans),
+                            'wallSeconds': wall_seconds,
+                            'bytes': phase_bytes,
+                            'retries': sum(span.retries for span in phase_spans),
+                            'bytesPerSecond': phase_bytes / wall_seconds if wall_seconds else 0.0}
+        return phases
+
+    def get_report(self, success=True):
+        with self._lock:
+            spans = [span.to_dict() for span in self._spans]
+        return {'startedAt': self.started_at, 'duration': time.time() - self.started_at, 'success': success,
+                'phases': self.get_phases(), 'spans': spans}
+
+    def format_prometheus(self, success=True):
+        """Formats the report for the textfile collector of node_exporter, spans are aggregated per phase"""
+        metrics = [('phase_spans', 'Number of spans of the phase', 'count'),
+                   ('phase_errors', 'Number of failed spans of the phase', 'errors'),
+                   ('phase_duration_seconds', 'Total duration of the spans of the phase', 'seconds'),
+                   ('phase_wall_seconds', 'Wall clock time during which spans of the phase were running', 'wallSeconds'),
+                   ('phase_bytes', 'Bytes transferred by the spans of the phase', 'bytes'),
+                   ('phase_retries', 'Retries made by the spans of the phase', 'retries'),
+                   ('phase_throughput_bytes_per_second', 'Bytes transferred per second of the phase spans', 'bytesPerSecond')]
+        phases = self.get_phases()
+        lines = []
+        for name, description, key in metrics:
+            lines.append('# HELP {}_{} {}'.format(PROMETHEUS_PREFIX, name, description))
+            lines.append('# TYPE {}_{} gauge'.format(PROMETHEUS_PREFIX, name))
+            for phase in sorted(phases):
+                lines.append('{}_{}{{phase="{}"}} {}'.format(PROMETHEUS_PREFIX, name, phase, phases[phase][key]))
+        for name, description, value in [('run_duration_seconds', 'Duration of the last run', time.time() - self.started_at),
+                                         ('run_success', 'Whether the last run succeeded', 1 if success else 0),
+                                         ('run_timestamp_seconds', 'Start time of the last run', self.started_at)]:
+            lines.append('# HELP {}_{} {}'.format(PROMETHEUS_PREFIX, name, description))
+            lines.append('# TYPE {}_{} gauge'.format(PROMETHEUS_PREFIX, name))
+            lines.append('{}_{} {}'.format(PROMETHEUS_PREFIX, name, value))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self, file_path, success=True):
+        """
+        Writes the report in Prometheus text format if file_path ends with '.prom', as JSON otherwise.
+        The file is replaced atomically, so a collector never reads a half written report.
+        """
+        if file_path.endswith(PROMETHEUS_FILE_EXTENSION):
+            content = self.format_prometheus(success)
+        else:
+            content = json.dumps(self.get_report(success), indent=2)
+        temp_file_path = file_path + '.tmp'
+        try:
+            with open(temp_file_path, 'w') as f:
+                f.write(content)
+            replace_file(temp_file_path, file_path)
+            logger.info("Run report written to '{}'".format(file_path))
+        except (IOError, OSError) as e:
+            logger.error("Cannot write the run report to '{}': {}".format(file_path, e))
+
+
+# spans of the whole run (of all the accounts in the batch mode) end up here
+metrics = RunMetrics()
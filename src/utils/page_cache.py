@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import time
+import threading
+from collections import OrderedDict
+
+from utils import *
+logger = log_manager.get_logger(__name__)
+
+
+####################################-PAGE CACHE-############################################
+
+DEFAULT_TTL = 300# seconds a page is used without asking the server
+DEFAULT_MAX_SIZE = 8 * 1024 * 1024# characters of all the cached pages
+
+
+class CachedPage(object):
+    """Body of a page fetched with GET, looks like a requests.Response to the code reading it"""
+
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+        self.etag = headers.get('etag')
+        self.last_modified = headers.get('last-modified')
+        self.stored_at = time.time()
+
+    @property
+    def content(self):
+        return self.text.encode('utf-8')
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+    def get_validators(self):
+        """Headers making the next request conditional, empty if the page cannot be revalidated"""
+        validators = {}
+        if self.etag:
+            validators['If-None-Match'] = self.etag
+        if self.last_modified:
+            validators['If-Modified-Since'] = self.last_modified
+        return validators
+
+
+class PageCache(object):
+    """
+    Thread safe LRU cache of pages fetched with GET, bounded by the total size of the pages.
+    A page younger than ttl is served without a request, an older one is revalidated with If-None-Match or
+    If-Modified-Since, so the server answers with 304 (no body) if it has not changed.
+    Pages are cached per session, as their content depends on the logged in account.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __lookup(self, url):
+        with self._lock:
+            page = self._pages.get(url)
+            if page is not None:
+                del self._pages[url]
+                self._pages[url] = page# most recently used go to the end
+            return page
+
+    def __store(self, page):
+        if len(page.text) > self.max_size:
+            return
+        with self._lock:
+            self.__remove(page.url)
+            self._pages[page.url] = page
+            self._size += len(page.text)
+            while self._size > self.max_size:
+                self.__remove(next(iter(self._pages)))
+
+    def __remove(self, url):
+        page = self._pages.pop(url, None)
+        if page is not None:
+            self._size -= len(page.text)
+
+    def invalidate(self, url=None):
+        """Forgets the page of the url, all the pages if url is None"""
+        with self._lock:
+            if url is None:
+                self._pages.clear()
+                self._size = 0
+            else:
+                self.__remove(url)
+
+    def get(self, session, url, headers=None, timeout=10):
+        """
+        Returns the page of the url, fetched with session.get if it is not cached or has changed.
+        Only 200 responses are cached, other ones are returned as they are.
+        """
+        page = self.__lookup(url)
+        if page is not None and page.is_fresh(self.ttl):
+            self.hits += 1
+            logger.debug("Page '{}' served from the cache".format(url))
+            return page
+        request_headers = dict(headers or {})
+        if page is not None:
+            request_headers.update(page.get_validators())
+        r = session.get(url, headers=request_headers, timeout=timeout)
+        if r.status_code == 304 and page is not None:
+            self.revalidations += 1
+            logger.debug("Page '{}' has not changed".format(url))
+            page.stored_at = time.time()
+            return page
+        self.misses += 1
+        if r.status_code != 200:
+            self.invalidate(url)
+            return r
+        if 'no-store' in r.headers.get('cache-control', '').lower():
+            self.invalidate(url)
+            return r
+        page = CachedPage(url, r.status_code, r.headers, r.text)
+        self.__store(page)
+        return page
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+import json
+import time
+import random
+import datetime
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:# python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from utils import *
+logger = log_manager.get_logger(__name__)
+
+
+####################################-SCHEDULER-############################################
+
+MAX_SLEEP = 60# seconds, the clock is checked again at least that often (e.g. after the machine has been suspended)
+DEFAULT_RETRY_DELAY = 5 * 60# seconds before the first retry of a failed run, doubled by every next one
+
+
+def get_next_time_of_day(now, hour, minute):
+    """Returns the first moment (seconds since the epoch) after now, when the local clock shows hour:minute"""
+    date = datetime.datetime.fromtimestamp(now).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if time.mktime(date.timetuple()) <= now:
+        date += datetime.timedelta(days=1)
+    return time.mktime(date.timetuple())
+
+
+class Job(object):
+    """
+    Function run every day at the given times of day, or every 'interval' seconds. Every run is delayed by
+    a random jitter of up to 'jitter' seconds, so many clients don't hit the server at the same moment.
+    A failed run is retried up to 'retries' times with an exponential backoff before the next scheduled run.
+    """
+
+    def __init__(self, name, function, times_of_day=None, interval=None, jitter=0, retries=0,
+                 retry_delay=DEFAULT_RETRY_DELAY, is_failed=None):
+        """
+        :param times_of_day: list of (hour, minute) tuples
+        :param interval: seconds between the runs, used if times_of_day is not given
+        :param retry_delay: seconds between a failed run and its first retry, doubled by every next retry
+        :param is_failed: callable telling from the result of the function if the run failed without an exception
+        """
+        if not times_of_day and not interval:
+            raise ValueError("Job '{}' needs either times of day or an interval".format(name))
+        self.name = name
+        self.function = function
+        self.times_of_day = times_of_day
+        self.interval = interval
+        self.jitter = jitter
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.is_failed = is_failed
+        self.attempt = 0# 0 for a scheduled run, n for the n-th retry of a failed one
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = None
+        self.last_result = None
+        self.last_error = None
+        self.next_run = None
+        self.schedule(time.time())
+
+    def schedule(self, now):
+        """Sets the time of the next run"""
+        if self.times_of_day:
+            next_run = min(get_next_time_of_day(now, hour, minute) for hour, minute in self.times_of_day)
+        else:
+            next_run = now + self.interval
+        self.next_run = next_run + random.uniform(0, self.jitter)
+
+    def run(self):
+        """Runs the function, an exception is logged and recorded as the error of the run"""
+        logger.info("Running job '{}'...".format(self.name))
+        self.last_run = time.time()
+        self.runs += 1
+        try:
+            self.last_result = self.function()
+            self.last_error = None
+            failed = self.is_failed is not None and self.is_failed(self.last_result)
+        except Exception as e:
+            self.last_result = None
+            self.last_error = str(e)
+            failed = True
+            logger.error("Job '{}' failed: {}".format(self.name, e))
+        if failed:
+            self.failures += 1
+        self.last_duration = time.time() - self.last_run
+        if failed and self.attempt < self.retries:
+            self.next_run = time.time() + self.retry_delay * 2 ** self.attempt
+            self.attempt += 1
+            logger.info("Retry {} of {} of job '{}' at {}".format(self.attempt, self.retries, self.name, time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(self.next_run))))
+            return
+        self.attempt = 0
+        self.schedule(time.time())
+        logger.info("Next run of job '{}' at {}".format(self.name, time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                                 time.localtime(self.next_run))))
+
+    def to_dict(self):
+        return {'name': self.name, 'runs': self.runs, 'failures': self.failures, 'attempt': self.attempt,
+                'lastRun': self.last_run,
+                'lastDuration': self.last_duration, 'lastResult': self.last_result, 'lastError': self.last_error,
+                'nextRun': self.next_run}
+
+
+class Scheduler(object):
+    """Runs the jobs one at a time (the soonest first) until stopped"""
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.started_at = time.time()
+        self.running_job = None
+        self._stopped = threading.Event()
+
+    def run_forever(self):
+        for job in self.jobs:
+            logger.info("First run of job '{}' at {}".format(job.name, time.strftime("%Y-%m-%d %H:%M:%S",
+                                                                                     time.localtime(job.next_run))))
+        while not self._stopped.is_set():
+            job = min(self.jobs, key=lambda job: job.next_run)
+            remaining = job.next_run - time.time()
+            if remaining > 0:
+                self._stopped.wait(min(remaining, MAX_SLEEP))
+                continue
+            self.running_job = job
+            try:
+                job.run()
+            finally:
+                self.running_job = None
+
+    def stop(self):
+        """Stops the scheduler once the running job (if any) finishes"""
+        self._stopped.set()
+
+    def get_status(self):
+        return {'startedAt': self.started_at, 'uptime': time.time() - self.started_at,
+                'runningJob': self.running_job.name if self.running_job is not None else None,
+                'jobs': [job.to_dict() for job in self.jobs]}
+
+
+####################################-STATUS ENDPOINT-############################################
+
+class StatusHandler(BaseHTTPRequestHandler):
+    """GET /status returns the status as JSON, GET /health returns 200 if healthy and 503 otherwise"""
+
+    def log_message(self, format, *args):
+        logger.debug("Status endpoint: " + format % args)
+
+    def __send(self, status_code, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path not in ('', '/status', '/health'):
+            return self.__send(404, 'Not found\n', 'text/plain')
+        healthy, status = self.server.get_status()
+        if path == '/health':
+            return self.__send(200 if healthy else 503, 'ok\n' if healthy else 'failing\n', 'text/plain')
+        self.__send(200, json.dumps(dict(status, healthy=healthy), indent=2), 'application/json')
+
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    """Status endpoint listening on localhost only, served by a background thread"""
+    daemon_threads = True
+
+    def __init__(self, port, get_status):
+        """:param get_status: callable returning (healthy, JSON serializable status dict)"""
+        HTTPServer.__init__(self, ('127.0.0.1', port), StatusHandler)
+        self.get_status = get_status
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='status-endpoint')
+        thread.daemon = True
+        thread.start()
+        logger.info("Status endpoint listening on http://127.0.0.1:{}/status".format(self.server_address[1]))
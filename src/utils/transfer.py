@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+from __future__ import print_function
+import io
+import os
+import re
+import sys
+import time
+import threading
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+from utils import *
+from utils.integrity import hash_file
+logger = log_manager.get_logger(__name__)
+
+
+####################################-CONCURRENT DOWNLOAD HELPERS-############################################
+
+DEFAULT_WORKERS_PER_HOST = 4
+PART_FILE_SUFFIX = '.part'
+PART_VALIDATOR_SUFFIX = '.part.validator'# ETag or Last-Modified of the resource the '.part' file is downloaded from
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+DEFAULT_CHUNK_SIZE = 256 * 1024# used when the size of the file is unknown
+CHUNKS_PER_FILE = 100# adaptive chunk size aims at about that many writes (and progress updates) per file
+PROGRESS_INTERVAL = 0.2# seconds between redraws of a progress bar
+
+
+def clone_session(session):
+    """Creates a new requests session sharing the cookies, headers and connection pools of the given (logged in) one"""
+    import requests
+    new_session = requests.Session()
+    new_session.headers.update(session.headers)
+    new_session.cookies.update(session.cookies)
+    for prefix, adapter in session.adapters.items():# connection pools of the adapters are thread safe
+        new_session.mount(prefix, adapter)
+    return new_session
+
+
+class HostLimiter(object):
+    """Limits the number of concurrent connections opened to a single host"""
+
+    def __init__(self, workers_per_host=DEFAULT_WORKERS_PER_HOST):
+        self._workers_per_host = max(1, workers_per_host)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        """Returns a semaphore guarding the host of the given url"""
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._workers_per_host)
+            return self._semaphores[host]
+
+
+class ProgressSummary(object):
+    """Thread safe, combined progress of many simultaneous downloads printed as a single line"""
+
+    def __init__(self, nr_of_files, interactive=None):
+        self._nr_of_files = nr_of_files
+        self._finished = 0
+        self._progress = {}
+        self._lock = threading.Lock()
+        self._interactive = sys.stdout.isatty() if interactive is None else interactive
+        self._printed_at = 0.0
+
+    def update(self, key, downloaded, total):
+        """Registers that 'downloaded' bytes out of 'total' have been fetched for the file 'key'"""
+        with self._lock:
+            self._progress[key] = (downloaded, total)
+            if time.time() - self._printed_at >= PROGRESS_INTERVAL:# the line is redrawn a few times per second at most
+                self.__print()
+
+    def finish(self, key):
+        """Marks the file 'key' as completed (either downloaded or failed)"""
+        with self._lock:
+            self._finished += 1
+            self._progress.pop(key, None)
+            self.__print()
+            if self._interactive and self._finished == self._nr_of_files:
+                print("")
+
+    def __print(self):
+        if not self._interactive:
+            return
+        self._printed_at = time.time()
+        downloaded = sum(done for done, _ in self._progress.values())
+        total = sum(size for _, size in self._progress.values() if size)
+        work_done = (self._finished + (float(downloaded) / total if total else 0.0)) / max(1, self._nr_of_files)
+        work_done = min(work_done, 1.0)
+        print("\r[PROGRESS] - [{0:50s}] {1:.1f}% ({2}/{3} files, {4} active, {5:.1f} MB) ".format(
+            '#' * int(work_done * 50), work_done * 100, self._finished, self._nr_of_files,
+            len(self._progress), downloaded / 1048576.0), end="")
+
+
+def rate_limited(progress, interval=PROGRESS_INTERVAL):
+    """Wraps progress callable(done, total), so it is invoked at most once per interval seconds and when done == total"""
+    called_at = [0.0]
+
+    def wrapper(done, total):
+        now = time.time()
+        if now - called_at[0] >= interval or done == total:
+            called_at[0] = now
+            progress(done, total)
+    return wrapper
+
+
+####################################-CHUNKED READING-############################################
+
+def get_chunk_size(length):
+    """Chunk size adapted to the number of bytes to be read: about CHUNKS_PER_FILE chunks, within the size limits"""
+    if length is None:
+        return DEFAULT_CHUNK_SIZE
+    return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, length // CHUNKS_PER_FILE))
+
+
+def get_raw_stream(response):
+    """Returns the undecoded body of a streamed requests response if it can be read with readinto, None otherwise"""
+    raw = getattr(response, 'raw', None)# not available for the asyncio engine responses
+    if raw is None or not hasattr(raw, 'readinto'):
+        return None
+    if response.headers.get('content-encoding', 'identity').strip().lower() != 'identity':
+        return None# compressed body, iter_content decodes it
+    return raw
+
+
+def read_raw_into(raw, buffer):
+    """Reads from the raw body into the buffer, errors are raised as the ones of requests.Response.iter_content"""
+    import requests
+    from urllib3.exceptions import ProtocolError, ReadTimeoutError
+    try:
+        return raw.readinto(buffer)
+    except ProtocolError as e:
+        raise requests.exceptions.ChunkedEncodingError(e)
+    except ReadTimeoutError as e:
+        raise requests.exceptions.ConnectionError(e)
+
+
+def iter_body(response, chunk_size):
+    """
+    Yields the body of a streamed response in chunks of at most chunk_size bytes. A plain body is read with readinto
+    into a single preallocated buffer, so a chunk is valid only until the next one is yielded.
+    """
+    raw = get_raw_stream(response)
+    if raw is None:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                yield chunk
+        return
+    buffer = memoryview(bytearray(chunk_size))
+    while True:
+        length = read_raw_into(raw, buffer)
+        if not length:
+            break
+        yield buffer[:length]
+
+
+####################################-RESUMABLE DOWNLOADS-############################################
+
+def replace_file(src, dst):
+    """Atomically renames src to dst, overwriting dst if it exists"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:# python 2
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
+
+
+def get_total_length(response, offset):
+    """Returns the full size of the downloaded resource or None if the server does not tell it"""
+    if response.headers.get('content-encoding', 'identity').strip().lower() != 'identity':
+        return None# the lengths count the compressed bytes, the body is decoded while reading
+    content_range = response.headers.get('content-range')
+    if content_range:
+        m = re.match(r'^bytes\s+(\d+-\d+|\*)/(\d+)$', content_range.strip())
+        if m:
+            return int(m.group(2))
+    content_length = response.headers.get('content-length')
+    if content_length is not None:
+        return offset + int(content_length)
+    return None
+
+
+def get_validator(response):
+    """Returns the strong ETag or the Last-Modified date of the response (usable in If-Range), None if it has neither"""
+    etag = (response.headers.get('etag') or '').strip()
+    if etag and not etag.startswith('W/'):
+        return etag
+    return (response.headers.get('last-modified') or '').strip() or None
+
+
+def remove_part_validator(file_path):
+    if os.path.isfile(file_path + PART_VALIDATOR_SUFFIX):
+        os.remove(file_path + PART_VALIDATOR_SUFFIX)
+
+
+def store_part_validator(response, file_path):
+    """Stores the validator of a new '.part' file, so it is resumed only if the resource has not changed"""
+    validator = get_validator(response)
+    if validator is None:
+        remove_part_validator(file_path)
+        return
+    with open(file_path + PART_VALIDATOR_SUFFIX, 'w') as f:
+        f.write(validator)
+
+
+def get_resume_headers(file_path, offset, headers=None):
+    """
+    Returns the headers of a download request, asking only for the bytes after offset if the '.part' file has them.
+    If-Range makes the server send the whole content again (200) if the resource has changed since.
+    """
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers['Range'] = 'bytes={}-'.format(offset)
+        try:
+            with open(file_path + PART_VALIDATOR_SUFFIX, 'r') as f:
+                validator = f.read().strip()
+            if validator:
+                request_headers['If-Range'] = validator
+        except (IOError, OSError):
+            pass# the server has not sent any validator, the length check is all there is
+        logger.info("Resuming download of '{}' from byte {}".format(os.path.basename(file_path), offset))
+    return request_headers
+
+
+def get_part_file_mode(status_code, response, url, file_path, offset):
+    """
+    Checks the response to a (possibly ranged) download request, the validator of a new '.part' file is stored.
+    :return: (mode the '.part' file has to be opened with, offset the response body starts at),
+             mode is None if the file turned out to be complete already
+    """
+    import requests
+    part_file_path = file_path + PART_FILE_SUFFIX
+    if status_code == 416 and offset:# requested range is not satisfiable, maybe there is nothing left to download
+        remove_part_validator(file_path)
+        if get_total_length(response, offset) == offset:
+            replace_file(part_file_path, file_path)
+            return None, offset
+        os.remove(part_file_path)
+        raise requests.exceptions.RequestException(
+            "Cannot resume '{}', the partially downloaded file has been removed".format(file_path))
+    if status_code == 206:
+        return 'ab', offset
+    if status_code == 200:# whole content sent, the resource has changed or range is not supported
+        if offset:
+            logger.info("Cannot resume '{}', downloading it from the beginning".format(os.path.basename(file_path)))
+        store_part_validator(response, file_path)
+        return 'wb', 0
+    raise requests.exceptions.RequestException(
+        "Cannot download '{}', http GET status code: {}".format(url, status_code))
+
+
+def finish_part_file(file_path, downloaded, total_length):
+    """Renames the '.part' file to file_path if all the bytes have been received"""
+    import requests
+    if total_length is not None and downloaded != total_length:
+        raise requests.exceptions.RequestException("Download of '{}' is incomplete: {} out of {} bytes received".format(
+            file_path, downloaded, total_length))
+    replace_file(file_path + PART_FILE_SUFFIX, file_path)
+    remove_part_validator(file_path)
+
+
+def resume_checksums(checksums, file_path, mode):
+    """
+    Prepares checksums of a download for the body of the response: the bytes already on disk are hashed first,
+    the '.part' file if the body is appended to it, the whole file if it turned out to be complete (mode is None)
+    """
+    checksums.reset()
+    if mode is None:
+        hash_file(file_path, checksums)
+    elif mode == 'ab':
+        hash_file(file_path + PART_FILE_SUFFIX, checksums)
+
+
+def download_file(session, url, file_path, headers=None, timeout=100, progress=None, checksums=None):
+    """
+    Downloads url into a '.part' file, resuming it with a http Range request if it already exists
+    (and the resource has not changed since it was started).
+    The '.part' file is renamed to file_path only when all the bytes have been received.
+    :param progress: callable(downloadedBytes, totalBytes) invoked while downloading, totalBytes might be None
+    :param checksums: utils.integrity.Checksums fed with the content of the file while it is being written
+    :return: number of bytes transferred during this call
+    """
+    part_file_path = file_path + PART_FILE_SUFFIX
+    offset = os.path.getsize(part_file_path) if os.path.isfile(part_file_path) else 0
+    r = session.get(url, headers=get_resume_headers(file_path, offset, headers), timeout=timeout, stream=True)
+    try:
+        mode, offset = get_part_file_mode(r.status_code, r, url, file_path, offset)
+        if checksums is not None:
+            resume_checksums(checksums, file_path, mode)
+        if mode is None:
+            return 0
+        total_length = get_total_length(r, offset)
+        downloaded = offset
+        # chunks are big enough to be written straight through the file buffer, no need to flush them one by one
+        with open(part_file_path, mode) as f:
+            for chunk in iter_body(r, get_chunk_size(total_length - offset if total_length is not None else None)):
+                f.write(chunk)
+                if checksums is not None:
+                    checksums.update(chunk)
+                downloaded += len(chunk)
+                if progress is not None:
+                    progress(downloaded, total_length)
+    finally:
+        r.close()
+    finish_part_file(file_path, downloaded, total_length)
+    return downloaded - offset
+
+
+####################################-STREAMED DOWNLOADS-############################################
+
+class ResponseStream(io.RawIOBase):
+    """Read only, non seekable file object reading the body of a streamed http response"""
+
+    def __init__(self, response, name, chunk_size=DEFAULT_CHUNK_SIZE):
+        self._response = response
+        # a plain body is read straight into the buffers of the callers, otherwise it is decoded by iter_content
+        self._raw = get_raw_stream(response)
+        self._chunks = response.iter_content(chunk_size=chunk_size) if self._raw is None else None
+        self._buffer = memoryview(b'')
+        self.name = name
+        content_length = response.headers.get('content-length')
+        self.size = int(content_length) if content_length is not None else None
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self._raw is not None:
+            return read_raw_into(self._raw, b)
+        while not len(self._buffer):
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        length = min(len(b), len(self._buffer))
+        b[:length] = self._buffer[:length]
+        self._buffer = self._buffer[length:]
+        return length
+
+    def close(self):
+        if not self.closed:
+            self._response.close()
+        super(ResponseStream, self).close()
+
+
+def open_stream(session, url, name, headers=None, timeout=100):
+    """Opens url for reading, returns ResponseStream named as the given file name"""
+    import requests
+    r = session.get(url, headers=headers, timeout=timeout, stream=True)
+    if r.status_code != 200:
+        r.close()
+        raise requests.exceptions.RequestException(
+            "Cannot download '{}', http GET status code: {}".format(url, r.status_code))
+    return ResponseStream(r, name)
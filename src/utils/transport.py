@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+import time
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_tz, mktime_tz
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import *
+from utils.metrics import metrics
+logger = log_manager.get_logger(__name__)
+
+
+####################################-RETRYING TRANSPORT-############################################
+
+DEFAULT_RETRIES = 4
+DEFAULT_REQUESTS_PER_SECOND = 10.0
+BACKOFF_BASE = 0.5# seconds, doubled by every next attempt
+MAX_BACKOFF = 30.0
+MAX_RETRY_AFTER = 120.0# a server asking to wait longer fails the request
+RETRIABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+CIRCUIT_FAILURE_THRESHOLD = 5# consecutive failures opening the circuit of a host
+CIRCUIT_RESET_TIMEOUT = 30.0# seconds the circuit stays open before a trial request is let through
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request to a host which keeps failing"""
+
+
+def get_backoff_delay(attempt):
+    """Exponential backoff with full jitter, so simultaneous clients don't retry in lockstep"""
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt))
+
+
+def get_retry_after(headers):
+    """Returns the number of seconds the Retry-After header (seconds or http date) asks to wait, None if not set"""
+    value = (headers.get('retry-after') or '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+
+class TokenBucket(object):
+    """Thread safe token bucket allowing 'rate' requests per second on average and bursts of 'capacity' requests"""
+
+    def __init__(self, rate, capacity):
+        self._rate = float(rate)
+        self._capacity = float(capacity)
+        self._tokens = self._capacity
+        self._updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token, returns the number of seconds the caller has to wait before using it"""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+            self._tokens -= 1# goes below zero for callers waiting for the future tokens
+            return -self._tokens / self._rate if self._tokens < 0 else 0.0
+
+    def pause(self, seconds):
+        """Holds back all the requests for the given time, e.g. when the server asks to slow down"""
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self._rate)
+
+
+class CircuitBreaker(object):
+    """
+    Stops requests to a host after CIRCUIT_FAILURE_THRESHOLD consecutive failed requests (each one counted once,
+    when its retries have run out). Once CIRCUIT_RESET_TIMEOUT
+    passes a single trial request is let through, its success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, host):
+        self._host = host
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Raises CircuitOpenError if the request must not be sent.
+        :return: True if the caller has taken the trial request, its outcome is recorded with trial=True then
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            remaining = self._opened_at + CIRCUIT_RESET_TIMEOUT - time.time()
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError("Requests to {} are suspended after {} failures in a row{}".format(
+                    self._host, self._failures, ", retrying in {:.0f}s".format(remaining) if remaining > 0 else ""))
+            self._trial_running = True
+            return True
+
+    def record(self, failed, trial=False):
+        with self._lock:
+            if trial:
+                self._trial_running = False
+            if not failed:
+                if self._opened_at is not None:
+                    logger.info("Requests to {} are resumed".format(self._host))
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= CIRCUIT_FAILURE_THRESHOLD:
+                if self._opened_at is None:
+                    logger.error("{} failed {} times in a row, requests to it are suspended for {:.0f}s".format(
+                        self._host, self._failures, CIRCUIT_RESET_TIMEOUT))
+                self._opened_at = time.time()
+
+    def release(self):
+        """Ends the trial request without an outcome (e.g. it raised an unexpected error), so another one can be sent"""
+        with self._lock:
+            self._trial_running = False
+
+
+class RetryPolicy(object):
+    """
+    Decides when and how long to wait before (re)sending a request, the state is kept per host and shared by
+    all the sessions using the policy.
+    :param retries: number of retries of a failed idempotent request
+    :param requests_per_second: average rate of requests sent to a single host, 0 disables the limit
+    """
+
+    def __init__(self, retries=DEFAULT_RETRIES, requests_per_second=DEFAULT_REQUESTS_PER_SECOND):
+        self.retries = retries
+        self.requests_per_second = requests_per_second
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def __get_host_state(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                bucket = None
+                if self.requests_per_second > 0:
+                    bucket = TokenBucket(self.requests_per_second, max(1.0, 2 * self.requests_per_second))
+                self._hosts[host] = (CircuitBreaker(host), bucket)
+            return self._hosts[host]
+
+    def before_request(self, url):
+        """
+        Raises CircuitOpenError if the host keeps failing.
+        :return: (number of seconds to wait before sending, True if the attempt is the trial request to the host)
+        """
+        breaker, bucket = self.__get_host_state(url)
+        trial = breaker.allow()
+        return (bucket.reserve() if bucket is not None else 0.0), trial
+
+    def after_response(self, url, method, attempt, status_code=None, headers=None, error=None, trial=False):
+        """
+        Registers the outcome of the attempt (the response status or the connection error).
+        :return: number of seconds to wait before retrying, None if the outcome is final
+        """
+        breaker, bucket = self.__get_host_state(url)
+        if error is None and status_code not in RETRIABLE_STATUS_CODES:
+            breaker.record(failed=False, trial=trial)
+            return None
+        retry_after = get_retry_after(headers) if headers is not None else None
+        if status_code == 429 and bucket is not None:# throttled, the host is fine, but everybody has to slow down
+            bucket.pause(retry_after if retry_after is not None else get_backoff_delay(attempt))
+        delay = None
+        if attempt < self.retries and method.upper() in IDEMPOTENT_METHODS:
+            if retry_after is None:
+                delay = get_backoff_delay(attempt)
+            elif retry_after <= MAX_RETRY_AFTER:
+                delay = retry_after
+        if delay is None and status_code != 429:
+            # a single broken url must not suspend the whole host, so only the final outcome of a request counts
+            breaker.record(failed=True, trial=trial)
+        return delay
+
+    def release(self, url):
+        """Ends the trial attempt, the next trial request is let through if this one has not recorded its outcome"""
+        breaker, _ = self.__get_host_state(url)
+        breaker.release()
+
+    @staticmethod
+    @contextmanager
+    def waiting(url, delay, reason):
+        """Logs the retry, the time spent in the block (waiting for the next attempt) is recorded as a 'retry_wait' span"""
+        logger.info("{} {}, retrying in {:.1f}s...".format(url, reason, delay))
+        with metrics.span('retry_wait', host=urlparse(url).netloc) as span:
+            span.retries = 1
+            yield
+
+
+class RetryingHTTPAdapter(HTTPAdapter):
+    """
+    requests transport adapter retrying failed requests (connection errors, 429 and 5xx responses) with jittered
+    exponential backoff or as long as Retry-After asks, limiting the rate of requests sent to every host and
+    suspending requests to a host which keeps failing. Other arguments are passed to HTTPAdapter.
+    """
+
+    def __init__(self, policy=None, pool_adapter=None, **kwargs):
+        """
+        :param pool_adapter: HTTPAdapter whose connection pool is used instead of a new one, e.g. to share it among
+                             the sessions of many accounts, each one retried as its own policy decides
+        """
+        self.policy = policy if policy is not None else RetryPolicy()
+        super(RetryingHTTPAdapter, self).__init__(**kwargs)
+        if pool_adapter is not None:
+            self.poolmanager = pool_adapter.poolmanager
+            self.proxy_manager = pool_adapter.proxy_manager
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            delay, trial = self.policy.before_request(request.url)
+            try:
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    response = super(RetryingHTTPAdapter, self).send(request, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    delay = self.policy.after_response(request.url, request.method, attempt, error=e, trial=trial)
+                    if delay is None:
+                        raise
+                    reason = "failed: {}".format(e)
+                else:
+                    delay = self.policy.after_response(request.url, request.method, attempt, response.status_code,
+                                                       response.headers, trial=trial)
+                    if delay is None:
+                        return response
+                    response.close()
+                    reason = "returned http status code {}".format(response.status_code)
+            finally:
+                if trial:
+                    self.policy.release(request.url)
+            attempt += 1
+            with self.policy.waiting(request.url, delay, reason):
+                time.sleep(delay)
@@ -0,0 +1,102 @@
+import pytest
+
+from packtPublishingFreeEbook import BookDownloader
+
+TITLES = ['Learning Python', 'Learning Python Networking', 'Mastering Go', 'Go Web Programming']
+
+
+class FakeResponse(object):
+
+    def __init__(self, text):
+        self.status_code = 200
+        self.text = text
+        self.content = text.encode('utf-8')
+
+
+class FakeHttpSession(object):
+
+    def __init__(self, text):
+        self.text = text
+
+    def get(self, url, **kwargs):
+        return FakeResponse(self.text)
+
+
+class FakeAccountData(object):
+    myBooksUrl = 'https://www.packtpub.com/account/my-ebooks'
+    reqHeaders = {}
+    libraryIndexFilePath = None
+
+
+class FakePacktPubHttpSession(object):
+
+    def __init__(self, text):
+        self.session = FakeHttpSession(text)
+
+    def getCurrentHttpSession(self):
+        return self.session
+
+    def getCurrentConfig(self):
+        return FakeAccountData()
+
+
+def account_page(titles):
+    lines = []
+    for nid, title in enumerate(titles, 1000):
+        lines.append('<div class="product-line unseen" title="{} [eBook]" nid="{}"></div>'.format(title, nid))
+        lines.append('<div class="product-buttons-line toggle"><a href="/ebook_download/{}/pdf">pdf</a></div>'.format(nid))
+    return '<div id="product-account-list">{}</div>'.format(''.join(lines))
+
+
+@pytest.fixture
+def downloader():
+    downloader = BookDownloader(FakePacktPubHttpSession(account_page(TITLES)))
+    downloader.getDataOfAllMyBooks()
+    return downloader
+
+
+def found_titles(downloader, titles):
+    return [book['title'] for book in downloader.findBooksByTitles(titles)]
+
+
+def test_exact_title_is_case_and_punctuation_insensitive(downloader):
+    assert found_titles(downloader, ['mastering go']) == ['Mastering Go']
+    assert found_titles(downloader, ['Learning Python']) == ['Learning Python']
+
+
+def test_unique_beginning_matches_the_book(downloader):
+    assert found_titles(downloader, ['Go Web']) == ['Go Web Programming']
+
+
+def test_ambiguous_beginning_matches_nothing(downloader):
+    assert found_titles(downloader, ['Learning']) == []
+
+
+def test_unknown_title_matches_nothing(downloader):
+    assert found_titles(downloader, ['Rust in Action']) == []
+
+
+@pytest.mark.parametrize('empty_title', ['', ' ', '[]', '?'])
+def test_empty_title_matches_nothing(downloader, empty_title):
+    assert found_titles(downloader, [empty_title]) == []
+    assert found_titles(downloader, ['Mastering Go', empty_title]) == ['Mastering Go']
+
+
+def test_empty_title_does_not_match_the_only_book():
+    downloader = BookDownloader(FakePacktPubHttpSession(account_page(['Mastering Go'])))
+    downloader.getDataOfAllMyBooks()
+    assert found_titles(downloader, ['']) == []
+
+
+@pytest.mark.parametrize('parser', ['html.parser', 'lxml'])
+def test_buttons_of_a_skipped_book_line_are_not_attached_to_the_previous_book(monkeypatch, parser):
+    if parser == 'lxml':
+        pytest.importorskip('lxml')
+    monkeypatch.setattr(BookDownloader, 'htmlParser', parser)
+    page = account_page(['Mastering Go']).replace('</div></div>', '</div>'
+                                                  '<div class="product-line unseen" title="no nid"></div>'
+                                                  '<div class="product-buttons-line toggle">'
+                                                  '<a href="/ebook_download/9999/epub">epub</a></div></div>')
+    downloader = BookDownloader(FakePacktPubHttpSession(page))
+    downloader.getDataOfAllMyBooks()
+    assert [book['downloadUrls'] for book in downloader.bookData] == [{'pdf': '/ebook_download/1000/pdf'}]
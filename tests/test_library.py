@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+
+from packtPublishingFreeEbook import PacktAccountDataModel
+from utils.integrity import Checksums
+from utils.library import LibraryIndex
+
+BOOKS = [{'title': 'Mastering Go', 'id': '1000', 'downloadUrls': {'pdf': '/ebook_download/1000/pdf'}},
+         {'title': 'Learning Python', 'id': '1001', 'downloadUrls': {'code': '/code_download/2001'}}]
+
+
+@pytest.fixture
+def db_file_path(tmpdir):
+    return str(tmpdir.join('library.sqlite'))
+
+
+@pytest.fixture
+def index(db_file_path):
+    index = LibraryIndex(db_file_path, PacktAccountDataModel.convertBookTitleToValidString)
+    yield index
+    index.close()
+
+
+def test_update_books_returns_the_new_ones(index):
+    assert index.update_books(BOOKS[:1]) == BOOKS[:1]
+    assert index.update_books(BOOKS) == BOOKS[1:]
+    assert index.update_books(BOOKS) == []
+
+
+def test_books_are_found_by_normalized_title(index):
+    index.update_books(BOOKS)
+    assert index.find_books_by_titles(['mastering go', 'Rust in Action']) == BOOKS[:1]
+    assert sorted(book['id'] for book in index.find_books_by_titles(['Mastering_Go', 'LEARNING PYTHON'])) == \
+        ['1000', '1001']
+
+
+def test_index_is_kept_between_runs(db_file_path, index):
+    index.update_books(BOOKS)
+    index.close()
+    reopened = LibraryIndex(db_file_path, PacktAccountDataModel.convertBookTitleToValidString)
+    try:
+        assert reopened.update_books(BOOKS) == []
+    finally:
+        reopened.close()
+
+
+def test_downloaded_files_and_their_checksums(tmpdir, index):
+    path = tmpdir.join('Mastering_Go.pdf')
+    path.write_binary(b'book')
+    checksums = Checksums()
+    checksums.update(b'book')
+    assert not index.is_file_downloaded(str(path))
+    index.add_file(str(path), '1000', 'pdf', checksums)
+    assert index.is_file_downloaded(str(path))
+    [record] = index.get_files()
+    assert (record['path'], record['nid'], record['format'], record['size']) == (str(path), '1000', 'pdf', 4)
+    assert (record['sha256'], record['md5']) == (checksums.sha256, checksums.md5)
+
+
+def test_forgotten_file_is_not_synced_any_more(tmpdir, index):
+    path = tmpdir.join('Mastering_Go.pdf')
+    path.write_binary(b'book')
+    index.add_file(str(path), '1000', 'pdf')
+    index.mark_books_synced({'1000': {('pdf', 'Mastering_Go.pdf')}, '1001': {('code', 'Learning_Python.zip')}})
+    index.forget_file(str(path))
+    assert not index.is_file_downloaded(str(path))
+    assert index.get_synced_books() == {'1001': {('code', 'Learning_Python.zip')}}
+
+
+def test_synced_entries_are_merged(index):
+    index.mark_books_synced({'1000': {('pdf', 'a')}})
+    index.mark_books_synced({'1000': {('epub', 'b')}})
+    assert index.get_synced_books() == {'1000': {('pdf', 'a'), ('epub', 'b')}}
+    index.forget_files()
+    assert index.get_synced_books() == {}
+
+
+def test_checksum_columns_are_added_to_an_old_index(db_file_path):
+    connection = sqlite3.connect(db_file_path)
+    connection.execute("CREATE TABLE files (path TEXT PRIMARY KEY, nid TEXT NOT NULL, format TEXT NOT NULL, "
+                       "size INTEGER NOT NULL, mtime REAL NOT NULL)")
+    connection.execute("INSERT INTO files VALUES ('old.pdf', '1000', 'pdf', 4, 0)")
+    connection.commit()
+    connection.close()
+    index = LibraryIndex(db_file_path, PacktAccountDataModel.convertBookTitleToValidString)
+    try:
+        [record] = index.get_files()
+        assert record['path'] == 'old.pdf' and record['sha256'] is None and record['md5'] is None
+    finally:
+        index.close()
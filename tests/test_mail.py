@@ -0,0 +1,123 @@
+import base64
+import email
+import io
+
+import pytest
+
+from utils import mail
+from utils.mail import MailBook
+
+CONFIG = """[MAIL]
+host: smtp.example.com
+port: 587
+email: me@example.com
+password: secret
+toEmails: a@example.com, b@example.com
+"""
+
+
+class FakeSMTP(object):
+    """Records the conversation of MailBook with the SMTP server"""
+
+    def __init__(self):
+        self.sent = b''
+        self.commands = []
+        self.closed = False
+
+    def noop(self):
+        return 250, b'OK'
+
+    def mail(self, sender):
+        self.commands.append('mail')
+        return 250, b'OK'
+
+    def rcpt(self, recipient):
+        return 250, b'OK'
+
+    def rset(self):
+        self.commands.append('rset')
+
+    def putcmd(self, cmd):
+        self.commands.append(cmd)
+
+    def getreply(self):
+        if self.commands[-1] == 'data' and not self.sent:
+            return 354, b'Go ahead'
+        return 250, b'OK'
+
+    def send(self, data):
+        self.sent += data
+
+    def quit(self):
+        self.commands.append('quit')
+
+    def close(self):
+        self.closed = True
+
+
+class BrokenStream(io.BytesIO):
+    """Download stream whose connection drops after the first read"""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise IOError("Connection reset by peer")
+        return io.BytesIO.read(self, size)
+
+
+@pytest.fixture
+def mail_book(tmpdir, monkeypatch):
+    cfg = tmpdir.join('configFile.cfg')
+    cfg.write(CONFIG)
+    smtp = FakeSMTP()
+    monkeypatch.setattr(MailBook, '_get_connection', lambda self: setattr(self, '_smtp', smtp) or smtp)
+    book = MailBook(str(cfg))
+    book.fake_smtp = smtp
+    return book
+
+
+@pytest.mark.parametrize('size', [0, 1, mail.BASE64_LINE_INPUT_SIZE, mail.STREAM_READ_SIZE + 5,
+                                  3 * mail.STREAM_READ_SIZE])
+def test_streamed_attachment_is_base64_in_whole_lines(mail_book, size):
+    content = bytes(bytearray(i % 256 for i in range(size)))
+    data = b''.join(mail_book._iter_message_data(['a@example.com'], 'subject', None,
+                                                [(io.BytesIO(content), 'book.pdf')]))
+    message = email.message_from_bytes(data)
+    attachment = message.get_payload()[1]
+    assert attachment.get_filename() == 'book.pdf'
+    assert attachment.get_payload(decode=True) == content
+    lines = attachment.get_payload().split('\r\n')
+    assert all(len(line) <= 76 for line in lines)
+    assert base64.b64decode(''.join(lines)) == content
+
+
+def test_streamed_email_ends_data_and_keeps_connection(mail_book):
+    mail_book.send_book(io.BytesIO(b'book'), book_name='book.pdf')
+    smtp = mail_book.fake_smtp
+    assert smtp.commands == ['mail', 'data']
+    assert smtp.sent.endswith(b'\r\n.\r\n')
+    assert mail_book._smtp is smtp and not smtp.closed
+
+
+def test_stream_failure_during_data_drops_connection_without_quit(mail_book):
+    stream = BrokenStream(b'x' * (2 * mail.STREAM_READ_SIZE))
+    mail_book.send_book(stream, book_name='book.pdf')
+    smtp = mail_book.fake_smtp
+    assert 'quit' not in smtp.commands
+    assert smtp.closed
+    assert mail_book._smtp is None
+    assert not smtp.sent.endswith(b'\r\n.\r\n')
+
+
+def test_connection_has_timeout(tmpdir, monkeypatch):
+    cfg = tmpdir.join('configFile.cfg')
+    cfg.write(CONFIG)
+    created = {}
+
+    def smtp(**kwargs):
+        created.update(kwargs)
+        raise IOError("unreachable")
+
+    monkeypatch.setattr(mail.smtplib, 'SMTP', smtp)
+    with pytest.raises(IOError):
+        MailBook(str(cfg))._get_connection()
+    assert created['timeout'] == mail.SMTP_TIMEOUT
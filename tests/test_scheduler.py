@@ -0,0 +1,64 @@
+import pytest
+
+from utils import scheduler
+from utils.scheduler import Job
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler.time, 'time', clock.time)
+    return clock
+
+
+def failing_function(failures):
+    def function():
+        if failures:
+            raise RuntimeError(failures.pop(0))
+        return 'ok'
+    return function
+
+
+def test_failed_run_is_retried_with_backoff(clock):
+    job = Job('job', failing_function(['a', 'b', 'c']), interval=3600, retries=3, retry_delay=60)
+    delays = []
+    for _ in range(4):
+        job.run()
+        delays.append(job.next_run - clock.now)
+    assert delays == [60, 120, 240, 3600]
+    assert (job.runs, job.failures, job.attempt, job.last_result, job.last_error) == (4, 3, 0, 'ok', None)
+
+
+def test_retries_run_out_before_the_next_scheduled_run(clock):
+    job = Job('job', failing_function(['a', 'b', 'c']), interval=3600, retries=2, retry_delay=60)
+    delays = []
+    for _ in range(3):
+        job.run()
+        delays.append(job.next_run - clock.now)
+    assert delays == [60, 120, 3600]
+    assert (job.attempt, job.last_error) == (0, 'c')
+
+
+def test_failure_told_by_the_result_is_retried(clock):
+    results = [[{'error': 'login failed'}], [{'error': None}]]
+    job = Job('job', lambda: results.pop(0), interval=3600, retries=1, retry_delay=60,
+              is_failed=lambda summaries: any(summary['error'] for summary in summaries))
+    job.run()
+    assert (job.attempt, job.next_run - clock.now, job.failures) == (1, 60, 1)
+    job.run()
+    assert (job.attempt, job.next_run - clock.now, job.failures) == (0, 3600, 1)
+
+
+def test_job_without_retries_waits_for_the_next_scheduled_run(clock):
+    job = Job('job', failing_function(['a']), interval=3600)
+    job.run()
+    assert (job.attempt, job.next_run - clock.now, job.last_error) == (0, 3600, 'a')
@@ -0,0 +1,121 @@
+import io
+import os
+import re
+
+import pytest
+import requests
+
+from utils import transfer
+from utils.integrity import Checksums, hash_file
+
+CONTENT = bytes(bytearray(i % 251 for i in range(300 * 1024)))
+URL = 'https://www.packtpub.com/ebook_download/1000/pdf'
+
+
+class FakeServer(object):
+    """Serves one resource as a server honouring Range and If-Range would, records the request headers"""
+
+    def __init__(self, content, etag='"v1"'):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None, stream=False):
+        headers = headers or {}
+        self.requests.append(headers)
+        response = requests.Response()
+        response.url = url
+        response.headers['ETag'] = self.etag
+        match = re.match(r'bytes=(\d+)-', headers.get('Range', ''))
+        if match and headers.get('If-Range', self.etag) == self.etag:
+            start = int(match.group(1))
+            if start >= len(self.content):
+                response.status_code = 416
+                response.headers['Content-Range'] = 'bytes */{}'.format(len(self.content))
+                body = b''
+            else:
+                response.status_code = 206
+                response.headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, len(self.content) - 1,
+                                                                             len(self.content))
+                body = self.content[start:]
+        else:
+            response.status_code = 200
+            body = self.content
+        response.headers['Content-Length'] = str(len(body))
+        response.raw = io.BytesIO(body)
+        return response
+
+
+@pytest.fixture
+def file_path(tmpdir):
+    return str(tmpdir.join('book.pdf'))
+
+
+def write_part_file(file_path, data, validator=None):
+    with open(file_path + transfer.PART_FILE_SUFFIX, 'wb') as f:
+        f.write(data)
+    if validator is not None:
+        with open(file_path + transfer.PART_VALIDATOR_SUFFIX, 'w') as f:
+            f.write(validator)
+
+
+def read(file_path):
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def test_download_renames_the_complete_part_file(file_path):
+    server = FakeServer(CONTENT)
+    checksums = Checksums()
+    assert transfer.download_file(server, URL, file_path, checksums=checksums) == len(CONTENT)
+    assert read(file_path) == CONTENT
+    assert not os.path.exists(file_path + transfer.PART_FILE_SUFFIX)
+    assert not os.path.exists(file_path + transfer.PART_VALIDATOR_SUFFIX)
+    assert checksums.sha256 == hash_file(file_path).sha256
+    assert 'Range' not in server.requests[0]
+
+
+def test_part_file_is_resumed_if_the_resource_has_not_changed(file_path):
+    server = FakeServer(CONTENT)
+    write_part_file(file_path, CONTENT[:1000], '"v1"')
+    checksums = Checksums()
+    assert transfer.download_file(server, URL, file_path, checksums=checksums) == len(CONTENT) - 1000
+    assert server.requests[0]['Range'] == 'bytes=1000-'
+    assert server.requests[0]['If-Range'] == '"v1"'
+    assert read(file_path) == CONTENT
+    assert checksums.size == len(CONTENT) and checksums.sha256 == hash_file(file_path).sha256
+
+
+def test_part_file_of_a_changed_resource_is_downloaded_again(file_path):
+    server = FakeServer(CONTENT, etag='"v2"')
+    write_part_file(file_path, b'x' * 1000, '"v1"')
+    assert transfer.download_file(server, URL, file_path) == len(CONTENT)
+    assert server.requests[0]['If-Range'] == '"v1"'
+    assert read(file_path) == CONTENT
+
+
+def test_complete_part_file_is_renamed_on_416(file_path):
+    server = FakeServer(CONTENT)
+    write_part_file(file_path, CONTENT, '"v1"')
+    checksums = Checksums()
+    assert transfer.download_file(server, URL, file_path, checksums=checksums) == 0
+    assert read(file_path) == CONTENT
+    assert checksums.size == len(CONTENT)
+
+
+def test_incomplete_body_keeps_the_part_file_and_its_validator(file_path):
+    server = FakeServer(CONTENT)
+    original_get = server.get
+
+    def truncated_get(*args, **kwargs):
+        response = original_get(*args, **kwargs)
+        response.raw = io.BytesIO(response.raw.read()[:-10])
+        return response
+
+    server.get = truncated_get
+    with pytest.raises(requests.exceptions.RequestException):
+        transfer.download_file(server, URL, file_path)
+    assert not os.path.exists(file_path)
+    assert os.path.getsize(file_path + transfer.PART_FILE_SUFFIX) == len(CONTENT) - 10
+    with open(file_path + transfer.PART_VALIDATOR_SUFFIX) as f:
+        assert f.read() == '"v1"'
@@ -0,0 +1,196 @@
+import io
+import threading
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import transport
+from utils.transport import CircuitBreaker, CircuitOpenError, RetryingHTTPAdapter, RetryPolicy, TokenBucket
+
+URL = 'http://example.com/book'
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(transport.time, 'time', clock.time)
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)# waits for the token after the one reserved by the previous caller
+    clock.now += 1.0
+    assert bucket.reserve() == pytest.approx(0.5)
+
+
+def test_token_bucket_refills_up_to_its_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.reserve()
+    clock.now += 60
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve() > 0
+
+
+def test_paused_token_bucket_holds_back_requests(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    bucket.pause(10)
+    assert bucket.reserve() == pytest.approx(10.5)
+
+
+def test_retry_after_header(clock):
+    assert transport.get_retry_after({'retry-after': '7'}) == 7.0
+    assert transport.get_retry_after({'retry-after': 'Thu, 01 Jan 1970 00:17:00 GMT'}) == pytest.approx(20.0)
+    assert transport.get_retry_after({}) is None
+    assert transport.get_retry_after({'retry-after': 'soon'}) is None
+
+
+def test_only_idempotent_requests_are_retried():
+    policy = RetryPolicy(retries=2, requests_per_second=0)
+    assert policy.after_response(URL, 'GET', 0, 503) is not None
+    assert policy.after_response(URL, 'GET', 2, 503) is None
+    assert policy.after_response(URL, 'POST', 0, 503) is None
+    assert policy.after_response(URL, 'GET', 0, 404) is None
+
+
+def test_server_asked_delay_is_respected_up_to_a_limit():
+    policy = RetryPolicy(retries=2, requests_per_second=0)
+    assert policy.after_response(URL, 'GET', 0, 429, {'retry-after': '3'}) == 3.0
+    assert policy.after_response(URL, 'GET', 0, 503, {'retry-after': str(int(transport.MAX_RETRY_AFTER) + 1)}) is None
+
+
+@pytest.fixture
+def breaker():
+    """Circuit opened by failed requests, its reset timeout has already passed (half-open)"""
+    breaker = CircuitBreaker('example.com')
+    for _ in range(transport.CIRCUIT_FAILURE_THRESHOLD):
+        assert breaker.allow() is False
+        breaker.record(failed=True)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker._opened_at -= transport.CIRCUIT_RESET_TIMEOUT
+    return breaker
+
+
+def test_closed_circuit_lets_requests_through():
+    breaker = CircuitBreaker('example.com')
+    for _ in range(transport.CIRCUIT_FAILURE_THRESHOLD - 1):
+        breaker.record(failed=True)
+    breaker.record(failed=False)
+    breaker.record(failed=True)
+    assert breaker.allow() is False
+
+
+def test_half_open_circuit_lets_a_single_trial_through(breaker):
+    assert breaker.allow() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_other_requests_do_not_end_the_trial(breaker):
+    assert breaker.allow() is True
+    breaker.record(failed=True)# a request sent before the circuit opened
+    breaker.record(failed=False)
+    breaker._opened_at = 0# reopened by the failure above, its timeout has passed as well
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_successful_trial_closes_the_circuit(breaker):
+    assert breaker.allow() is True
+    breaker.record(failed=False, trial=True)
+    assert breaker.allow() is False
+    assert breaker.allow() is False
+
+
+def test_failed_trial_opens_the_circuit_again(breaker):
+    assert breaker.allow() is True
+    breaker.record(failed=True, trial=True)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_released_trial_lets_the_next_one_through(breaker):
+    assert breaker.allow() is True
+    breaker.release()
+    assert breaker.allow() is True
+
+
+class FakeServer(object):
+    """Answers requests by their path, requests to the paths in 'blocked' wait until the path is unblocked"""
+
+    def __init__(self, status_codes):
+        self.status_codes = status_codes
+        self.blocked = {}
+        self.sent = []
+
+    def block(self, path):
+        self.blocked[path] = (threading.Event(), threading.Event())# (request arrived, unblocked)
+
+    def send(self, request, **kwargs):
+        path = request.path_url
+        self.sent.append(path)
+        if path in self.blocked:
+            arrived, unblocked = self.blocked[path]
+            arrived.set()
+            unblocked.wait(5)
+        response = requests.Response()
+        response.status_code = self.status_codes[path]
+        response.url = request.url
+        response.raw = io.BytesIO(b'')
+        return response
+
+
+def test_attempt_ended_without_outcome_does_not_let_a_second_trial_through(monkeypatch):
+    monkeypatch.setattr(transport, 'BACKOFF_BASE', 0.001)
+    server = FakeServer({'/slow': 503, '/failing': 500, '/trial': 200, '/other': 200})
+    monkeypatch.setattr(HTTPAdapter, 'send', lambda self, request, **kwargs: server.send(request, **kwargs))
+    policy = RetryPolicy(retries=1, requests_per_second=0)
+    session = requests.Session()
+    session.mount('http://', RetryingHTTPAdapter(policy))
+
+    def get_in_thread(path, results):
+        def get():
+            try:
+                results.append(session.get('http://example.com' + path).status_code)
+            except CircuitOpenError as e:
+                results.append(e)
+        thread = threading.Thread(target=get)
+        thread.start()
+        return thread
+
+    server.block('/slow')# sent while the circuit is still closed
+    slow_results = []
+    slow = get_in_thread('/slow', slow_results)
+    assert server.blocked['/slow'][0].wait(5)
+    for _ in range(transport.CIRCUIT_FAILURE_THRESHOLD):
+        assert session.get('http://example.com/failing').status_code == 500
+    breaker, _ = policy._RetryPolicy__get_host_state('http://example.com/')
+    breaker._opened_at -= transport.CIRCUIT_RESET_TIMEOUT
+
+    server.block('/trial')
+    trial_results = []
+    trial = get_in_thread('/trial', trial_results)
+    assert server.blocked['/trial'][0].wait(5)
+    server.blocked['/slow'][1].set()# its attempt fails with retries left, so it ends without an outcome
+    slow.join(5)
+    assert isinstance(slow_results[0], CircuitOpenError)
+    with pytest.raises(CircuitOpenError):
+        session.get('http://example.com/other')
+    server.blocked['/trial'][1].set()
+    trial.join(5)
+    assert trial_results == [200]
+    assert '/other' not in server.sent
+    assert session.get('http://example.com/other').status_code == 200